@@ -0,0 +1,55 @@
+"""Measure the memory held by a run's songs and track IDs.
+
+Run from the project root with, for example:
+    python -m benchmarks.bench_memory --lines 1000000
+"""
+import argparse
+import random
+import tracemalloc
+from typing import Callable, List
+from playlist_converter.model import StringTable, TrackIds
+from .fake_spotify import fake_track_id
+
+
+def make_lines(lines: int, artists: int, seed: int = 0) -> List[str]:
+    # Lines as a playlist file holds them, with artists repeating heavily
+    rng = random.Random(seed)
+    return ["Track {}---Artist {}".format(n, rng.randrange(artists))
+            for n in range(lines)]
+
+def plain(lines: List[str], track_ids: List[str]):
+    # Songs as tuples of freshly split strings, and IDs as strings
+    items = [tuple(line.split("---")) for line in lines]
+    return items, list(track_ids)
+
+def compact(lines: List[str], track_ids: List[str]):
+    table = StringTable()
+    items = [table.entry(*line.split("---")) for line in lines]
+    return items, table, TrackIds(track_ids)
+
+def measure(build: Callable, *args) -> int:
+    tracemalloc.start()
+    kept = build(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--lines", type=int, default=1000000)
+    arg_parser.add_argument("--artists", type=int, default=20000)
+    args = arg_parser.parse_args()
+    lines = make_lines(args.lines, args.artists)
+    track_ids = [fake_track_id(str(n)) for n in range(args.lines)]
+    plain_size = measure(plain, lines, track_ids)
+    compact_size = measure(compact, lines, track_ids)
+    print("{} lines, {} artists".format(args.lines, args.artists))
+    for label, size in [("tuples and str IDs", plain_size),
+                        ("interned and packed", compact_size)]:
+        print("{:<20} {:8.1f} MB  {:6.1f} bytes/line".format(
+            label, size / 2 ** 20, size / args.lines))
+
+
+if __name__ == "__main__":
+    main()
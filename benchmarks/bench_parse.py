@@ -0,0 +1,48 @@
+"""Compare parsing a large directory serially and on a process pool.
+
+Run from the project root with, for example:
+    python -m benchmarks.bench_parse --files 20000 --lines 50
+"""
+import argparse
+import os
+import time
+from tempfile import TemporaryDirectory
+from playlist_converter import read_file
+from .bench_run_app import make_playlists
+
+
+def parse_serially(directory: str) -> float:
+    start = time.perf_counter()
+    for playlist in read_file.get_playlists(directory):
+        playlist.playlist_name()
+        playlist.playlist_items("---", "track artist")
+    return time.perf_counter() - start
+
+def parse_on_pool(directory: str, processes: int) -> float:
+    start = time.perf_counter()
+    playlists = read_file.get_playlists(directory)
+    read_file.parse_playlists(playlists, "---", "track artist", processes)
+    for playlist in playlists:
+        playlist.playlist_name()
+        playlist.playlist_items("---", "track artist")
+    return time.perf_counter() - start
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--files", type=int, default=5000)
+    arg_parser.add_argument("--lines", type=int, default=50)
+    arg_parser.add_argument("--processes", type=int,
+                            default=os.cpu_count() or 1)
+    args = arg_parser.parse_args()
+    with TemporaryDirectory() as tempdir:
+        make_playlists(tempdir, args.files, args.lines, 0.4)
+        serial = parse_serially(tempdir)
+        pooled = parse_on_pool(tempdir, args.processes)
+    print("{} files of {} lines".format(args.files, args.lines))
+    print("{:<20} {:8.3f} s".format("serial", serial))
+    print("{:<20} {:8.3f} s  ({} processes, {:.2f}x)".format(
+        "process pool", pooled, args.processes, serial / pooled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Measure the full run_app path against a local fake Spotify API.
+
+Run from the project root with, for example:
+    python -m benchmarks.bench_run_app --size medium --latency 0.02
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where only --trace-memory reports memory
+    resource = None
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from typing import Dict, List
+from unittest import mock
+from playlist_converter import app, client
+from .fake_spotify import FakeSpotifyServer
+
+
+# Number of files and lines per file in each synthetic directory
+SIZES = {
+    "small": (4, 100),
+    "medium": (16, 250),
+    "large": (32, 1000)
+}
+
+def make_playlists(
+        directory: str,
+        files: int,
+        lines: int,
+        duplicate_rate: float,
+        seed: int = 0
+        ) -> int:
+    # Write files of "track---artist" lines, some repeated across files
+    rng = random.Random(seed)
+    artists = ["Artist {}".format(n) for n in range(max(1, lines // 10))]
+    seen = []
+    for file_number in range(files):
+        path = os.path.join(directory, "playlist-{:03d}.txt".format(file_number))
+        with open(path, "w") as f:
+            f.write("Name: Playlist {}\n".format(file_number))
+            for line_number in range(lines):
+                if seen and rng.random() < duplicate_rate:
+                    song = rng.choice(seen)
+                else:
+                    track = "Track {}-{}".format(file_number, line_number)
+                    song = (track, rng.choice(artists))
+                    seen.append(song)
+                f.write("{}---{}\n".format(*song))
+    return files * lines
+
+def write_config(tempdir: str, directory: str, args: argparse.Namespace) -> str:
+    path = os.path.join(tempdir, "config.ini")
+    # Extra accounts each convert their own directory, made alongside
+    accounts = []
+    for number in range(1, args.accounts):
+        accounts += [
+            "[API account{}]".format(number),
+            "user_id = benchmark{}".format(number),
+            "access_token = benchmark-token{}".format(number),
+            "directory_path = {}{}".format(directory, number)]
+    with open(path, "w") as f:
+        f.write("\n".join(accounts + [
+            "[FILE_INFO]",
+            "directory_path = " + directory,
+            "data_order = track artist",
+            "data_delimiter = ---",
+            "[API]",
+            "user_id = benchmark",
+            "access_token = benchmark-token",
+            "[OPTIONS]",
+            "max_workers = {}".format(args.workers),
+            "max_files = {}".format(args.files_at_once),
+            "requests_per_second = 0",
+            "cache_path = " + (os.path.join(tempdir, "cache.db")
+                               if args.cache else ""),
+            "journal_path = " + os.path.join(tempdir, "journal.jsonl"),
+            "sync_state_path = " + os.path.join(tempdir, "sync_state.json"),
+            "saved_index_path = " + (os.path.join(tempdir, "saved.json")
+                                     if args.library_size else ""),
+            ""
+        ]))
+    return path
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def peak_memory_bytes(traced: bool) -> int:
+    # Peak of traced Python allocations, or else the process's peak RSS
+    if traced:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, float]:
+    files, lines = SIZES[args.size]
+    server = FakeSpotifyServer(
+        args.latency, args.error_rate, args.throttle_rate,
+        ambiguous_rate=args.ambiguous_rate, library_size=args.library_size)
+    with TemporaryDirectory() as tempdir, server, server.patch_client():
+        directory = os.path.join(tempdir, "playlists")
+        os.mkdir(directory)
+        tracks = make_playlists(directory, files, lines, args.duplicate_rate)
+        for number in range(1, args.accounts):
+            os.mkdir(directory + str(number))
+            tracks += make_playlists(directory + str(number), files, lines,
+                                     args.duplicate_rate, seed=number)
+        config_path = write_config(tempdir, directory, args)
+        latencies = []
+        send_request = client.send_request
+        def timed_send_request(*send_args, **send_kwargs):
+            start = time.perf_counter()
+            try:
+                return send_request(*send_args, **send_kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        with mock.patch.object(client, "send_request", timed_send_request), \
+                mock.patch.object(app, "get_config_path",
+                                  return_value=config_path), \
+                redirect_stdout(io.StringIO()):
+            if args.trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                app.run_app([])
+            except SystemExit:
+                pass
+            elapsed = time.perf_counter() - start
+            peak_memory = peak_memory_bytes(args.trace_memory)
+        total_requests = sum(server.requests.values())
+        first_add = server.first_seen.get("add_tracks", start + elapsed)
+        return {
+            "tracks": tracks,
+            "seconds": elapsed,
+            "tracks_per_second": tracks / elapsed,
+            "requests": total_requests,
+            "requests_per_track": total_requests / tracks,
+            "first_tracks_added_ms": (first_add - start) * 1000,
+            "p50_latency_ms": percentile(latencies, 0.50) * 1000,
+            "p99_latency_ms": percentile(latencies, 0.99) * 1000,
+            "peak_memory_mb": peak_memory / 2 ** 20,
+            "memory_traced": int(args.trace_memory),
+            "playlists": len(server.playlists),
+            **{"requests_" + name: count
+               for name, count in sorted(server.requests.items())}
+        }
+
+def parse_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--size", choices=SIZES, default="small")
+    arg_parser.add_argument("--latency", type=float, default=0.01,
+                            help="seconds the fake API waits per request")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="share of requests answered with HTTP 500")
+    arg_parser.add_argument("--throttle-rate", type=float, default=0.0,
+                            help="share of requests answered with HTTP 429")
+    arg_parser.add_argument("--duplicate-rate", type=float, default=0.4,
+                            help="share of lines repeating an earlier song")
+    arg_parser.add_argument("--ambiguous-rate", type=float, default=0.2,
+                            help="share of searches finding the song twice")
+    arg_parser.add_argument("--library-size", type=int, default=2000,
+                            help="saved tracks to index, where 0 checks "
+                                 "saved tracks with a request per batch")
+    arg_parser.add_argument("--accounts", type=int, default=1,
+                            help="accounts converting a directory each")
+    arg_parser.add_argument("--workers", type=int,
+                            default=client.DEFAULT_WORKERS)
+    arg_parser.add_argument("--files-at-once", type=int,
+                            default=app.DEFAULT_MAX_FILES)
+    arg_parser.add_argument("--cache", action="store_true",
+                            help="turn on the on-disk search cache")
+    arg_parser.add_argument("--trace-memory", action="store_true",
+                            help="measure peak Python allocations with "
+                                 "tracemalloc, which slows the run down")
+    arg_parser.add_argument("--json", metavar="PATH",
+                            help="also write the results to a JSON file")
+    return arg_parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = run_benchmark(args)
+    for name, value in results.items():
+        if isinstance(value, float):
+            print("{:<24} {:10.2f}".format(name, value))
+        else:
+            print("{:<24} {:10d}".format(name, value))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
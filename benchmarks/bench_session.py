@@ -0,0 +1,42 @@
+"""Compare per-request latency with and without a pooled session.
+
+Run from the project root with:
+    python -m benchmarks.bench_session
+"""
+import statistics
+import time
+from typing import List
+from playlist_converter import client
+from .fake_spotify import FakeSpotifyServer
+
+
+REQUESTS = 300
+
+def time_requests(url: str, session=None) -> List[float]:
+    timings = []
+    request_args = {"url": url, "params": {"q": "foo", "type": "track"}}
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        client.send_request("GET", request_args, session)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def report(label: str, timings: List[float]) -> None:
+    ordered = sorted(timings)
+    p50 = ordered[len(ordered) // 2] * 1000
+    p99 = ordered[int(len(ordered) * 0.99)] * 1000
+    mean = statistics.mean(timings) * 1000
+    print("{:<20} mean {:6.2f} ms  p50 {:6.2f} ms  p99 {:6.2f} ms".format(
+        label, mean, p50, p99))
+
+def main():
+    with FakeSpotifyServer() as server:
+        url = server.api_urls()["SEARCH_URL"]
+        report("new connection", time_requests(url))
+        session = client.make_session(1)
+        report("pooled session", time_requests(url, session))
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Measure startup of a run that finds nothing changed, using -X importtime.
+
+Run from the project root with, for example:
+    python -m benchmarks.bench_startup --files 1000 --runs 10
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+from typing import List, Tuple
+from playlist_converter import cli
+from .bench_run_app import make_playlists
+
+
+CONFIG = """[FILE_INFO]
+directory_path = {directory}
+data_order = track artist
+data_delimiter = ---
+
+[API]
+user_id = bench_user
+access_token = bench_token
+
+[OPTIONS]
+fingerprint_path = {fingerprint}
+"""
+
+def write_config(tempdir: str, directory: str) -> str:
+    path = os.path.join(tempdir, "config.ini")
+    with open(path, "w") as f:
+        f.write(CONFIG.format(
+            directory=directory,
+            fingerprint=os.path.join(tempdir, "fingerprint.txt")))
+    return path
+
+def record_fingerprint(config_path: str) -> None:
+    # As a finished --check run would, so the timed runs find no changes
+    args = cli.parse_args(["--check", "--config", config_path])
+    config = cli.read_check_config(args)
+    cli.save_fingerprint(
+        cli.fingerprint_path(config), cli.directory_fingerprint(config, args))
+
+def import_times(stderr: str) -> List[Tuple[int, str, bool]]:
+    # (cumulative microseconds, module, whether imported at top level)
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times.append((int(cumulative), module.strip(),
+                      not module.startswith("  ")))
+    return times
+
+def time_command(
+        command: List[str],
+        runs: int
+        ) -> Tuple[float, List[Tuple[int, str, bool]]]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        done = subprocess.run(
+            [sys.executable, "-X", "importtime"] + command,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), import_times(done.stderr)
+
+def report(
+        label: str,
+        wall: float,
+        times: List[Tuple[int, str, bool]]
+        ) -> None:
+    imports = sum(cumulative for cumulative, _, top in times if top)
+    loaded = any(module == "requests" for _, module, _ in times)
+    print("{:<24} wall {:7.1f} ms  imports {:7.1f} ms  requests {}".format(
+        label, wall * 1000, imports / 1000,
+        "loaded" if loaded else "not loaded"))
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--files", type=int, default=1000)
+    arg_parser.add_argument("--lines", type=int, default=20)
+    arg_parser.add_argument("--runs", type=int, default=10)
+    args = arg_parser.parse_args()
+    with TemporaryDirectory() as tempdir:
+        directory = os.path.join(tempdir, "playlists")
+        os.mkdir(directory)
+        make_playlists(directory, args.files, args.lines, 0.4)
+        config_path = write_config(tempdir, directory)
+        record_fingerprint(config_path)
+        print("{} files of {} lines, median of {} runs".format(
+            args.files, args.lines, args.runs))
+        report("interpreter", *time_command(["-c", "pass"], args.runs))
+        report("import app", *time_command(
+            ["-c", "import playlist_converter.app"], args.runs))
+        wall, times = time_command(
+            ["-m", "playlist_converter", "--check", "--config", config_path],
+            args.runs)
+        report("--check, no changes", wall, times)
+    print("slowest imports for --check:")
+    top_level = [(cumulative, module)
+                 for cumulative, module, top in times if top]
+    for cumulative, module in sorted(top_level, reverse=True)[:5]:
+        print("  {:<30} {:7.1f} ms".format(module, cumulative / 1000))
+
+
+if __name__ == "__main__":
+    main()
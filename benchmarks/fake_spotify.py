@@ -0,0 +1,254 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import urlparse, parse_qs
+from unittest import mock
+from playlist_converter import client
+
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+VERSIONS = ["{} - Live", "{} - Remastered", "{} (Remix)", "{} - Radio Edit"]
+QUERY_PATTERN = re.compile(r"^(.*) artist:(.*)$")
+PLAYLIST_TRACKS_PATH = re.compile(r"^/v1/playlists/([^/]+)/tracks$")
+PLAYLIST_PATH = re.compile(r"^/v1/playlists/([^/]+)$")
+USER_PLAYLISTS_PATH = re.compile(r"^/v1/users/([^/]+)/playlists$")
+
+def fake_track_id(seed: str) -> str:
+    # Deterministic 22 character base62 ID, shaped like Spotify's
+    number = int.from_bytes(hashlib.sha256(seed.encode()).digest()[:16], "big")
+    chars = []
+    for _ in range(22):
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62[remainder])
+    return "".join(chars)
+
+def hashed_chance(seed: str, rate: float) -> bool:
+    # True for about rate of all seeds, with the same answer for each seed
+    digest = hashlib.sha256(seed.encode()).digest()
+    return digest[0] / 256 < rate
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """Answers Spotify API requests with canned JSON over keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; avoid delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api("GET")
+
+    def do_POST(self):
+        self.handle_api("POST")
+
+    def do_DELETE(self):
+        self.handle_api("DELETE")
+
+    def handle_api(self, method: str) -> None:
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"null")
+        url = urlparse(self.path)
+        endpoint = self.endpoint(method, url.path)
+        with server.lock:
+            server.requests[endpoint] += 1
+            server.first_seen.setdefault(endpoint, time.perf_counter())
+        time.sleep(server.latency)
+        roll = server.random.random()
+        if roll < server.throttle_rate:
+            self.send_json({"error": "rate limited"}, 429,
+                           {"Retry-After": "0"})
+        elif roll < server.throttle_rate + server.error_rate:
+            self.send_json({"error": "server error"}, 500)
+        elif endpoint == "search":
+            self.send_json(self.search(parse_qs(url.query)))
+        elif endpoint == "contains":
+            self.send_json(self.contains(parse_qs(url.query)))
+        elif endpoint == "saved_tracks":
+            self.send_json(self.saved_tracks(parse_qs(url.query)))
+        elif endpoint == "create_playlist":
+            with server.lock:
+                server.playlists.append(body["name"])
+                playlist_id = "playlist{}".format(len(server.playlists))
+            self.send_json({"id": playlist_id}, 201)
+        elif endpoint in ("add_tracks", "remove_tracks"):
+            self.send_json(self.edit_tracks(endpoint, url.path, body), 201)
+        elif endpoint == "playlist_state":
+            self.send_json(self.playlist_state(url.path))
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def endpoint(self, method: str, path: str) -> str:
+        if path == "/v1/search":
+            return "search"
+        if path == "/v1/me/tracks/contains":
+            return "contains"
+        if path == "/v1/me/tracks" and method == "GET":
+            return "saved_tracks"
+        if USER_PLAYLISTS_PATH.match(path) and method == "POST":
+            return "create_playlist"
+        if PLAYLIST_TRACKS_PATH.match(path):
+            return "add_tracks" if method == "POST" else "remove_tracks"
+        if PLAYLIST_PATH.match(path) and method == "GET":
+            return "playlist_state"
+        return "unknown"
+
+    def search(self, params: Dict[str, List[str]]) -> Dict:
+        query = params["q"][0]
+        limit = int(params.get("limit", ["20"])[0])
+        match = QUERY_PATTERN.match(query)
+        track, artist = match.groups() if match else (query, "")
+        if hashed_chance("miss" + query, self.server.miss_rate):
+            return {"tracks": {"items": []}}
+        # The song itself comes first, then other versions of it, unless the
+        # search is ambiguous and the song appears twice, as on an album
+        # and a compilation
+        exact = 2 if hashed_chance("ambiguous" + query,
+                                   self.server.ambiguous_rate) else 1
+        names = lambda n: track if n < exact else VERSIONS[n % 4].format(track)
+        items = [{
+            "id": fake_track_id("{}#{}".format(query, n)),
+            "name": names(n),
+            "artists": [{"name": artist}],
+            "popularity": 80 - n,
+            "duration_ms": 180000 + n * 1000
+        } for n in range(min(limit, self.server.results))]
+        return {"tracks": {"items": items}}
+
+    def edit_tracks(self, endpoint: str, path: str, body: Dict) -> Dict:
+        # Count each playlist's tracks, making a new snapshot per edit
+        playlist_id = PLAYLIST_TRACKS_PATH.match(path).group(1)
+        with self.server.lock:
+            if endpoint == "add_tracks":
+                self.server.playlist_sizes[playlist_id] += len(body["uris"])
+            else:
+                self.server.playlist_sizes[playlist_id] -= len(body["tracks"])
+            self.server.edits += 1
+            edits = self.server.edits
+        return {"snapshot_id": fake_track_id("snapshot#{}".format(edits))}
+
+    def playlist_state(self, path: str) -> Dict:
+        playlist_id = PLAYLIST_PATH.match(path).group(1)
+        with self.server.lock:
+            total = self.server.playlist_sizes[playlist_id]
+            edits = self.server.edits
+        return {"snapshot_id": fake_track_id("snapshot#{}".format(edits)),
+                "tracks": {"total": total}}
+
+    def contains(self, params: Dict[str, List[str]]) -> List[bool]:
+        # Accept both repeated ids parameters and one comma-separated value
+        ids = [tid for value in params.get("ids", [])
+               for tid in value.split(",")]
+        return [hashed_chance("saved" + tid, self.server.saved_rate)
+                for tid in ids]
+
+    def saved_tracks(self, params: Dict[str, List[str]]) -> Dict:
+        # A library of made-up tracks, one saved per day, newest first
+        limit = int(params.get("limit", ["20"])[0])
+        offset = int(params.get("offset", ["0"])[0])
+        total = self.server.library_size
+        items = [{
+            "added_at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime((total - n) * 86400)),
+            "track": {"id": fake_track_id("library#{}".format(n))}
+        } for n in range(offset, min(offset + limit, total))]
+        next_url = self.path if offset + limit < total else None
+        return {"items": items, "total": total, "next": next_url}
+
+    def send_json(
+            self,
+            body: Any,
+            status: int = 200,
+            headers: Dict[str, str] = None
+            ) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        # Keep benchmark output free of per-request access logs
+        pass
+
+
+class FakeSpotifyServer:
+    """Local HTTP server standing in for api.spotify.com."""
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            throttle_rate: float = 0.0,
+            miss_rate: float = 0.05,
+            saved_rate: float = 0.1,
+            ambiguous_rate: float = 0.2,
+            library_size: int = 2000,
+            results: int = 20,
+            seed: int = 0
+        ):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), FakeSpotifyHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.throttle_rate = throttle_rate
+        self.httpd.miss_rate = miss_rate
+        self.httpd.saved_rate = saved_rate
+        self.httpd.ambiguous_rate = ambiguous_rate
+        self.httpd.library_size = library_size
+        self.httpd.results = results
+        self.httpd.random = random.Random(seed)
+        self.httpd.lock = threading.Lock()
+        self.httpd.requests = Counter()
+        # perf_counter time of the first request to each endpoint
+        self.httpd.first_seen = {}
+        self.httpd.playlists = []
+        self.httpd.playlist_sizes = Counter()
+        self.httpd.edits = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def requests(self) -> Counter:
+        return self.httpd.requests
+
+    @property
+    def first_seen(self) -> Dict[str, float]:
+        return self.httpd.first_seen
+
+    @property
+    def playlists(self) -> List[str]:
+        return self.httpd.playlists
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/v1".format(host, port)
+
+    def api_urls(self) -> Dict[str, str]:
+        # Client URL constants rewritten to point at this server
+        real_base = "https://api.spotify.com/v1"
+        names = ["SEARCH_URL", "CONTAINS_URL", "SAVED_TRACKS_URL",
+                 "PLAYLIST_URL", "PLAYLIST_STATE_URL", "ADD_TRACK_URL"]
+        return {name: getattr(client, name).replace(real_base, self.base_url)
+                for name in names}
+
+    def patch_client(self):
+        return mock.patch.multiple(client, **self.api_urls())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,14 +1,55 @@
 import os
+import re
 import sys
+import signal
+import sqlite3
+import argparse
 import configparser
-from typing import Dict, List, Optional
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from queue import Queue
+from threading import Event, Thread
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from requests import RequestException, HTTPError
-from .client import SpotifyClient
-from .read_file import get_playlists, PlaylistFile
+from requests.adapters import HTTPAdapter
+from .auth import TokenProvider
+from .cache import (
+    SearchCache, ResolutionTable, DEFAULT_TTL_DAYS, DEFAULT_MAX_ENTRIES)
+from .cli import config_dir, config_overrides, main, parse_args
+from .client import SpotifyClient, DEFAULT_WORKERS, DEFAULT_TIMEOUT, track_uri
+from .fuzzy import SongIndex
+from .journal import Journal, FileCheckpoint, file_fingerprint
+from .library import SavedLibrary
+from .manifest import (
+    entry_fingerprint, manifest_entry, read_manifest, write_manifest)
+from .metrics import Metrics, Profiler
+from .model import STRINGS
+from .parsers import READ_ERRORS
+from .ranking import DEFAULT_SEARCH_LIMIT, DEFAULT_RANK_MARGIN
+from .scheduler import DEFAULT_RATE, DEFAULT_RETRIES
+from .read_file import (
+    get_playlists, parse_playlists, split_globs, PlaylistFile)
+from .sync import SyncState, content_hash, item_hash, item_hashes
+from .watch import DirectoryWatcher, DEFAULT_WATCH_INTERVAL
 
 
 parser = configparser.ConfigParser
 config_error_msg = "Something went wrong reading your config file...\n"
+directory_error_msg = "Something went wrong reading the directory path...\n"
+DEFAULT_MAX_FILES = 4
+# Files are read while they're converted unless more processes are asked
+# for, as parsing ahead holds every file's songs in memory at once
+DEFAULT_PARSE_PROCESSES = 1
+# Sections like "[API team]" add accounts converting their own directory
+ACCOUNT_SECTION = "API "
+# Files each extra account keeps apart from the others'
+ACCOUNT_PATHS = ["journal_path", "sync_state_path", "saved_index_path",
+                 "token_path"]
+# Appended to a manifest's path to name the journal of applying it
+APPLY_JOURNAL_SUFFIX = ".journal"
+past_tense = {"convert": "Converted", "resolve": "Resolved", "apply": "Made"}
 
 def show_error(message: str) -> None:
     sys.stderr.write("Error: {}\n".format(message))
@@ -19,17 +60,24 @@ def quote_each_word(words: List[str]) -> str:
     quote = lambda word: f"'{word}'"
     return ", ".join([quote(word) for word in words])
 
-def get_config_path() -> Optional[str]:
-    project_root = os.path.dirname(os.path.dirname(__file__))
-    path = os.path.join(project_root, "config", "config.ini")
+def get_config_path(path: Optional[str] = None) -> Optional[str]:
+    # A path given with --config is named in full if it's missing
+    name = path or "config.ini"
+    path = path or os.path.join(config_dir(), "config.ini")
     if not os.path.exists(path):
-        show_error("Required configuration file 'config.ini' not found")
+        show_error("Required configuration file '{}' not found".format(name))
     return path
 
-def read_config(config_path: str) -> parser:
+def read_config(
+        config_path: str,
+        overrides: Optional[Dict[str, Dict[str, str]]] = None
+        ) -> parser:
     config = configparser.ConfigParser()
     with open(config_path, "r") as config_file:
         config.read_file(config_file)
+    # Keys set by --set or environment variables win over the file's
+    if overrides:
+        config.read_dict(overrides)
     return config
 
 def get_config_values(config: parser) -> Optional[Dict[str, str]]:
@@ -46,6 +94,119 @@ def get_config_values(config: parser) -> Optional[Dict[str, str]]:
     else:
         return values
 
+def get_auth_values(config: parser, section: str = "API") -> Dict[str, str]:
+    # Optional keys letting a long run refresh its expired access token
+    return {key: config.get(section, key, fallback="")
+            for key in ["refresh_token", "client_id", "client_secret"]}
+
+def get_accounts(
+        config: parser,
+        values: Dict[str, str]
+        ) -> Optional[List[Dict[str, Any]]]:
+    """Return the [API] account, then one for each "[API name]" section."""
+    accounts = [{
+        "name": "",
+        "user_id": values["user_id"],
+        "access_token": values["access_token"],
+        "directory_path": values["directory_path"],
+        "requests_per_second": None,
+        **get_auth_values(config)
+    }]
+    sections = [section for section in config.sections()
+                if section.startswith(ACCOUNT_SECTION)]
+    try:
+        for section in sections:
+            account = {
+                "name": section[len(ACCOUNT_SECTION):].strip(),
+                "user_id": config.get(section, "user_id"),
+                "access_token": config.get(section, "access_token"),
+                "directory_path": config.get(section, "directory_path")
+            }
+            check_empty(account)
+            # Each account has its own rate budget, if it's given one
+            account["requests_per_second"] = config.getfloat(
+                section, "requests_per_second", fallback=None)
+            account.update(get_auth_values(config, section))
+            accounts.append(account)
+    except (configparser.Error, ValueError) as error:
+        show_error(config_error_msg + str(error))
+    else:
+        return accounts
+
+def account_options(
+        options: Dict[str, Any],
+        account: Dict[str, Any]
+        ) -> Dict[str, Any]:
+    # Options for an extra account, whose progress, sync state, saved
+    # tracks and token files get its name, like "sync_state-team.json"
+    if not account["name"]:
+        return options
+    values = dict(options)
+    suffix = re.sub(r"[^\w.-]", "_", account["name"])
+    for key in ACCOUNT_PATHS:
+        if values[key]:
+            root, extension = os.path.splitext(values[key])
+            values[key] = "{}-{}{}".format(root, suffix, extension)
+    if account["requests_per_second"] is not None:
+        values["requests_per_second"] = account["requests_per_second"]
+    return values
+
+def get_option_values(config: parser) -> Optional[Dict[str, Any]]:
+    # Optional tuning keys, falling back to defaults when they're missing
+    default_cache = os.path.join(config_dir(), "search_cache.db")
+    default_journal = os.path.join(config_dir(), "journal.jsonl")
+    default_sync_state = os.path.join(config_dir(), "sync_state.json")
+    default_saved_index = os.path.join(config_dir(), "saved_tracks.json")
+    default_token = os.path.join(config_dir(), "token.json")
+    try:
+        values = {
+            "max_workers": config.getint(
+                "OPTIONS", "max_workers", fallback=DEFAULT_WORKERS),
+            "max_files": config.getint(
+                "OPTIONS", "max_files", fallback=DEFAULT_MAX_FILES),
+            "parse_processes": config.getint(
+                "OPTIONS", "parse_processes",
+                fallback=DEFAULT_PARSE_PROCESSES),
+            "pool_size": config.getint(
+                "OPTIONS", "pool_size", fallback=None),
+            "timeout": config.getfloat(
+                "OPTIONS", "timeout", fallback=DEFAULT_TIMEOUT),
+            "requests_per_second": config.getfloat(
+                "OPTIONS", "requests_per_second", fallback=DEFAULT_RATE),
+            "max_retries": config.getint(
+                "OPTIONS", "max_retries", fallback=DEFAULT_RETRIES),
+            "watch_interval": config.getfloat(
+                "OPTIONS", "watch_interval", fallback=DEFAULT_WATCH_INTERVAL),
+            "search_limit": config.getint(
+                "OPTIONS", "search_limit", fallback=DEFAULT_SEARCH_LIMIT),
+            "rank_margin": config.getfloat(
+                "OPTIONS", "rank_margin", fallback=DEFAULT_RANK_MARGIN),
+            "dedupe_tracks": config.getboolean(
+                "OPTIONS", "dedupe_tracks", fallback=False),
+            "cache_path": config.get(
+                "OPTIONS", "cache_path", fallback=default_cache),
+            "cache_ttl_days": config.getint(
+                "OPTIONS", "cache_ttl_days", fallback=DEFAULT_TTL_DAYS),
+            "cache_max_entries": config.getint(
+                "OPTIONS", "cache_max_entries", fallback=DEFAULT_MAX_ENTRIES),
+            "journal_path": config.get(
+                "OPTIONS", "journal_path", fallback=default_journal),
+            "sync_state_path": config.get(
+                "OPTIONS", "sync_state_path", fallback=default_sync_state),
+            "saved_index_path": config.get(
+                "OPTIONS", "saved_index_path", fallback=default_saved_index),
+            "token_path": config.get(
+                "OPTIONS", "token_path", fallback=default_token),
+            "include_globs": split_globs(config.get(
+                "OPTIONS", "include_globs", fallback="")),
+            "exclude_globs": split_globs(config.get(
+                "OPTIONS", "exclude_globs", fallback=""))
+        }
+    except ValueError as error:
+        show_error(config_error_msg + str(error))
+    else:
+        return values
+
 def check_empty(mapping: Dict[str, str]) -> None:
     empty_keys = [key for key in mapping if not mapping[key]]
     if empty_keys:
@@ -60,42 +221,657 @@ def check_data_order(data_order: str) -> None:
         custom_msg = "Key 'data_order' must equal one of {}".format(quoted)
         show_error(config_error_msg + custom_msg)
 
-def get_playlist_files(dir_path: str) -> Optional[List[PlaylistFile]]:
+def get_playlist_files(
+        dir_path: str,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        unchanged: Optional[Dict[str, List[float]]] = None
+        ) -> Optional[List[PlaylistFile]]:
     try:
-        playlist_files = get_playlists(dir_path)
+        playlist_files = get_playlists(
+            dir_path, include, exclude or (), unchanged)
     except (NotADirectoryError, FileNotFoundError) as error:
-        custom_msg = "Something went wrong reading the directory path...\n"
-        show_error(custom_msg + str(error))
+        show_error(directory_error_msg + str(error))
     else:
         return playlist_files
 
+def open_search_cache(options: Dict[str, Any]) -> Optional[SearchCache]:
+    # An empty cache_path turns the search cache off
+    if not options["cache_path"]:
+        return None
+    try:
+        return SearchCache(
+            options["cache_path"],
+            options["cache_ttl_days"],
+            options["cache_max_entries"])
+    except sqlite3.Error as error:
+        custom_msg = "Something went wrong opening the search cache...\n"
+        show_error(custom_msg + str(error))
+
+def open_saved_library(options: Dict[str, Any]) -> Optional[SavedLibrary]:
+    # An empty saved_index_path checks saved tracks with a request per batch
+    if not options["saved_index_path"]:
+        return None
+    library = SavedLibrary(options["saved_index_path"])
+    try:
+        library.load()
+    except (OSError, ValueError, KeyError) as error:
+        custom_msg = "Something went wrong reading the saved tracks index...\n"
+        show_error(custom_msg + str(error))
+    else:
+        return library
+
+def open_token_provider(
+        access_token: str,
+        auth: Dict[str, str],
+        options: Dict[str, Any]
+        ) -> Optional[TokenProvider]:
+    tokens = TokenProvider(
+        access_token, auth["refresh_token"], auth["client_id"],
+        auth["client_secret"], options["token_path"], options["timeout"])
+    try:
+        # A refresh token Spotify issued since replaces the configured one
+        tokens.load()
+    except (OSError, ValueError, KeyError) as error:
+        custom_msg = "Something went wrong reading the token file...\n"
+        show_error(custom_msg + str(error))
+    else:
+        return tokens
+
+def open_journal(journal_path: str, resume: bool) -> Optional[Journal]:
+    # Without resume, progress left by an earlier run is thrown away
+    journal = Journal(journal_path)
+    try:
+        if resume:
+            journal.load()
+        else:
+            journal.reset()
+    except OSError as error:
+        custom_msg = "Something went wrong reading the progress journal...\n"
+        show_error(custom_msg + str(error))
+    else:
+        return journal
+
+def open_sync_state(sync_state_path: str) -> Optional[SyncState]:
+    # An empty sync_state_path stops playlists being recorded for --sync
+    if not sync_state_path:
+        return None
+    sync_state = SyncState(sync_state_path)
+    try:
+        sync_state.load()
+    except (OSError, ValueError) as error:
+        custom_msg = "Something went wrong reading the sync state...\n"
+        show_error(custom_msg + str(error))
+    else:
+        return sync_state
+
+def record_items(
+        items: Iterator[Tuple[str, str]],
+        recorded: array
+        ) -> Iterator[Tuple[str, str]]:
+    # Pass items through while keeping each one's hash for the sync state,
+    # rather than its text, so large files are recorded in 8 bytes a line
+    for item in items:
+        recorded.append(item_hash(item))
+        yield item
+
+def convert_file(
+        file: PlaylistFile,
+        client: SpotifyClient,
+        delimiter: str,
+        order: str,
+        journal: Optional[Journal] = None,
+        sync_state: Optional[SyncState] = None,
+        sync: bool = False
+        ) -> None:
+    record = None
+    if sync_state is not None:
+        # Taken before reading, so edits made meanwhile are synced next time
+        fingerprint = file_fingerprint(file.path)
+        file_hash = content_hash(file.path)
+        if sync:
+            record = sync_state.get(file.path)
+        if record is not None and record["hash"] == file_hash:
+            # Only touched, so the new fingerprint lets the next scan skip it
+            sync_state.set(file.path, file_hash, record["playlist_id"],
+                           record["item_hashes"], record["track_ids"],
+                           fingerprint)
+            return
+    name = file.playlist_name()
+    if record is not None and record["playlist_id"]:
+        # Changed file whose playlist already exists: only apply the diff
+        items = file.playlist_items(delimiter, order)
+        playlist_id = record["playlist_id"]
+        def record_partial(hashes: List[int], track_ids: List) -> None:
+            # The playlist was only edited partway, so its lines are
+            # recorded without a file hash for the next sync to diff against
+            sync_state.set(file.path, "", playlist_id, hashes, track_ids)
+        track_ids = client.sync_playlist(
+            playlist_id, record["item_hashes"], record["track_ids"], items,
+            record_partial)
+        hashes = item_hashes(items)
+    else:
+        # Songs are read lazily, so lookups start as soon as lines arrive
+        hashes = array("Q")
+        stream = file.iter_items(delimiter, order)
+        if sync_state is not None:
+            stream = record_items(stream, hashes)
+        checkpoint = (journal.checkpoint(file.path) if journal
+                      else FileCheckpoint())
+        client.make_playlist_with_tracks(name, stream, checkpoint)
+        # A file finished by an earlier run isn't read, but is still recorded
+        for _ in stream:
+            pass
+        playlist_id, track_ids = checkpoint.playlist_id, checkpoint.track_ids
+    if sync_state is not None:
+        sync_state.set(file.path, file_hash, playlist_id, hashes, track_ids,
+                       fingerprint)
+
+def conversion_error(convert: Callable[[], Any]) -> Optional[str]:
+    # Return why convert() failed, or None if it didn't
+    try:
+        convert()
+    except HTTPError as error:
+        return "Failed due to an HTTP error\n" + str(error)
+    except RequestException as error:
+        return "A request exception occurred...\n" + str(error)
+    except READ_ERRORS as error:
+        return "Something went wrong reading the file...\n" + str(error)
+    return None
+
+def run_concurrently(
+        tasks: List[Tuple[str, Callable[[], Any]]],
+        max_files: int
+        ) -> List[Tuple[str, Optional[str]]]:
+    # Run each named task on a pool, pairing each name with its error
+    run = lambda task: (task[0], conversion_error(task[1]))
+    with ThreadPoolExecutor(max_workers=max(1, max_files)) as executor:
+        return list(executor.map(run, tasks))
+
 def convert_files(
         playlist_files: List[PlaylistFile],
         client: SpotifyClient,
         delimiter: str,
+        order: str,
+        journal: Optional[Journal] = None,
+        sync_state: Optional[SyncState] = None,
+        sync: bool = False,
+        max_files: int = 1
+        ) -> List[Tuple[str, Optional[str]]]:
+    """Convert several files at once, pairing each filename with its error."""
+    # All files share the client, and so its limit on requests in flight
+    tasks = [(file.filename, partial(
+        convert_file, file, client, delimiter, order, journal, sync_state,
+        sync)) for file in playlist_files]
+    return run_concurrently(tasks, max_files)
+
+def resolve_file(
+        file: PlaylistFile,
+        client: SpotifyClient,
+        delimiter: str,
         order: str
+        ) -> Dict[str, Any]:
+    items = file.playlist_items(delimiter, order)
+    track_ids = list(client.get_track_ids(items))
+    return manifest_entry(file.path, file.playlist_name(), items, track_ids)
+
+def resolve_files(
+        playlist_files: List[PlaylistFile],
+        client: SpotifyClient,
+        delimiter: str,
+        order: str,
+        max_files: int = 1
+        ) -> Tuple[List[Tuple[str, Optional[str]]], List[Dict[str, Any]]]:
+    """Look up every file's songs without changing any playlists."""
+    entries = [None] * len(playlist_files)
+    def resolve(index: int, file: PlaylistFile) -> None:
+        entries[index] = resolve_file(file, client, delimiter, order)
+    tasks = [(file.filename, partial(resolve, index, file))
+             for index, file in enumerate(playlist_files)]
+    results = run_concurrently(tasks, max_files)
+    return results, [entry for entry in entries if entry is not None]
+
+def apply_entry(
+        entry: Dict[str, Any],
+        client: SpotifyClient,
+        checkpoint: Optional[FileCheckpoint] = None
         ) -> None:
-    for file in playlist_files:
-        name = file.playlist_name()
-        items = file.playlist_items(delimiter, order)
-        try:
-            client.make_playlist_with_tracks(name, items)
-        except HTTPError:
-            show_error("Failed due to an HTTP error")
-        except RequestException as error:
-            custom_msg = "A request exception occurred...\n"
-            show_error(custom_msg + str(error))
-
-def run_app():
-    config_path = get_config_path()
-    config = get_config_values(read_config(config_path))
-    check_empty(config)
-    check_data_order(config["data_order"])
-    files = get_playlist_files(config["directory_path"])
-    sp_client = SpotifyClient(config["access_token"], config["user_id"])
+    # Make a playlist from a manifest entry, without searching for songs,
+    # skipping the playlist or batches an earlier run already made
+    if checkpoint is None:
+        checkpoint = FileCheckpoint()
+    if checkpoint.done or not entry["track_ids"]:
+        return
+    if checkpoint.playlist_id is None:
+        checkpoint.set_playlist(client.create_playlist(entry["playlist"]))
+    track_uris = [track_uri(tid) for tid in entry["track_ids"]]
+    found = len(set(track_uris)) if client.dedupe else len(track_uris)
+    posted = client.tracks_posted(checkpoint, found)
+    client.add_playlist_tracks(
+        checkpoint.playlist_id, track_uris, posted, checkpoint.add_batch)
+    checkpoint.finish()
+
+def apply_manifest(
+        entries: List[Dict[str, Any]],
+        client: SpotifyClient,
+        max_files: int = 1,
+        journal: Optional[Journal] = None
+        ) -> List[Tuple[str, Optional[str]]]:
+    """Make the playlists listed in a manifest, pairing each with its error."""
+    tasks = []
+    for entry in entries:
+        # An entry edited in the manifest starts over
+        checkpoint = (journal.checkpoint(entry["file"],
+                                         entry_fingerprint(entry))
+                      if journal else FileCheckpoint())
+        tasks.append((os.path.basename(entry["file"]),
+                      partial(apply_entry, entry, client, checkpoint)))
+    return run_concurrently(tasks, max_files)
+
+def apply_manifest_file(
+        manifest_path: str,
+        entries: List[Dict[str, Any]],
+        client: SpotifyClient,
+        max_files: int = 1
+        ) -> List[Tuple[str, Optional[str]]]:
+    """Make a manifest's playlists, skipping those an earlier run made."""
+    # Progress is kept beside the manifest rather than in the conversion
+    # journal, which later runs clear, and is never thrown away, so
+    # applying the manifest again only makes what wasn't finished
+    journal = open_journal(manifest_path + APPLY_JOURNAL_SUFFIX, True)
+    try:
+        return apply_manifest(entries, client, max_files, journal)
+    finally:
+        journal.close()
+
+def load_manifest(manifest_path: str) -> Optional[List[Dict[str, Any]]]:
+    try:
+        entries = read_manifest(manifest_path)
+    except (OSError, ValueError) as error:
+        custom_msg = "Something went wrong reading the manifest...\n"
+        show_error(custom_msg + str(error))
+    else:
+        return entries
+
+def save_manifest(manifest_path: str, entries: List[Dict[str, Any]]) -> None:
+    try:
+        write_manifest(manifest_path, entries)
+    except OSError as error:
+        custom_msg = "Something went wrong writing the manifest...\n"
+        show_error(custom_msg + str(error))
+
+def show_result(
+        filename: str,
+        error: Optional[str],
+        action: str = "convert"
+        ) -> None:
+    if error is None:
+        sys.stdout.write("{} '{}'\n".format(past_tense[action], filename))
+    else:
+        sys.stdout.write("Failed to {} '{}': {}\n".format(
+            action, filename, error))
+    sys.stdout.flush()
+
+def show_summary(
+        results: List[Tuple[str, Optional[str]]],
+        action: str = "convert"
+        ) -> None:
+    for filename, error in results:
+        show_result(filename, error, action)
+    failed = [filename for filename, error in results if error is not None]
+    if failed:
+        show_error("{} of {} file(s) failed to {}".format(
+            len(failed), len(results), action))
+
+def record_counters(metrics: Metrics, client: SpotifyClient) -> None:
+    # Counts of each account's client are added together
+    counters = {"token_refreshes": client.tokens.refreshes}
+    for tier, lines in client.tiers.items():
+        counters["lines_" + tier] = lines
+    with metrics.lock:
+        for name, value in counters.items():
+            metrics.counters[name] = metrics.counters.get(name, 0) + value
+
+def record_shared_counters(
+        metrics: Metrics,
+        resolutions: ResolutionTable,
+        songs: SongIndex,
+        cache: Optional[SearchCache]
+        ) -> None:
+    # Counts of what every account's client shares
+    metrics.counters["repeated_songs"] = resolutions.hits
+    metrics.counters["unique_songs"] = resolutions.misses
+    metrics.counters["song_index_size"] = len(songs)
+    if cache is not None:
+        metrics.counters["search_cache_hits"] = cache.hits
+        metrics.counters["search_cache_misses"] = cache.misses
+
+def convert_playlist_files(
+        args: argparse.Namespace,
+        options: Dict[str, Any],
+        files: List[PlaylistFile],
+        client: SpotifyClient,
+        delimiter: str,
+        order: str,
+        metrics: Metrics,
+        journal: Optional[Journal] = None,
+        sync_state: Optional[SyncState] = None
+        ) -> List[Tuple[str, Optional[str]]]:
+    if journal is None:
+        journal = open_journal(options["journal_path"], args.resume)
+    # Playlists made on every run are recorded so --sync can update them
+    if sync_state is None:
+        sync_state = open_sync_state(options["sync_state_path"])
+    try:
+        with metrics.phase("convert"):
+            results = convert_files(
+                files, client, delimiter, order, journal, sync_state,
+                args.sync, options["max_files"])
+    finally:
+        with metrics.phase("save_state"):
+            journal.close()
+            if sync_state is not None:
+                sync_state.save()
+    if all(error is None for _, error in results):
+        # Every file was converted, so there's nothing left to resume
+        journal.reset()
+    return results
+
+def watch_directory(
+        config: Dict[str, str],
+        options: Dict[str, Any],
+        client: SpotifyClient,
+        sync_state: SyncState,
+        stop: Event
+        ) -> None:
+    """Sync files as they're created or changed, until stop is set."""
+    delimiter, order = config["data_delimiter"], config["data_order"]
+    # Files synced by earlier runs are only converted once they change
+    watcher = DirectoryWatcher(
+        config["directory_path"], options["include_globs"],
+        options["exclude_globs"], sync_state.fingerprints())
+    max_files = max(1, options["max_files"])
+    # Bounded, so a burst of changes waits for workers instead of piling up
+    work = Queue(maxsize=2 * max_files)
+    # Paths queued or converting, which mustn't be converted twice at once
+    busy = set()
+
+    def convert_queued() -> None:
+        while True:
+            file = work.get()
+            if file is None:
+                return
+            error = conversion_error(partial(
+                convert_file, file, client, delimiter, order, None,
+                sync_state, True))
+            # Failed files are tried again once they change
+            show_result(file.filename, error)
+            try:
+                sync_state.save()
+            except OSError as save_error:
+                show_result(file.filename, "Something went wrong saving "
+                            "the sync state...\n" + str(save_error))
+            busy.discard(file.path)
+
+    workers = [Thread(target=convert_queued) for _ in range(max_files)]
+    for worker in workers:
+        worker.start()
+    # Whether files were queued since songs looked up were last forgotten
+    queued = False
+    try:
+        while not stop.is_set():
+            if queued and not busy:
+                # Each batch of changes starts afresh, so a long watch
+                # sees songs and saved tracks added since and its tables
+                # only grow with the files of one batch
+                client.forget_lookups()
+                STRINGS.clear()
+                queued = False
+            try:
+                changed = watcher.poll()
+            except OSError as error:
+                # The directory may only be gone for a moment, like a mount
+                sys.stderr.write("Error: {}{}\n".format(
+                    directory_error_msg, error))
+                sys.stderr.flush()
+                changed = []
+            for file in changed:
+                if file.path in busy:
+                    # Still converting an earlier version, so it's taken
+                    # again on a later poll
+                    watcher.forget(file.path)
+                    continue
+                busy.add(file.path)
+                queued = True
+                work.put(file)
+            stop.wait(options["watch_interval"])
+    finally:
+        # Files already queued are finished before stopping
+        for _ in workers:
+            work.put(None)
+        for worker in workers:
+            worker.join()
+
+def stop_on_terminate(stop: Event) -> None:
+    # Services are stopped with SIGTERM, and Ctrl+C sends SIGINT
+    handler = lambda signum, frame: stop.set()
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+def find_playlist_files(
+        args: argparse.Namespace,
+        directory_path: str,
+        options: Dict[str, Any],
+        delimiter: str,
+        order: str,
+        metrics: Metrics
+        ) -> Optional[List[PlaylistFile]]:
+    unchanged = None
+    if args.sync and not args.resolve_only:
+        # Files with the size and mtime of the last run aren't even read
+        sync_state = open_sync_state(options["sync_state_path"])
+        unchanged = sync_state.fingerprints()
+    with metrics.phase("scan_directory"):
+        files = get_playlist_files(
+            directory_path, options["include_globs"],
+            options["exclude_globs"], unchanged)
+    with metrics.phase("parse"):
+        # Only pays off for very large directories, so small ones are
+        # still read lazily while converting
+        parse_playlists(files, delimiter, order, options["parse_processes"])
+    return files
+
+def open_client(
+        account: Dict[str, Any],
+        options: Dict[str, Any],
+        cache: Optional[SearchCache],
+        metrics: Metrics,
+        shared: Optional[Dict[str, Any]] = None
+        ) -> SpotifyClient:
+    # Client for one account, which may share connections and songs looked
+    # up with other accounts' clients
+    return SpotifyClient(
+        account["access_token"], account["user_id"], options["max_workers"],
+        cache, options["pool_size"], options["timeout"],
+        options["requests_per_second"], options["max_retries"], metrics,
+        options["search_limit"], options["rank_margin"],
+        open_saved_library(options),
+        open_token_provider(account["access_token"], account, options),
+        options["dedupe_tracks"], **(shared or {}))
+
+def open_account(
+        args: argparse.Namespace,
+        account: Dict[str, Any],
+        config: Dict[str, str],
+        options: Dict[str, Any],
+        cache: Optional[SearchCache],
+        shared: Dict[str, Any],
+        metrics: Metrics
+        ) -> Dict[str, Any]:
+    """Find one account's files and open everything converting them needs."""
+    options = account_options(options, account)
+    files = find_playlist_files(
+        args, account["directory_path"], options, config["data_delimiter"],
+        config["data_order"], metrics)
+    return {
+        "account": account,
+        "options": options,
+        "files": files,
+        "client": open_client(account, options, cache, metrics, shared),
+        "journal": open_journal(options["journal_path"], args.resume),
+        "sync_state": open_sync_state(options["sync_state_path"])
+    }
+
+def convert_account(
+        args: argparse.Namespace,
+        opened: Dict[str, Any],
+        config: Dict[str, str],
+        metrics: Metrics
+        ) -> List[Tuple[str, Optional[str]]]:
+    """Convert one account's directory, labelling files with its name."""
+    account, sp_client = opened["account"], opened["client"]
+    try:
+        results = convert_playlist_files(
+            args, opened["options"], opened["files"], sp_client,
+            config["data_delimiter"], config["data_order"], metrics,
+            opened["journal"], opened["sync_state"])
+    finally:
+        record_counters(metrics, sp_client)
+        sp_client.close()
+    if not account["name"]:
+        return results
+    return [("{}: {}".format(account["name"], filename), error)
+            for filename, error in results]
+
+def convert_accounts(
+        args: argparse.Namespace,
+        accounts: List[Dict[str, Any]],
+        config: Dict[str, str],
+        options: Dict[str, Any],
+        cache: Optional[SearchCache],
+        metrics: Metrics
+        ) -> List[Tuple[str, Optional[str]]]:
+    """Convert every account's directory at once in this process."""
+    # Accounts share a connection pool and the songs looked up by any of
+    # them, but each has its own token, rate limit and saved tracks
+    pool_size = (options["pool_size"] or options["max_workers"]) * \
+        len(accounts)
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    shared = {"adapter": adapter, "resolutions": ResolutionTable(),
+              "songs": SongIndex()}
+    convert = lambda opened: convert_account(args, opened, config, metrics)
+    try:
+        # Every account is set up before any is converted, so a missing
+        # directory or unreadable file stops the run before it changes
+        # anything, instead of ending it midway from a worker thread
+        opened = [open_account(args, account, config, options, cache,
+                               shared, metrics)
+                  for account in accounts]
+        with ThreadPoolExecutor(max_workers=len(accounts)) as executor:
+            results = list(executor.map(convert, opened))
+    finally:
+        adapter.close()
+        record_shared_counters(
+            metrics, shared["resolutions"], shared["songs"], cache)
+    return [result for account_results in results
+            for result in account_results]
+
+def convert_directory(args: argparse.Namespace, metrics: Metrics) -> None:
+    with metrics.phase("load_config"):
+        config_path = get_config_path(args.config)
+        parsed_config = read_config(config_path, config_overrides(args))
+        config = get_config_values(parsed_config)
+        check_empty(config)
+        check_data_order(config["data_order"])
+        options = get_option_values(parsed_config)
+        accounts = get_accounts(parsed_config, config)
     delimiter, data_order = config["data_delimiter"], config["data_order"]
-    convert_files(files, sp_client, delimiter, data_order)
+    if (args.sync or args.watch) and not options["sync_state_path"]:
+        show_error(config_error_msg + "--sync and --watch need a "
+                   "'sync_state_path' to record playlists in")
+    if len(accounts) > 1:
+        if args.watch or args.apply or args.resolve_only:
+            show_error("--watch, --resolve-only and --apply only work "
+                       "with the [API] account")
+        cache = open_search_cache(options)
+        try:
+            results = convert_accounts(
+                args, accounts, config, options, cache, metrics)
+        finally:
+            if cache is not None:
+                cache.close()
+        show_summary(results)
+        return
+    entries = load_manifest(args.apply) if args.apply else None
+    files = None
+    if args.watch:
+        # Files are found as the directory is watched, so only check it
+        if not os.path.isdir(config["directory_path"]):
+            show_error(directory_error_msg + '"{}" is not a directory.'.format(
+                config["directory_path"]))
+    elif entries is None:
+        files = find_playlist_files(
+            args, config["directory_path"], options, delimiter, data_order,
+            metrics)
+    cache = open_search_cache(options)
+    sp_client = open_client(accounts[0], options, cache, metrics)
+    action = "convert"
+    results = []
+    try:
+        if args.watch:
+            # One client serves every change, keeping its session and
+            # resolved songs warm between them
+            stop = Event()
+            stop_on_terminate(stop)
+            with metrics.phase("watch"):
+                watch_directory(
+                    config, options, sp_client,
+                    open_sync_state(options["sync_state_path"]), stop)
+        elif entries is not None:
+            action = "apply"
+            with metrics.phase("apply"):
+                results = apply_manifest_file(
+                    args.apply, entries, sp_client, options["max_files"])
+        elif args.resolve_only:
+            action = "resolve"
+            with metrics.phase("resolve"):
+                results, entries = resolve_files(
+                    files, sp_client, delimiter, data_order,
+                    options["max_files"])
+            save_manifest(args.resolve_only, entries)
+        else:
+            results = convert_playlist_files(
+                args, options, files, sp_client, delimiter, data_order,
+                metrics)
+    finally:
+        record_counters(metrics, sp_client)
+        record_shared_counters(
+            metrics, sp_client.resolutions, sp_client.songs, cache)
+        sp_client.close()
+        if cache is not None:
+            cache.close()
+    show_summary(results, action)
 
+def run_app(
+        argv: Optional[List[str]] = None,
+        args: Optional[argparse.Namespace] = None
+        ):
+    if args is None:
+        args = parse_args(argv)
+    metrics = Metrics()
+    profiler = Profiler() if args.profile else None
+    try:
+        with ExitStack() as stack:
+            if profiler is not None:
+                stack.enter_context(profiler.profile())
+            with metrics.phase("total"):
+                convert_directory(args, metrics)
+    finally:
+        # Reports are written even when the run stops with an error
+        if args.metrics:
+            metrics.write(args.metrics)
+        if profiler is not None:
+            profiler.write(args.profile)
 
 if __name__ == "__main__":
-    run_app()
+    main()
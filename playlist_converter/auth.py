@@ -0,0 +1,87 @@
+import json
+import os
+from threading import Lock
+from typing import Callable, Union
+import requests
+
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+class TokenProvider:
+    """Access token for API requests, refreshed when Spotify rejects it."""
+
+    def __init__(
+            self,
+            access_token: str,
+            refresh_token: str = "",
+            client_id: str = "",
+            client_secret: str = "",
+            path: Union[str, None] = None,
+            timeout: Union[float, None] = None
+        ):
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        # File keeping the refresh token Spotify last issued, which may
+        # replace the one in the configuration file
+        self.path = path
+        self.timeout = timeout
+        self.refreshes = 0
+        # Held while refreshing, so requests wait for the new token
+        self.lock = Lock()
+
+    def can_refresh(self) -> bool:
+        return bool(self.refresh_token and self.client_id)
+
+    def load(self) -> None:
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, "r") as token_file:
+                self.refresh_token = json.load(token_file)["refresh_token"]
+
+    def current(self) -> str:
+        """Return the access token, waiting if it's being refreshed."""
+        with self.lock:
+            return self.access_token
+
+    def refresh(
+            self,
+            rejected_token: str,
+            on_refresh: Union[Callable[[str], None], None] = None
+            ) -> str:
+        """Replace a rejected access token once, returning the new token."""
+        # on_refresh gets the new token before any waiting request resumes
+        with self.lock:
+            # Requests rejected together share the first one's refresh
+            if self.access_token != rejected_token:
+                return self.access_token
+            data = {"grant_type": "refresh_token",
+                    "refresh_token": self.refresh_token}
+            # Apps without a client secret identify themselves in the body
+            auth = None
+            if self.client_secret:
+                auth = (self.client_id, self.client_secret)
+            else:
+                data["client_id"] = self.client_id
+            response = requests.post(
+                TOKEN_URL, data=data, auth=auth, timeout=self.timeout)
+            response.raise_for_status()
+            response_json = response.json()
+            self.access_token = response_json["access_token"]
+            self.refreshes += 1
+            if on_refresh is not None:
+                on_refresh(self.access_token)
+            new_refresh_token = response_json.get("refresh_token")
+            if new_refresh_token and new_refresh_token != self.refresh_token:
+                self.refresh_token = new_refresh_token
+                self.save()
+            return self.access_token
+
+    def save(self) -> None:
+        # Write to a temporary file first so a crash can't lose the token
+        if self.path is None:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as token_file:
+            json.dump({"refresh_token": self.refresh_token}, token_file)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,155 @@
+import json
+import re
+import sqlite3
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable, List, Tuple, Union
+
+
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 100000
+SECONDS_PER_DAY = 24 * 60 * 60
+FEATURING = re.compile(r"\b(?:featuring|feat|ft)\b\.?")
+PUNCTUATION = re.compile(r"[()\[\].,]")
+
+class SearchCache:
+    """Persistent map of normalized (track, artist) pairs to search results."""
+
+    def __init__(
+            self,
+            path: str,
+            ttl_days: int = DEFAULT_TTL_DAYS,
+            max_entries: int = DEFAULT_MAX_ENTRIES
+        ):
+        self.path = path
+        self.ttl = ttl_days * SECONDS_PER_DAY
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Worker threads share one connection, so access is serialized
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "key TEXT PRIMARY KEY, "
+                "track_ids TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, "
+                "lead REAL NOT NULL DEFAULT 0)")
+            columns = [row[1] for row in self.connection.execute(
+                "PRAGMA table_info(searches)")]
+            if "lead" not in columns:
+                # Results cached before they were ranked lead by nothing
+                self.connection.execute(
+                    "ALTER TABLE searches "
+                    "ADD COLUMN lead REAL NOT NULL DEFAULT 0")
+        self.evict()
+
+    def get(
+            self,
+            track: str,
+            artist: str
+        ) -> Union[Tuple[List[str], float], None]:
+        """Return a song's cached track IDs and lead, or None if not cached."""
+        # An empty list is a cached negative result: the search found nothing
+        key = normalize_key(track, artist)
+        oldest_allowed = time.time() - self.ttl
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT track_ids, lead FROM searches "
+                "WHERE key = ? AND stored_at >= ?",
+                (key, oldest_allowed)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def put(
+            self,
+            track: str,
+            artist: str,
+            track_ids: List[str],
+            lead: float = 0.0
+        ) -> None:
+        """Store the ranked track IDs a search returned, even if none."""
+        key = normalize_key(track, artist)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO searches "
+                "(key, track_ids, stored_at, lead) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(track_ids), time.time(), lead))
+
+    def evict(self) -> None:
+        """Remove expired entries, then the oldest ones over the size limit."""
+        oldest_allowed = time.time() - self.ttl
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM searches WHERE stored_at < ?", (oldest_allowed,))
+            self.connection.execute(
+                "DELETE FROM searches WHERE key IN ("
+                "SELECT key FROM searches ORDER BY stored_at LIMIT "
+                "max(0, (SELECT COUNT(*) FROM searches) - ?))",
+                (self.max_entries,))
+
+    def close(self) -> None:
+        self.evict()
+        self.connection.close()
+
+
+class ResolutionTable:
+    """Run-wide results of song lookups, so each song is looked up once."""
+
+    def __init__(self):
+        self.futures = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def resolve(
+            self,
+            track: str,
+            artist: str,
+            lookup: Callable[[], Any]
+            ) -> Any:
+        """Return lookup() for a song, sharing one call between its repeats."""
+        key = normalize_key(track, artist)
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.futures[key] = future
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            # Waits if the first lookup of this song is still in flight
+            return future.result()
+        try:
+            result = lookup()
+        except BaseException as error:
+            # Later repeats of the song may try again
+            with self.lock:
+                del self.futures[key]
+            future.set_exception(error)
+            raise
+        future.set_result(result)
+        return result
+
+    def clear(self) -> None:
+        with self.lock:
+            self.futures = {}
+            self.hits = 0
+            self.misses = 0
+
+
+def normalize_key(track: str, artist: str) -> str:
+    # Key for a song ignoring case, whitespace, brackets and the
+    # "feat."/"ft."/"featuring" variants
+    return "{}\n{}".format(normalize_text(track), normalize_text(artist))
+
+def normalize_text(text: str) -> str:
+    text = FEATURING.sub("feat", text.lower())
+    return " ".join(PUNCTUATION.sub(" ", text).split())
@@ -0,0 +1,179 @@
+import os
+import sys
+import hashlib
+import argparse
+import configparser
+from typing import Dict, List, Mapping, Optional, Tuple
+from .read_file import default_globs, scan_directory, split_globs
+
+
+# Environment variables like PLAYLIST_CONVERTER_OPTIONS__MAX_FILES=8 set
+# a key, here max_files in [OPTIONS], in place of the config file's value
+ENV_PREFIX = "PLAYLIST_CONVERTER_"
+ENV_SEPARATOR = "__"
+CONFIG_PATH_ENV = ENV_PREFIX + "CONFIG"
+nothing_changed_msg = "Nothing changed since the last run\n"
+fingerprint_error_msg = "Couldn't save the run's fingerprint: {}\n"
+
+def config_dir() -> str:
+    project_root = os.path.dirname(os.path.dirname(__file__))
+    return os.path.join(project_root, "config")
+
+def config_setting(value: str) -> Tuple[str, str, str]:
+    # A --set value like "OPTIONS.max_files=8"
+    name, equals, setting = value.partition("=")
+    section, _, key = name.rpartition(".")
+    if not equals or not section.strip() or not key.strip():
+        raise argparse.ArgumentTypeError(
+            "'{}' isn't like SECTION.KEY=VALUE".format(value))
+    return section.strip(), key.strip(), setting
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m playlist_converter",
+        description="Convert text files of songs to Spotify playlists.")
+    arg_parser.add_argument(
+        "--resume", action="store_true",
+        help="continue an interrupted run, skipping work it already did")
+    arg_parser.add_argument(
+        "--sync", action="store_true",
+        help="skip unchanged files and update the playlists of changed ones")
+    arg_parser.add_argument(
+        "--check", action="store_true",
+        help="exit straight away if no playlist file or config has changed "
+             "since the last run with --check")
+    arg_parser.add_argument(
+        "--config", metavar="PATH",
+        default=os.environ.get(CONFIG_PATH_ENV),
+        help="read the config from PATH instead of config/config.ini")
+    arg_parser.add_argument(
+        "--set", metavar="SECTION.KEY=VALUE", type=config_setting,
+        action="append", default=[], dest="settings",
+        help="use VALUE for a config key, like OPTIONS.max_files=8")
+    arg_parser.add_argument(
+        "--metrics", metavar="PATH",
+        help="write request and timing metrics to PATH as JSON, or as "
+             "Prometheus text if PATH ends in .prom")
+    arg_parser.add_argument(
+        "--profile", metavar="PATH",
+        help="profile the run with cProfile and save the stats to PATH")
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--resolve-only", metavar="MANIFEST",
+        help="look up every song and write the matches to MANIFEST "
+             "instead of making playlists")
+    mode.add_argument(
+        "--apply", metavar="MANIFEST",
+        help="make the playlists listed in MANIFEST without searching")
+    mode.add_argument(
+        "--watch", action="store_true",
+        help="keep running, syncing files as they're created or changed")
+    args = arg_parser.parse_args(argv)
+    if args.check and (args.watch or args.apply):
+        arg_parser.error("--check can't be used with --watch or --apply")
+    return args
+
+def config_overrides(
+        args: argparse.Namespace,
+        environ: Optional[Mapping[str, str]] = None
+        ) -> Dict[str, Dict[str, str]]:
+    """Return config keys set by environment variables, then by --set."""
+    environ = os.environ if environ is None else environ
+    overrides = {}
+    for name in sorted(environ):
+        if not name.startswith(ENV_PREFIX):
+            continue
+        section, _, key = name[len(ENV_PREFIX):].partition(ENV_SEPARATOR)
+        if section and key:
+            overrides.setdefault(section, {})[key.lower()] = environ[name]
+    for section, key, value in args.settings:
+        overrides.setdefault(section, {})[key] = value
+    return overrides
+
+def config_path(args: argparse.Namespace) -> str:
+    return args.config or os.path.join(config_dir(), "config.ini")
+
+def read_check_config(
+        args: argparse.Namespace
+        ) -> Optional[configparser.ConfigParser]:
+    # A config that can't be read leaves the run to report why
+    config = configparser.ConfigParser()
+    try:
+        with open(config_path(args), "r") as config_file:
+            config.read_file(config_file)
+        config.read_dict(config_overrides(args))
+    except (OSError, configparser.Error):
+        return None
+    return config
+
+def fingerprint_path(config: configparser.ConfigParser) -> str:
+    default_path = os.path.join(config_dir(), "fingerprint.txt")
+    return config.get("OPTIONS", "fingerprint_path", fallback=default_path)
+
+def directory_fingerprint(
+        config: configparser.ConfigParser,
+        args: argparse.Namespace
+        ) -> Optional[str]:
+    """Return a digest of the config and every playlist file's stat."""
+    digest = hashlib.sha256()
+    try:
+        sections = {section: sorted(config.items(section))
+                    for section in config.sections()}
+        include = split_globs(config.get(
+            "OPTIONS", "include_globs", fallback="")) or default_globs()
+        exclude = split_globs(config.get(
+            "OPTIONS", "exclude_globs", fallback=""))
+        # Every account's directory, as "[API name]" sections have their own
+        directories = sorted({
+            config.get(section, "directory_path")
+            for section in config.sections()
+            if config.has_option(section, "directory_path")})
+        digest.update(repr((sorted(sections.items()), args.sync,
+                            args.resolve_only)).encode())
+        for directory in directories:
+            files = []
+            for path, relative, _ in scan_directory(
+                    directory, include, exclude):
+                stat = os.stat(path)
+                files.append((relative, stat.st_size, stat.st_mtime_ns))
+            files.sort()
+            digest.update(repr((directory, files)).encode())
+    except (OSError, configparser.Error):
+        return None
+    return digest.hexdigest()
+
+def read_fingerprint(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as fingerprint_file:
+            return fingerprint_file.read().strip()
+    except OSError:
+        return None
+
+def save_fingerprint(path: str, fingerprint: str) -> None:
+    # Failing to save only means the next --check does the work again
+    try:
+        with open(path, "w") as fingerprint_file:
+            fingerprint_file.write(fingerprint + "\n")
+    except OSError as error:
+        sys.stderr.write(fingerprint_error_msg.format(error))
+        sys.stderr.flush()
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    fingerprint = None
+    if args.check:
+        config = read_check_config(args)
+        if config is not None:
+            path = fingerprint_path(config)
+            fingerprint = directory_fingerprint(config, args)
+        if fingerprint is not None and fingerprint == read_fingerprint(path):
+            sys.stdout.write(nothing_changed_msg)
+            sys.stdout.flush()
+            return
+    # There's work to do, so only now load requests and the rest of the app
+    from .app import run_app
+    run_app(args=args)
+    # The fingerprint was taken before the run, so changes made during it
+    # are found by the next one
+    if fingerprint is not None:
+        save_fingerprint(path, fingerprint)
@@ -1,105 +1,695 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from json import dumps
-from typing import List, Tuple, Dict, Union, Any
+from threading import Lock
+from typing import (
+    List, Tuple, Dict, Union, Any, Callable, Iterable, Iterator, Sequence)
 import requests
+from requests.adapters import HTTPAdapter
+from .auth import TokenProvider
+from .cache import SearchCache, ResolutionTable
+from .fuzzy import SongIndex
+from .journal import FileCheckpoint
+from .library import SavedLibrary
+from .metrics import Metrics
+from .ranking import (
+    is_confident, rank_candidates, DEFAULT_SEARCH_LIMIT, DEFAULT_RANK_MARGIN,
+    WIDE_SEARCH_LIMIT)
+from .sync import diff_items, item_hashes
+from .scheduler import RequestScheduler, DEFAULT_RATE, DEFAULT_RETRIES
 
 
 SEARCH_URL = "https://api.spotify.com/v1/search"
 CONTAINS_URL = "https://api.spotify.com/v1/me/tracks/contains"
+SAVED_TRACKS_URL = "https://api.spotify.com/v1/me/tracks"
 PLAYLIST_URL = "https://api.spotify.com/v1/users/{}/playlists"
+PLAYLIST_STATE_URL = "https://api.spotify.com/v1/playlists/{}"
 ADD_TRACK_URL = "https://api.spotify.com/v1/playlists/{}/tracks"
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 10.0
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Methods whose requests can be sent again after a server error unchecked
+IDEMPOTENT_METHODS = ("GET", "DELETE")
+# Most track IDs the saved-track check accepts in one request
+CONTAINS_LIMIT = 50
+# Most saved tracks returned per page of the user's library
+SAVED_PAGE_SIZE = 50
+# Most tracks one request can add to or remove from a playlist
+ADD_TRACKS_LIMIT = 100
+# Songs searched for before their saved-track checks are batched together
+RESOLVE_BATCH_SIZE = 50
+# Ways a line's song is resolved, counted in SpotifyClient.tiers
+RESOLUTION_TIERS = ("cache", "search", "index", "corrected_search",
+                    "unresolved")
 
 class SpotifyClient:
     """Client makes requests to the Spotify API to create a playlist."""
 
-    def __init__(self, access_token: str, user_id: str):
+    def __init__(
+            self,
+            access_token: str,
+            user_id: str,
+            max_workers: int = DEFAULT_WORKERS,
+            cache: Union[SearchCache, None] = None,
+            pool_size: Union[int, None] = None,
+            timeout: float = DEFAULT_TIMEOUT,
+            requests_per_second: float = DEFAULT_RATE,
+            max_retries: int = DEFAULT_RETRIES,
+            metrics: Union[Metrics, None] = None,
+            search_limit: int = DEFAULT_SEARCH_LIMIT,
+            rank_margin: float = DEFAULT_RANK_MARGIN,
+            library: Union[SavedLibrary, None] = None,
+            tokens: Union[TokenProvider, None] = None,
+            dedupe: bool = False,
+            adapter: Union[HTTPAdapter, None] = None,
+            resolutions: Union[ResolutionTable, None] = None,
+            songs: Union[SongIndex, None] = None
+        ):
         self.access_token = access_token
         self.user_id = user_id
+        self.cache = cache
+        self.metrics = metrics
+        self.search_limit = search_limit
+        self.rank_margin = rank_margin
+        # Whether a track already in a playlist is left out when it repeats
+        self.dedupe = dedupe
+        # Songs and saved flags already looked up during this run. Songs
+        # are found the same way for every account, so clients for several
+        # accounts may share them; saved flags are each user's own
+        if resolutions is None:
+            resolutions = ResolutionTable()
+        self.resolutions = resolutions
+        # Songs found so far, which misspelled ones may be matched against
+        if songs is None:
+            songs = SongIndex()
+        self.songs = songs
+        # How many lines each of RESOLUTION_TIERS resolved
+        self.tiers = dict.fromkeys(RESOLUTION_TIERS, 0)
+        self.tiers_lock = Lock()
+        self.saved_flags = {}
+        self.saved_lock = Lock()
+        # With a library index, saved tracks are checked without requests
+        self.library = library
+        self.library_ready = False
+        self.library_lock = Lock()
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        # Caps requests in flight and per second across all worker threads
+        self.scheduler = RequestScheduler(
+            self.max_workers, requests_per_second, max_retries)
+        # Keep-alive connections are reused by every request this client
+        # sends, and by other clients given the same adapter
+        self.shared_adapter = adapter is not None
+        self.session = make_session(pool_size or self.max_workers, adapter)
+        # Without a refresh token, a rejected access token ends the run
+        self.tokens = tokens or TokenProvider(access_token)
+        self.set_access_token(access_token)
+
+    def send(
+            self,
+            method: str,
+            request_args: Dict,
+            endpoint: str = "other",
+            applied: Union[Callable[[], Any], None] = None
+        ) -> Any:
+        """Send a request through the scheduler, retrying if throttled."""
+        on_retry = None
+        if self.metrics is not None:
+            request_args = self.metrics.instrument(endpoint, request_args)
+            on_retry = lambda: self.metrics.record_retry(endpoint)
+        attempt = lambda: send_request(
+            method, request_args, self.session, self.timeout)
+        # Other requests are retried after a server error only once
+        # applied() finds they had no effect
+        run = lambda: self.scheduler.run(
+            attempt, method in IDEMPOTENT_METHODS, applied, on_retry)
+        token = self.tokens.current()
+        try:
+            return run()
+        except requests.HTTPError as error:
+            expired = (error.response is not None and
+                       error.response.status_code == 401)
+            if not expired or not self.tokens.can_refresh():
+                raise
+        # The access token expired: refresh it, then replay the request once
+        self.tokens.refresh(token, self.set_access_token)
+        return run()
+
+    def forget_lookups(self) -> None:
+        """Forget the songs and saved tracks looked up so far."""
+        # Songs not found are searched for again, as the search cache
+        # allows, and tracks saved since are added to the library index
+        self.resolutions.clear()
+        self.songs.clear()
+        with self.saved_lock:
+            self.saved_flags.clear()
+        with self.library_lock:
+            self.library_ready = False
+
+    def set_access_token(self, access_token: str) -> None:
+        self.session.headers["Authorization"] = "Bearer " + access_token
+
+    def close(self) -> None:
+        # A shared adapter's connections are closed by its owner
+        if not self.shared_adapter:
+            self.session.close()
 
     def find_track_ids(self, track: str, artist: str) -> List[str]:
+        # Repeats of a song in this run share one search, even if concurrent
+        lookup = lambda: self.resolve_song(track, artist)
+        tier, track_ids, lead = self.resolutions.resolve(
+            track, artist, lookup)
+        with self.tiers_lock:
+            self.tiers[tier] += 1
+        if self.library is None and is_confident(lead, self.rank_margin):
+            # A clear winner needs no saved-track check to pick between IDs,
+            # while with the library index that check sends no request
+            return track_ids[:1]
+        return track_ids
+
+    def resolve_song(
+            self,
+            track: str,
+            artist: str
+        ) -> Tuple[str, List[str], float]:
+        """Return a song's ranked track IDs, their lead and the tier."""
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(track, artist)
+        if cached is not None:
+            tier, (track_ids, lead) = "cache", cached
+        else:
+            tier = "search"
+            track_ids, lead = self.search_track_ids(track, artist)
+        # Only what Spotify returned is cached, never a guess from the index
+        searched = (track_ids, lead)
+        if not track_ids:
+            # A misspelled song may be one found earlier, needing no request,
+            # or be searched for once more as found songs spell it
+            match = self.songs.match(track, artist)
+            corrected = None
+            if match is None and cached is None:
+                corrected = self.songs.correct(track, artist)
+            if match is not None:
+                tier, track_ids, lead = "index", [match], 0.0
+            elif corrected is not None:
+                tier = "corrected_search"
+                track_ids, lead = self.search_track_ids(*corrected)
+                searched = (track_ids, lead)
+        if self.cache is not None and searched != cached:
+            self.cache.put(track, artist, *searched)
+        if not track_ids:
+            return "unresolved", track_ids, lead
+        self.songs.add(track, artist, track_ids[0])
+        return tier, track_ids, lead
+
+    def search_track_ids(
+            self,
+            track: str,
+            artist: str
+        ) -> Tuple[List[str], float]:
+        """Return search results from best to worst and the best's lead."""
+        tracks_found = self.search_tracks(track, artist, self.search_limit)
+        track_ids, lead = rank_candidates(track, artist, tracks_found)
+        more = WIDE_SEARCH_LIMIT - self.search_limit
+        if len(tracks_found) == self.search_limit and more > 0 and \
+                not is_confident(lead, self.rank_margin):
+            # Without a clear winner the saved version may be further down,
+            # so the next page is looked at too
+            tracks_found += self.search_tracks(
+                track, artist, more, self.search_limit)
+            track_ids, lead = rank_candidates(track, artist, tracks_found)
+        return track_ids, lead
+
+    def search_tracks(
+            self,
+            track: str,
+            artist: str,
+            limit: int,
+            offset: int = 0
+        ) -> List[Dict]:
         query = "{} artist:{}".format(track, artist)
-        request_args = {
-            "url": SEARCH_URL,
-            "headers": {"Authorization": "Bearer " + self.access_token},
-            "params": {"q": query, "type": "track", "limit": 20}
-        }
-        response_json = send_request("GET", request_args)
-        tracks_found = response_json["tracks"]["items"]
-        return [result["id"] for result in tracks_found]
+        params = {"q": query, "type": "track", "limit": limit}
+        if offset:
+            params["offset"] = offset
+        request_args = {"url": SEARCH_URL, "params": params}
+        response_json = self.send("GET", request_args, "search")
+        return response_json["tracks"]["items"]
 
     def find_saved_track(self, track_ids: List[str]) -> Union[str, None]:
+        response_json = self.check_saved(track_ids)
+        return first_saved(list(zip(track_ids, response_json)))
+
+    def find_saved_tracks(
+            self,
+            candidate_lists: List[List[str]]
+        ) -> List[Union[str, None]]:
+        """Return the first saved track of each list of candidate IDs."""
+        # Pack the IDs of many songs together, up to 50 per request, and
+        # skip IDs already checked earlier in this run
+        unique_ids = [tid for tid in dict.fromkeys(
+            tid for track_ids in candidate_lists for tid in track_ids)
+            if tid not in self.saved_flags]
+        batches = list(chunked(unique_ids, CONTAINS_LIMIT))
+        flags = ordered_map(self.check_saved, batches, self.max_workers)
+        for batch, batch_flags in zip(batches, flags):
+            with self.saved_lock:
+                self.saved_flags.update(zip(batch, batch_flags))
+        saved = self.saved_flags
+        return [first_saved([(tid, saved[tid]) for tid in track_ids])
+                for track_ids in candidate_lists]
+
+    def check_saved(self, track_ids: List[str]) -> List[bool]:
+        if self.library is not None:
+            self.refresh_library()
+            return [tid in self.library for tid in track_ids]
         request_args = {
             "url": CONTAINS_URL,
-            "headers": {"Authorization": "Bearer " + self.access_token},
             "params": {"ids": track_ids}
         }
-        response_json = send_request("GET", request_args)
-        return first_saved(list(zip(track_ids, response_json)))
+        return self.send("GET", request_args, "saved_check")
+
+    def refresh_library(self) -> None:
+        # Page through newly saved tracks once per run, on first use
+        with self.library_lock:
+            if not self.library_ready:
+                self.library.refresh(self.saved_track_pages)
+                self.library.save()
+                self.library_ready = True
+
+    def saved_track_pages(self) -> Iterator[Dict]:
+        """Yield pages of the user's saved tracks, newest first."""
+        offset = 0
+        while True:
+            request_args = {
+                "url": SAVED_TRACKS_URL,
+                "params": {"limit": SAVED_PAGE_SIZE, "offset": offset}
+            }
+            page = self.send("GET", request_args, "saved_tracks")
+            yield page
+            offset += len(page["items"])
+            if page["next"] is None or not page["items"]:
+                return
 
     def get_track_id(self, track: str, artist: str) -> Union[str, None]:
         track_results = self.find_track_ids(track, artist)
         if not track_results:
             return None
+        if len(track_results) == 1:
+            return track_results[0]
         saved_track = self.find_saved_track(track_results)
         if not saved_track:
             return track_results[0]
         return saved_track
 
+    def get_track_ids(
+            self,
+            tracks_with_artist: Iterable[Tuple[str, str]]
+        ) -> Iterator[Union[str, None]]:
+        """Resolve the track ID of each pair concurrently, keeping order."""
+        search = lambda pair: self.find_track_ids(*pair)
+        for batch in chunked(tracks_with_artist, RESOLVE_BATCH_SIZE):
+            results = list(ordered_map(search, batch, self.max_workers))
+            # Only songs with a choice of candidates need the saved check
+            found = [track_ids for track_ids in results if len(track_ids) > 1]
+            saved_tracks = iter(self.find_saved_tracks(found))
+            for track_ids in results:
+                if len(track_ids) <= 1:
+                    yield track_ids[0] if track_ids else None
+                    continue
+                saved_track = next(saved_tracks)
+                yield saved_track if saved_track else track_ids[0]
+
     def create_playlist(self, name: str) -> str:
         request_args = {
             "url": PLAYLIST_URL.format(self.user_id),
-            "headers": {
-                "Authorization": "Bearer " + self.access_token,
-                "Content-Type": "application/json"
-            },
+            "headers": JSON_HEADERS,
             "data": dumps({"name": name})
         }
-        response_json = send_request("POST", request_args)
+        # A playlist made before a server error is the user's newest one
+        applied = lambda: self.new_playlist(name)
+        response_json = self.send(
+            "POST", request_args, "create_playlist", applied)
         # Playlist ID used to add tracks to the playlist
         return response_json["id"]
 
-    def add_playlist_tracks(self, pid: str, track_uris: List[str]) -> None:
+    def new_playlist(self, name: str) -> Union[Dict, None]:
+        # The user's newest playlist, if it's an empty one named name
+        request_args = {
+            "url": PLAYLIST_URL.format(self.user_id),
+            "params": {"limit": 1}
+        }
+        items = self.send("GET", request_args, "list_playlists").get(
+            "items", [])
+        if items and items[0]["name"] == name and \
+                items[0]["tracks"]["total"] == 0:
+            return items[0]
+        return None
+
+    def add_playlist_tracks(
+            self,
+            pid: str,
+            track_uris: Iterable[str],
+            skip_tracks: int = 0,
+            on_batch: Union[Callable[[int, str], None], None] = None
+        ) -> None:
+        """Append tracks in batches of 100, after skip_tracks already added."""
+        # Batches are cut lazily, so long lists are never copied whole
+        if self.dedupe:
+            track_uris = unique(track_uris)
+        posted = skip_tracks
+        remaining = islice(track_uris, skip_tracks, None)
+        for batch in chunked(remaining, ADD_TRACKS_LIMIT):
+            self.post_playlist_tracks(pid, batch, on_batch, posted)
+            posted += len(batch)
+
+    def post_playlist_tracks(
+            self,
+            pid: str,
+            track_uris: List[str],
+            on_batch: Union[Callable[[int, str], None], None] = None,
+            posted: Union[int, None] = None
+        ) -> str:
+        """Add one batch to the end of a playlist, returning its snapshot."""
         request_args = {
             "url": ADD_TRACK_URL.format(pid),
-            "headers": {
-                "Authorization": "Bearer " + self.access_token,
-                "Content-Type": "application/json"
-            }
+            "headers": JSON_HEADERS,
+            "data": dumps({"uris": track_uris})
+        }
+        # The batch may have been added before the request failed, so
+        # when the playlist held posted tracks, its length tells
+        applied = None
+        if posted is not None:
+            applied = lambda: self.batch_added(pid, posted + len(track_uris))
+        try:
+            snapshot_id = self.send(
+                "POST", request_args, "add_tracks", applied).get(
+                    "snapshot_id")
+        except requests.RequestException:
+            added = applied() if applied is not None else None
+            if added is None:
+                raise
+            snapshot_id = added["snapshot_id"]
+        if on_batch is not None:
+            on_batch(len(track_uris), snapshot_id)
+        return snapshot_id
+
+    def playlist_state(self, pid: str) -> Dict:
+        # A playlist's snapshot ID and number of tracks
+        request_args = {
+            "url": PLAYLIST_STATE_URL.format(pid),
+            "params": {"fields": "snapshot_id,tracks.total"}
+        }
+        return self.send("GET", request_args, "playlist_state")
+
+    def batch_added(self, pid: str, total: int) -> Union[Dict, None]:
+        # The playlist's state, if it holds total tracks
+        state = self.playlist_state(pid)
+        if state["tracks"]["total"] != total:
+            return None
+        return state
+
+    def tracks_posted(self, checkpoint: FileCheckpoint, found: int) -> int:
+        """Return how many of found tracks an earlier run added."""
+        posted = checkpoint.tracks_posted
+        if checkpoint.playlist_id is None or posted >= found:
+            return posted
+        # Every change makes a new snapshot, so a different one means a
+        # batch was added after the last one recorded
+        state = self.playlist_state(checkpoint.playlist_id)
+        total = state["tracks"]["total"]
+        if state["snapshot_id"] != checkpoint.snapshot_id and \
+                posted < total <= found:
+            checkpoint.add_batch(total - posted, state["snapshot_id"])
+        return checkpoint.tracks_posted
+
+    def insert_playlist_tracks(
+            self,
+            pid: str,
+            track_uris: List[str],
+            position: int,
+            on_batch: Union[Callable[[int], None], None] = None
+        ) -> None:
+        request_args = {
+            "url": ADD_TRACK_URL.format(pid),
+            "headers": JSON_HEADERS
         }
-        # Maximum of 100 items per request
-        subsets = subsets_of_size(track_uris, 100)
-        for subset in subsets:
-            request_body = {"uris": subset}
+        for subset in chunked(track_uris, ADD_TRACKS_LIMIT):
+            request_body = {"uris": subset, "position": position}
             request_args["data"] = dumps(request_body)
-            send_request("POST", request_args)
+            self.send("POST", request_args, "add_tracks")
+            position += len(subset)
+            if on_batch is not None:
+                on_batch(len(subset))
+
+    def remove_playlist_tracks(
+            self,
+            pid: str,
+            removals: List[Tuple[str, int]],
+            on_batch: Union[Callable[[List[Tuple[str, int]]], None],
+                            None] = None
+        ) -> None:
+        request_args = {
+            "url": ADD_TRACK_URL.format(pid),
+            "headers": JSON_HEADERS
+        }
+        # Remove from the end so positions in later requests don't shift
+        ordered = sorted(removals, key=lambda removal: removal[1], reverse=True)
+        for subset in chunked(ordered, ADD_TRACKS_LIMIT):
+            tracks = [{"uri": uri, "positions": [position]}
+                      for uri, position in subset]
+            request_args["data"] = dumps({"tracks": tracks})
+            self.send("DELETE", request_args, "remove_tracks")
+            if on_batch is not None:
+                on_batch(subset)
+
+    def sync_playlist(
+            self,
+            pid: str,
+            old_hashes: Sequence[int],
+            old_track_ids: List[Union[str, None]],
+            new_items: List[Tuple[str, str]],
+            on_failure: Union[Callable[[List[int], List[Union[str, None]]],
+                                       None], None] = None
+        ) -> List[Union[str, None]]:
+        """Edit a playlist made from lines with old_hashes to new_items."""
+        new_hashes = item_hashes(new_items)
+        opcodes = diff_items(old_hashes, new_hashes)
+        removals = []
+        # Old lines by their track's position in the playlist
+        lines_at = {}
+        inserted_items = []
+        # Songs that weren't found aren't in the playlist, so positions in
+        # it only count the songs before that were
+        position = 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            for line, track_id in enumerate(old_track_ids[i1:i2], i1):
+                if track_id is None:
+                    continue
+                if tag != "equal":
+                    removals.append((track_uri(track_id), position))
+                    lines_at[position] = line
+                position += 1
+            if tag != "equal":
+                inserted_items.extend(new_items[j1:j2])
+        # Only songs that were added or changed are looked up
+        inserted_ids = iter(list(self.get_track_ids(inserted_items)))
+        # When an edit fails partway, on_failure is given the lines the
+        # playlist holds by then, so the next sync diffs against those
+        removed = set()
+        def removed_batch(batch: List[Tuple[str, int]]) -> None:
+            removed.update(lines_at[position] for _, position in batch)
+        try:
+            self.remove_playlist_tracks(pid, removals, removed_batch)
+        except requests.RequestException:
+            if on_failure is not None:
+                kept = [line for line in range(len(old_hashes))
+                        if line not in removed]
+                on_failure([old_hashes[line] for line in kept],
+                           [old_track_ids[line] for line in kept])
+            raise
+        new_track_ids = []
+        position = 0
+        for index, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+            if tag == "equal":
+                block_ids = old_track_ids[i1:i2]
+            else:
+                block_ids = [next(inserted_ids) for _ in range(j1, j2)]
+                block_uris = track_uris(block_ids)
+                inserted = 0
+                def inserted_batch(size: int) -> None:
+                    nonlocal inserted
+                    inserted += size
+                try:
+                    if block_uris:
+                        self.insert_playlist_tracks(
+                            pid, block_uris, position, inserted_batch)
+                except requests.RequestException:
+                    if on_failure is not None:
+                        placed = placed_lines(block_ids, inserted)
+                        hashes = list(new_hashes[:j1 + placed])
+                        track_ids = new_track_ids + block_ids[:placed]
+                        # Later blocks only hold their unchanged lines
+                        for later, start, end, _, _ in opcodes[index + 1:]:
+                            if later == "equal":
+                                hashes.extend(old_hashes[start:end])
+                                track_ids.extend(old_track_ids[start:end])
+                        on_failure(hashes, track_ids)
+                    raise
+            new_track_ids.extend(block_ids)
+            position += sum(track_id is not None for track_id in block_ids)
+        return new_track_ids
 
     def make_playlist_with_tracks(
             self,
             playlist_name: str,
-            tracks_with_artist: List[Tuple[str, str]]
+            tracks_with_artist: Iterable[Tuple[str, str]],
+            checkpoint: Union[FileCheckpoint, None] = None
         ) -> None:
-        track_ids = [self.get_track_id(*pair) for pair in tracks_with_artist]
-        track_uris = ["spotify:track:{}".format(tid) for tid in track_ids]
-        if track_uris:
-            playlist_id = self.create_playlist(playlist_name)
-            self.add_playlist_tracks(playlist_id, track_uris)
+        """Make a playlist, adding tracks in order while songs are found."""
+        if checkpoint is None:
+            checkpoint = FileCheckpoint()
+        if checkpoint.done:
+            return
+        # Songs resolved by an earlier, interrupted run aren't looked up again
+        resolved = len(checkpoint.track_ids)
+        remaining = islice(tracks_with_artist, resolved, None)
+        # Found tracks not yet added, after the ones already posted
+        found = track_uris(checkpoint.track_ids)
+        posted = self.tracks_posted(checkpoint, len(found))
+        pending = deque(islice(found, posted, None))
+        # Repeats are recorded as not found, so the playlist has no copies
+        seen = None
+        if self.dedupe:
+            seen = {tid for tid in checkpoint.track_ids if tid is not None}
+        # One thread posts batches in order while the next songs are resolved
+        with ThreadPoolExecutor(max_workers=1) as poster:
+            in_flight = None
+            def wait_for_post() -> None:
+                # A batch only counts as posted once add_batch recorded it,
+                # and a failed one stops the next from being submitted
+                nonlocal in_flight, posted
+                if in_flight is not None:
+                    post, size = in_flight
+                    in_flight = None
+                    post.result()
+                    posted += size
+            def post_full_batches(final: bool) -> None:
+                nonlocal in_flight
+                if pending and checkpoint.playlist_id is None:
+                    playlist_id = self.create_playlist(playlist_name)
+                    checkpoint.set_playlist(playlist_id)
+                while len(pending) >= ADD_TRACKS_LIMIT or (final and pending):
+                    wait_for_post()
+                    size = min(len(pending), ADD_TRACKS_LIMIT)
+                    batch = [pending.popleft() for _ in range(size)]
+                    in_flight = (poster.submit(
+                        self.post_playlist_tracks, checkpoint.playlist_id,
+                        batch, checkpoint.add_batch, posted), size)
+            post_full_batches(False)
+            for batch in chunked(self.get_track_ids(remaining),
+                                 RESOLVE_BATCH_SIZE):
+                if seen is not None:
+                    batch = drop_repeats(batch, seen)
+                checkpoint.add_track_ids(batch)
+                pending.extend(track_uris(batch))
+                post_full_batches(False)
+            post_full_batches(True)
+            wait_for_post()
+        checkpoint.finish()
 
 
-def send_request(method: str, request_args: Dict) -> Any:
-    response = requests.request(method, **request_args)
+def make_session(
+        pool_size: int,
+        adapter: Union[HTTPAdapter, None] = None
+        ) -> requests.Session:
+    # Session whose connection pool keeps pool_size connections per host,
+    # unless it's given an adapter, and so a pool, to share
+    session = requests.Session()
+    if adapter is None:
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def send_request(
+        method: str,
+        request_args: Dict,
+        session: Union[requests.Session, None] = None,
+        timeout: Union[float, None] = None
+        ) -> Any:
+    sender = session if session is not None else requests
+    response = sender.request(method, timeout=timeout, **request_args)
     response.raise_for_status()
     return response.json()
 
+def ordered_map(
+        func: Callable,
+        items: Iterable,
+        workers: int
+        ) -> Iterator:
+    # Like Executor.map, but only submits a bounded window of items at once
+    # so large or lazy iterables are never drained up front.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    # Lazily split items into lists of at most size items
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+def placed_lines(track_ids: List[Union[str, None]], added: int) -> int:
+    # How many of the lines with track_ids the first added tracks cover
+    if not added:
+        return 0
+    found = 0
+    for line, track_id in enumerate(track_ids, 1):
+        found += track_id is not None
+        if found == added:
+            return line
+    return len(track_ids)
+
+def track_uri(track_id: str) -> str:
+    return "spotify:track:{}".format(track_id)
+
+def track_uris(track_ids: Iterable[Union[str, None]]) -> List[str]:
+    # URIs of the songs that were found, leaving out the ones that weren't
+    return [track_uri(tid) for tid in track_ids if tid is not None]
+
+def unique(items: Iterable) -> Iterator:
+    # Items in order, without repeats, read lazily
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+def drop_repeats(
+        track_ids: List[Union[str, None]],
+        seen: set
+        ) -> List[Union[str, None]]:
+    # Replace IDs in seen with None, as if not found, adding the rest
+    kept = []
+    for track_id in track_ids:
+        if track_id in seen:
+            track_id = None
+        elif track_id is not None:
+            seen.add(track_id)
+        kept.append(track_id)
+    return kept
+
 def first_saved(tracks_saved: List[Tuple[str, bool]]) -> Union[str, None]:
     for tid, saved in tracks_saved:
         if saved:
             return tid
     return None
-
-def subsets_of_size(items: List, size: int) -> List[List]:
-    subsets = []
-    duplicate = list(items)
-    while duplicate:
-        subset = duplicate[:size]
-        subsets.append(subset)
-        duplicate = duplicate[size:]
-    return subsets
@@ -0,0 +1,161 @@
+import re
+from array import array
+from threading import Lock
+from typing import List, Set, Tuple, Union
+from .cache import normalize_text
+from .model import TrackIds
+
+
+# Lowest share of trigrams a title or artist must have with a known one to
+# be taken for a misspelling of it
+MIN_SIMILARITY = 0.5
+# Lowest combined score of a known song to be used without searching
+MIN_MATCH_SCORE = 0.8
+TITLE_WEIGHT = 0.6
+ARTIST_WEIGHT = 0.4
+# Most known titles compared against each unresolved song
+MAX_CANDIDATES = 20
+NUMBERS = re.compile(r"\d+")
+
+class TrigramIndex:
+    """Texts found by how many three-character sequences they share."""
+
+    __slots__ = ("texts", "sizes", "postings")
+
+    def __init__(self):
+        self.texts = []
+        # Number of distinct trigrams in each text
+        self.sizes = array("H")
+        # Positions of the texts holding each trigram, four bytes apiece
+        self.postings = {}
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add(self, text: str) -> int:
+        """Add a normalized text, returning its position."""
+        position = len(self.texts)
+        grams = trigrams(text)
+        self.texts.append(text)
+        self.sizes.append(min(len(grams), 0xFFFF))
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array("I")
+            postings.append(position)
+        return position
+
+    def search(
+            self,
+            text: str,
+            min_similarity: float = MIN_SIMILARITY
+            ) -> List[Tuple[float, int]]:
+        """Return (similarity, position) of similar texts, best first."""
+        grams = trigrams(text)
+        shared = {}
+        for gram in grams:
+            for position in self.postings.get(gram, ()):
+                shared[position] = shared.get(position, 0) + 1
+        # Dice coefficient of the two texts' trigram sets
+        scored = [(2 * count / (len(grams) + self.sizes[position]), position)
+                  for position, count in shared.items()]
+        scored = [(score, position) for score, position in scored
+                  if score >= min_similarity]
+        scored.sort(key=lambda found: (-found[0], found[1]))
+        return scored
+
+
+class SongIndex:
+    """Songs resolved earlier in a run, found again from misspellings."""
+
+    def __init__(self):
+        # Song positions in titles, artist_of and track_ids are the same
+        self.titles = TrigramIndex()
+        self.artist_of = array("I")
+        self.track_ids = TrackIds()
+        # Artists are indexed once however many songs they have
+        self.artists = TrigramIndex()
+        self.artist_positions = {}
+        # Hashes of the songs already added, instead of their text
+        self.added = set()
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.titles = TrigramIndex()
+            self.artist_of = array("I")
+            self.track_ids = TrackIds()
+            self.artists = TrigramIndex()
+            self.artist_positions = {}
+            self.added = set()
+
+    def add(self, track: str, artist: str, track_id: str) -> None:
+        track, artist = normalize_text(track), normalize_text(artist)
+        with self.lock:
+            key = hash((track, artist))
+            if key in self.added or not track or not artist:
+                return
+            self.added.add(key)
+            artist_position = self.artist_positions.get(artist)
+            if artist_position is None:
+                artist_position = self.artists.add(artist)
+                self.artist_positions[artist] = artist_position
+            self.titles.add(track)
+            self.artist_of.append(artist_position)
+            self.track_ids.append(track_id)
+
+    def match(self, track: str, artist: str) -> Union[str, None]:
+        """Return the track ID of a known song close enough to be the same."""
+        track, artist = normalize_text(track), normalize_text(artist)
+        with self.lock:
+            artist_scores = dict(
+                (position, score)
+                for score, position in self.artists.search(artist))
+            best_score, best_position = 0.0, None
+            for title_score, position in self.titles.search(
+                    track)[:MAX_CANDIDATES]:
+                if not same_numbers(track, self.titles.texts[position]):
+                    continue
+                artist_score = artist_scores.get(self.artist_of[position], 0)
+                score = (TITLE_WEIGHT * title_score +
+                         ARTIST_WEIGHT * artist_score)
+                if score > best_score:
+                    best_score, best_position = score, position
+            if best_position is None or best_score < MIN_MATCH_SCORE:
+                return None
+            return self.track_ids[best_position]
+
+    def correct(self, track: str, artist: str) -> Union[Tuple[str, str], None]:
+        """Return the song spelled as known songs are, or None if it is."""
+        track, artist = normalize_text(track), normalize_text(artist)
+        with self.lock:
+            found_artists = self.artists.search(artist)
+            if found_artists:
+                artist_position = found_artists[0][1]
+                corrected_artist = self.artists.texts[artist_position]
+            else:
+                artist_position, corrected_artist = None, artist
+            # Only the artist's own titles can correct the track
+            corrected_track = track
+            for _, position in self.titles.search(track)[:MAX_CANDIDATES]:
+                if self.artist_of[position] == artist_position and \
+                        same_numbers(track, self.titles.texts[position]):
+                    corrected_track = self.titles.texts[position]
+                    break
+        if (corrected_track, corrected_artist) == (track, artist):
+            return None
+        return corrected_track, corrected_artist
+
+
+def trigrams(text: str) -> Set[str]:
+    # Distinct trigrams of a normalized text, padded so short words and
+    # word starts count too
+    padded = "  {} ".format(text)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def same_numbers(first: str, second: str) -> bool:
+    # "Part 1" and "Part 2" are alike in spelling but different songs
+    return NUMBERS.findall(first) == NUMBERS.findall(second)
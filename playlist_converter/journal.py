@@ -0,0 +1,135 @@
+import json
+import os
+from threading import Lock
+from typing import Dict, List, Union
+from .model import TrackIds
+
+
+class FileCheckpoint:
+    """Progress converting one file, written to a journal as it's made."""
+
+    def __init__(
+            self,
+            journal: Union["Journal", None] = None,
+            key: str = "",
+            fingerprint: Union[List, None] = None
+        ):
+        self.journal = journal
+        self.key = key
+        self.fingerprint = fingerprint
+        self.track_ids = TrackIds()
+        self.playlist_id = None
+        # Tracks added to the playlist, and its snapshot ID after the last
+        # batch, which changes whenever the playlist does
+        self.tracks_posted = 0
+        self.snapshot_id = None
+        self.done = False
+
+    def add_track_ids(self, track_ids: List[Union[str, None]]) -> None:
+        self.track_ids.extend(track_ids)
+        self.record(track_ids=track_ids)
+
+    def set_playlist(self, playlist_id: str) -> None:
+        self.playlist_id = playlist_id
+        self.record(playlist_id=playlist_id)
+
+    def add_batch(
+            self,
+            size: int,
+            snapshot_id: Union[str, None] = None
+        ) -> None:
+        self.tracks_posted += size
+        self.snapshot_id = snapshot_id
+        self.record(posted=self.tracks_posted, snapshot_id=snapshot_id)
+
+    def finish(self) -> None:
+        self.done = True
+        self.record(done=True)
+
+    def apply(self, event: Dict) -> None:
+        # Replay one journal event onto this checkpoint
+        self.track_ids.extend(event.get("track_ids", []))
+        self.playlist_id = event.get("playlist_id", self.playlist_id)
+        self.tracks_posted = event.get("posted", self.tracks_posted)
+        self.snapshot_id = event.get("snapshot_id", self.snapshot_id)
+        self.done = event.get("done", self.done)
+
+    def record(self, **event) -> None:
+        if self.journal is not None:
+            self.journal.append(self.key, event)
+
+
+class Journal:
+    """Append-only log of conversion progress for resuming a run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.checkpoints = {}
+        self.lock = Lock()
+        self.file = None
+
+    def load(self) -> None:
+        """Replay the events of an earlier run, if it left a journal."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # The last line may be cut short by a crash
+                    continue
+                self.replay(event)
+
+    def replay(self, event: Dict) -> None:
+        key = event.pop("file")
+        if "fingerprint" in event:
+            self.checkpoints[key] = FileCheckpoint(
+                self, key, event["fingerprint"])
+        elif key in self.checkpoints:
+            self.checkpoints[key].apply(event)
+
+    def checkpoint(
+            self,
+            path: str,
+            fingerprint: Union[List, None] = None
+        ) -> FileCheckpoint:
+        """Return the progress for a file, starting over if it changed."""
+        if fingerprint is None:
+            fingerprint = file_fingerprint(path)
+        with self.lock:
+            previous = self.checkpoints.get(path)
+            if previous is not None and previous.fingerprint == fingerprint:
+                return previous
+            checkpoint = FileCheckpoint(self, path, fingerprint)
+            self.checkpoints[path] = checkpoint
+        self.append(path, {"fingerprint": fingerprint})
+        return checkpoint
+
+    def append(self, key: str, event: Dict) -> None:
+        line = json.dumps({"file": key, **event})
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a")
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def reset(self) -> None:
+        """Forget all progress, removing the journal file."""
+        self.close()
+        self.checkpoints = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def file_fingerprint(path: str) -> List[float]:
+    # Cheap check for whether a file changed between runs
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
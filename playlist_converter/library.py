@@ -0,0 +1,74 @@
+import json
+import os
+from typing import Callable, Dict, Iterator, Tuple, Union
+
+
+class SavedLibrary:
+    """IDs of the user's saved tracks, kept on disk between runs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.track_ids = set()
+        # When the newest saved track was added, for incremental refreshes
+        self.latest_added_at = ""
+        # How many tracks Spotify said were saved at the last refresh
+        self.total = 0
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self.track_ids
+
+    def __len__(self) -> int:
+        return len(self.track_ids)
+
+    def load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path, "r") as index_file:
+                index = json.load(index_file)
+            self.track_ids = set(index["track_ids"])
+            self.latest_added_at = index["latest_added_at"]
+            self.total = index["total"]
+
+    def refresh(self, fetch_pages: Callable[[], Iterator[Dict]]) -> None:
+        """Add tracks saved since the last refresh, newest pages first."""
+        total, added = self.add_pages(fetch_pages(), self.latest_added_at)
+        if total is not None and total != self.total + added:
+            # Tracks were unsaved since the index was built, so start over
+            self.track_ids = set()
+            self.latest_added_at = ""
+            total, _ = self.add_pages(fetch_pages(), "")
+        if total is not None:
+            self.total = total
+
+    def add_pages(
+            self,
+            pages: Iterator[Dict],
+            known_until: str
+            ) -> Tuple[Union[int, None], int]:
+        # Add saved tracks from pages until reaching ones added before
+        # known_until, returning the library size Spotify reported and how
+        # many tracks were added after known_until
+        total, added = None, 0
+        for page in pages:
+            total = page["total"]
+            for item in page["items"]:
+                if item["added_at"] < known_until:
+                    return total, added
+                # Tracks saved in the same second as the newest one indexed
+                # may be new too, but can't be counted as such
+                added += item["added_at"] > known_until
+                track_id = item["track"]["id"]
+                # Local files in the library have no Spotify ID
+                if track_id is not None:
+                    self.track_ids.add(track_id)
+                self.latest_added_at = max(
+                    self.latest_added_at, item["added_at"])
+        return total, added
+
+    def save(self) -> None:
+        # Write to a temporary file first so a crash can't corrupt the index
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump({"latest_added_at": self.latest_added_at,
+                       "total": self.total,
+                       "track_ids": sorted(self.track_ids)}, index_file)
+        os.replace(temp_path, self.path)
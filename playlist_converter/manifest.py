@@ -0,0 +1,59 @@
+import json
+import os
+from hashlib import sha256
+from typing import Dict, List, Tuple, Union
+
+
+MANIFEST_VERSION = 1
+
+def manifest_entry(
+        file_path: str,
+        playlist_name: str,
+        items: List[Tuple[str, str]],
+        track_ids: List[Union[str, None]]
+        ) -> Dict:
+    """Return the resolved tracks and unresolved songs of one file."""
+    resolved, unresolved = [], []
+    for index, (item, track_id) in enumerate(zip(items, track_ids)):
+        if track_id is None:
+            track, artist = item
+            unresolved.append(
+                {"index": index, "track": track, "artist": artist})
+        else:
+            resolved.append(track_id)
+    return {
+        "file": file_path,
+        "playlist": playlist_name,
+        "track_ids": resolved,
+        "unresolved": unresolved
+    }
+
+def entry_fingerprint(entry: Dict) -> List[str]:
+    """Return a digest of an entry's playlist, for journaling its progress."""
+    digest = sha256(entry["playlist"].encode("utf-8"))
+    for track_id in entry["track_ids"]:
+        digest.update(b"\n" + track_id.encode("utf-8"))
+    return [digest.hexdigest()]
+
+def write_manifest(path: str, entries: List[Dict]) -> None:
+    # Write to a temporary file first so a crash can't leave half a manifest
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as manifest_file:
+        json.dump({"version": MANIFEST_VERSION, "files": entries},
+                  manifest_file, indent=1)
+    os.replace(temp_path, path)
+
+def read_manifest(path: str) -> List[Dict]:
+    """Return the file entries of a manifest, checking they're complete."""
+    with open(path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    if not isinstance(manifest, dict) or \
+            manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version")
+    entries = manifest.get("files")
+    required = {"file", "playlist", "track_ids"}
+    if not isinstance(entries, list) or \
+            not all(required <= set(entry) for entry in entries):
+        raise ValueError("Manifest entries need keys 'file', 'playlist' "
+                         "and 'track_ids'")
+    return entries
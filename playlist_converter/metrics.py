@@ -0,0 +1,239 @@
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from requests import Response
+
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# First Python version whose cProfile profiles every thread at once
+SHARED_PROFILER_VERSION = (3, 12)
+
+class EndpointStats:
+    """Counts, latencies and bytes of the requests sent to one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.seconds = 0.0
+        # One count per bucket, plus one for requests slower than them all
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+
+    def add(
+            self,
+            seconds: float,
+            status: int,
+            bytes_sent: int,
+            bytes_received: int
+            ) -> None:
+        self.requests += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.seconds += seconds
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def report(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "statuses": {str(code): n for code, n in self.statuses.items()},
+            "seconds": self.seconds,
+            "latency_buckets": dict(zip(
+                [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                self.buckets)),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "retries": self.retries
+        }
+
+
+class Metrics:
+    """Per-endpoint request statistics and per-phase timings for a run."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.phases = {}
+        self.retries = 0
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def instrument(self, endpoint: str, request_args: Dict) -> Dict:
+        """Return request arguments that record the response under endpoint."""
+        def record(response: Response, *args, **kwargs) -> Response:
+            self.record_request(
+                endpoint, response.elapsed.total_seconds(),
+                response.status_code, bytes_sent(response),
+                bytes_received(response))
+            return response
+        return {**request_args, "hooks": {"response": record}}
+
+    def record_request(
+            self,
+            endpoint: str,
+            seconds: float,
+            status: int,
+            bytes_sent: int,
+            bytes_received: int
+            ) -> None:
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            stats.add(seconds, status, bytes_sent, bytes_received)
+
+    def record_retry(self, endpoint: str) -> None:
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            stats.retries += 1
+            self.retries += 1
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Add the time spent inside the with block to the named phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def report(self) -> Dict:
+        with self.lock:
+            return {
+                "endpoints": {name: stats.report()
+                              for name, stats in self.endpoints.items()},
+                "phases": dict(self.phases),
+                "retries": self.retries,
+                "counters": dict(self.counters)
+            }
+
+    def write(self, path: str) -> None:
+        """Write the report as Prometheus text for .prom files, else JSON."""
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(prometheus_text(self.report()))
+            else:
+                json.dump(self.report(), f, indent=2)
+
+
+def bytes_sent(response: Response) -> int:
+    # JSON bodies are sent as text, which is encoded to UTF-8 on the wire
+    body = response.request.body or b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return len(body)
+
+def bytes_received(response: Response) -> int:
+    # Bytes on the wire, which for compressed bodies are fewer than the
+    # content they decompress to
+    length = response.headers.get("Content-Length", "")
+    if length.isdigit():
+        return int(length)
+    content = response.content
+    tell = getattr(response.raw, "tell", None)
+    if callable(tell):
+        return tell()
+    return len(content)
+
+def prometheus_text(report: Dict) -> str:
+    # Render a metrics report in the Prometheus text exposition format
+    lines = []
+    def metric(name: str, kind: str, help_text: str) -> None:
+        lines.append("# HELP playlist_converter_{} {}".format(name, help_text))
+        lines.append("# TYPE playlist_converter_{} {}".format(name, kind))
+    def sample(name: str, labels: Dict[str, str], value: float) -> None:
+        label_text = ",".join('{}="{}"'.format(key, value)
+                              for key, value in labels.items())
+        if label_text:
+            label_text = "{" + label_text + "}"
+        lines.append("playlist_converter_{}{} {}".format(
+            name, label_text, value))
+    endpoints = report["endpoints"]
+    metric("requests_total", "counter", "Requests sent to the Spotify API.")
+    for endpoint, stats in endpoints.items():
+        for status, count in stats["statuses"].items():
+            sample("requests_total",
+                   {"endpoint": endpoint, "status": status}, count)
+    metric("request_seconds", "histogram", "Spotify API request latency.")
+    for endpoint, stats in endpoints.items():
+        cumulative = 0
+        for bound, count in stats["latency_buckets"].items():
+            cumulative += count
+            sample("request_seconds_bucket",
+                   {"endpoint": endpoint, "le": bound}, cumulative)
+        sample("request_seconds_sum", {"endpoint": endpoint}, stats["seconds"])
+        sample("request_seconds_count",
+               {"endpoint": endpoint}, stats["requests"])
+    for direction in ("sent", "received"):
+        name = "bytes_{}_total".format(direction)
+        metric(name, "counter", "Body bytes {} per endpoint.".format(direction))
+        for endpoint, stats in endpoints.items():
+            sample(name, {"endpoint": endpoint},
+                   stats["bytes_" + direction])
+    metric("retries_total", "counter", "Requests retried after 429 or 5xx.")
+    for endpoint, stats in endpoints.items():
+        sample("retries_total", {"endpoint": endpoint}, stats["retries"])
+    metric("phase_seconds", "gauge", "Time spent in each phase of the run.")
+    for phase, seconds in report["phases"].items():
+        sample("phase_seconds", {"phase": phase}, seconds)
+    metric("events_total", "counter", "Cache and lookup counters.")
+    for counter, value in report["counters"].items():
+        sample("events_total", {"counter": counter}, value)
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """cProfile for the calling thread and every thread started meanwhile."""
+
+    def __init__(self):
+        self.profilers = []
+        self.lock = threading.Lock()
+
+    def start_thread_profiler(self, *args) -> None:
+        # Runs once as the profile hook of each new thread, then hands over
+        # to a cProfile profiler of that thread's own
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter
+            return
+        with self.lock:
+            self.profilers.append(profiler)
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        main_profiler = cProfile.Profile()
+        self.profilers.append(main_profiler)
+        # From Python 3.12 one profiler sees every thread, and no other can
+        # be enabled beside it, so threads only get their own before that
+        per_thread = sys.version_info < SHARED_PROFILER_VERSION
+        if per_thread:
+            threading.setprofile(self.start_thread_profiler)
+        main_profiler.enable()
+        try:
+            yield
+        finally:
+            main_profiler.disable()
+            if per_thread:
+                threading.setprofile(None)
+
+    def write(self, path: str) -> None:
+        """Dump the merged statistics of all threads for pstats to load."""
+        stats = pstats.Stats(self.profilers[0])
+        for profiler in self.profilers[1:]:
+            try:
+                stats.add(profiler)
+            except TypeError:
+                # Threads that never got to run any profiled calls
+                continue
+        stats.dump_stats(path)
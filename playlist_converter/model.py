@@ -0,0 +1,127 @@
+from typing import Iterable, Iterator, List, NamedTuple, Union
+
+
+BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE62_VALUES = {char: value for value, char in enumerate(BASE62)}
+ID_LENGTH = 22
+# Each ID takes a tag byte and the 128-bit number its base62 text encodes
+SLOT_SIZE = 17
+NOT_FOUND, PACKED, UNPACKED = 0, 1, 2
+
+class TrackEntry(NamedTuple):
+    """A song from a playlist file, unpacking like a (track, artist) pair."""
+
+    track: str
+    artist: str
+
+
+class StringTable:
+    """One shared copy of each string, for names repeating across files."""
+
+    __slots__ = ("strings",)
+
+    def __init__(self):
+        self.strings = {}
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def clear(self) -> None:
+        self.strings = {}
+
+    def intern(self, text: str) -> str:
+        # setdefault is atomic, so worker threads can share the table
+        return self.strings.setdefault(text, text)
+
+    def entry(self, track: str, artist: str) -> TrackEntry:
+        # Artists repeat far more often than track names, so only they
+        # are shared
+        return TrackEntry(track, self.intern(artist))
+
+
+# Table shared by every file read during a run
+STRINGS = StringTable()
+
+class TrackIds:
+    """Track IDs, or None for songs not found, packed into 17 bytes each."""
+
+    __slots__ = ("data", "others")
+
+    def __init__(self, track_ids: Iterable[Union[str, None]] = ()):
+        self.data = bytearray()
+        # IDs that aren't 22 base62 characters are kept as they are
+        self.others = []
+        self.extend(track_ids)
+
+    def append(self, track_id: Union[str, None]) -> None:
+        if track_id is None:
+            self.data += bytes(SLOT_SIZE)
+            return
+        number = base62_number(track_id)
+        if number is None:
+            self.data.append(UNPACKED)
+            self.data += len(self.others).to_bytes(SLOT_SIZE - 1, "big")
+            self.others.append(track_id)
+        else:
+            self.data.append(PACKED)
+            self.data += number.to_bytes(SLOT_SIZE - 1, "big")
+
+    def extend(self, track_ids: Iterable[Union[str, None]]) -> None:
+        for track_id in track_ids:
+            self.append(track_id)
+
+    def __len__(self) -> int:
+        return len(self.data) // SLOT_SIZE
+
+    def __getitem__(
+            self,
+            index: Union[int, slice]
+            ) -> Union[str, None, List[Union[str, None]]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("track ID index out of range")
+        start = index * SLOT_SIZE
+        tag = self.data[start]
+        number = int.from_bytes(self.data[start + 1:start + SLOT_SIZE], "big")
+        if tag == NOT_FOUND:
+            return None
+        if tag == UNPACKED:
+            return self.others[number]
+        return base62_text(number)
+
+    def __iter__(self) -> Iterator[Union[str, None]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (TrackIds, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return "TrackIds({!r})".format(list(self))
+
+
+def base62_number(track_id: str) -> Union[int, None]:
+    # The number a Spotify ID encodes, or None if it isn't one
+    if len(track_id) != ID_LENGTH:
+        return None
+    number = 0
+    for char in track_id:
+        value = BASE62_VALUES.get(char)
+        if value is None:
+            return None
+        number = number * 62 + value
+    if number.bit_length() > 8 * (SLOT_SIZE - 1):
+        return None
+    return number
+
+def base62_text(number: int) -> str:
+    chars = []
+    for _ in range(ID_LENGTH):
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62[remainder])
+    return "".join(reversed(chars))
@@ -0,0 +1,210 @@
+import csv
+import json
+import os
+from functools import lru_cache
+from typing import Any, Iterator, List, Tuple, Union
+
+
+# What reading a malformed or unreadable playlist file can raise, including
+# UnicodeDecodeError and json's errors as ValueErrors
+READ_ERRORS = (OSError, ValueError, csv.Error)
+# Column headings, in lowercase, naming the track and artist columns of
+# CSV/TSV exports from other players
+TRACK_HEADINGS = {"track", "track name", "title", "song", "name"}
+ARTIST_HEADINGS = {"artist", "artists", "artist name", "artist name(s)",
+                   "artist(s)"}
+
+class DelimitedParser:
+    """Lines of a track and its artists split by the configured delimiter."""
+
+    # None reads files in the platform's default encoding
+    encoding = None
+    # Whether lines arrive stripped, or exactly as in the file
+    strip_lines = True
+
+    def playlist_name(self, lines: Iterator[str]) -> Union[str, None]:
+        # Assumption: Line with playlist name begins with "name:"
+        line = line_starts_with(lines, "name:")
+        if not line:
+            return None
+        colon_index = line.index(":")
+        return line[colon_index + 1:].strip()
+
+    def iter_items(
+            self,
+            lines: Iterator[str],
+            delimiter: str,
+            order: str) -> Iterator[Tuple[str, str]]:
+        # Assumption: Track name and artists separated by delimiter
+        track_index, artist_index = order_indices(order)
+        for ln in lines:
+            content = ln.split(delimiter)
+            if len(content) < 2:
+                continue
+            track = content[track_index].strip()
+            artist = content[artist_index].strip()
+            yield (track, artist)
+
+
+class CsvParser:
+    """Rows of a CSV or TSV export, with or without a heading row."""
+
+    # Exports often start with a byte order mark
+    encoding = "utf-8-sig"
+    # The csv module needs each row's leading separators and the newlines
+    # inside quoted fields
+    strip_lines = False
+
+    def __init__(self, separator: str):
+        self.separator = separator
+
+    def playlist_name(self, lines: Iterator[str]) -> Union[str, None]:
+        return None
+
+    def iter_items(
+            self,
+            lines: Iterator[str],
+            delimiter: str,
+            order: str) -> Iterator[Tuple[str, str]]:
+        # Columns are found by their headings, or else taken in data order
+        rows = csv.reader(lines, delimiter=self.separator)
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        headings = [heading.strip().lower() for heading in first_row]
+        track_index = find_heading(headings, TRACK_HEADINGS)
+        artist_index = find_heading(headings, ARTIST_HEADINGS)
+        if track_index is None or artist_index is None:
+            track_index, artist_index = order_indices(order)
+            rows = prepend(first_row, rows)
+        for row in rows:
+            if len(row) <= max(track_index, artist_index):
+                continue
+            track = row[track_index].strip()
+            artist = row[artist_index].strip()
+            if track and artist:
+                yield (track, artist)
+
+
+class M3uParser:
+    """Extended M3U playlists, reading songs from their #EXTINF titles."""
+
+    encoding = "utf-8-sig"
+    strip_lines = True
+
+    def playlist_name(self, lines: Iterator[str]) -> Union[str, None]:
+        line = line_starts_with(lines, "#playlist:")
+        if not line:
+            return None
+        return line[len("#playlist:"):].strip()
+
+    def iter_items(
+            self,
+            lines: Iterator[str],
+            delimiter: str,
+            order: str) -> Iterator[Tuple[str, str]]:
+        # Titles are "Artist - Track" by convention, whatever the data order
+        # of text files; entries without #EXTINF fall back to the file name
+        title = None
+        for ln in lines:
+            if ln.upper().startswith("#EXTINF:"):
+                title = ln.partition(",")[2]
+            elif ln and not ln.startswith("#"):
+                if title is None:
+                    title = os.path.splitext(os.path.basename(
+                        ln.replace("\\", "/")))[0]
+                artist, separator, track = title.partition(" - ")
+                if separator and track.strip() and artist.strip():
+                    yield (track.strip(), artist.strip())
+                title = None
+
+
+class JsonParser:
+    """JSON exports holding a list of tracks, alone or under a playlist."""
+
+    encoding = "utf-8-sig"
+    strip_lines = True
+
+    def playlist_name(self, lines: Iterator[str]) -> Union[str, None]:
+        playlist = json.loads("\n".join(lines))
+        if isinstance(playlist, dict):
+            name = playlist.get("name") or playlist.get("title")
+            if isinstance(name, str):
+                return name.strip()
+        return None
+
+    def iter_items(
+            self,
+            lines: Iterator[str],
+            delimiter: str,
+            order: str) -> Iterator[Tuple[str, str]]:
+        playlist = json.loads("\n".join(lines))
+        if isinstance(playlist, dict):
+            playlist = playlist.get("tracks") or playlist.get("items") or []
+        for entry in playlist:
+            song = json_song(entry)
+            if song is not None:
+                yield song
+
+
+# Parsers for each file extension; register_parser adds more
+PARSERS = {
+    ".txt": DelimitedParser(),
+    ".csv": CsvParser(","),
+    ".tsv": CsvParser("\t"),
+    ".m3u": M3uParser(),
+    ".m3u8": M3uParser(),
+    ".json": JsonParser()
+}
+
+def register_parser(extension: str, parser: Any) -> None:
+    """Read files with the extension, like ".xspf", using parser."""
+    PARSERS[extension.lower()] = parser
+
+def parser_for(filename: str) -> Union[Any, None]:
+    return PARSERS.get(os.path.splitext(filename)[1].lower())
+
+@lru_cache(maxsize=None)
+def order_indices(order: str) -> Tuple[int, int]:
+    # Positions of the track and artist for a data order of "track artist"
+    # or "artist track", worked out once instead of for every file
+    words = order.split()
+    return words.index("track"), words.index("artist")
+
+def line_starts_with(lines: Iterator[str], prefix: str) -> Union[str, None]:
+    # Return the first line beginning with prefix, or None.
+    for ln in lines:
+        if ln.lower().startswith(prefix):
+            return ln
+    return None
+
+def find_heading(headings: List[str], names: set) -> Union[int, None]:
+    for index, heading in enumerate(headings):
+        if heading in names:
+            return index
+    return None
+
+def prepend(first: Any, rest: Iterator) -> Iterator:
+    yield first
+    yield from rest
+
+def json_song(entry: Any) -> Union[Tuple[str, str], None]:
+    # Track and artists of one JSON entry, which may nest the song under
+    # "track" and name its artists as strings or objects with a "name"
+    if not isinstance(entry, dict):
+        return None
+    if isinstance(entry.get("track"), dict):
+        entry = entry["track"]
+    track = entry.get("track") or entry.get("trackName") or \
+        entry.get("name") or entry.get("title")
+    artists = entry.get("artist") or entry.get("artistName") or \
+        entry.get("artists")
+    if isinstance(artists, list):
+        names = [artist.get("name") if isinstance(artist, dict) else artist
+                 for artist in artists]
+        artists = ", ".join(name for name in names if isinstance(name, str))
+    if not isinstance(track, str) or not isinstance(artists, str):
+        return None
+    if not track.strip() or not artists.strip():
+        return None
+    return (track.strip(), artists.strip())
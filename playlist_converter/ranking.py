@@ -0,0 +1,74 @@
+from difflib import SequenceMatcher
+from statistics import median
+from typing import Dict, List, Tuple
+from .cache import normalize_text
+
+
+DEFAULT_SEARCH_LIMIT = 10
+# Results looked at for songs whose first page has no clear winner
+WIDE_SEARCH_LIMIT = 20
+# How far the best candidate's score must lead the next one's to be picked
+# without checking which candidates are saved; scores are between 0 and 1
+DEFAULT_RANK_MARGIN = 0.1
+# Best candidates scoring lower than this always get the saved-track check
+MIN_CONFIDENT_SCORE = 0.75
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.3
+DURATION_WEIGHT = 0.1
+POPULARITY_WEIGHT = 0.1
+
+def similarity(first: str, second: str) -> float:
+    # Ratio of matching characters after normalizing both texts
+    return SequenceMatcher(
+        None, normalize_text(first), normalize_text(second)).ratio()
+
+def artist_similarity(artist: str, result: Dict) -> float:
+    # Best match against any one artist of the result or all of them together
+    names = [found["name"] for found in result.get("artists", [])]
+    if not names:
+        return 0.0
+    return max(similarity(artist, name) for name in names + [", ".join(names)])
+
+def score_candidates(
+        track: str,
+        artist: str,
+        results: List[Dict]
+        ) -> List[float]:
+    """Score each search result between 0 and 1 as a match for the song."""
+    # Without a length in the playlist file, versions much longer or shorter
+    # than the typical result (live, extended, edits) score lower
+    durations = [result.get("duration_ms") for result in results]
+    typical = median([d for d in durations if d] or [0])
+    scores = []
+    for result, duration in zip(results, durations):
+        duration_score = 0.0
+        if duration and typical:
+            duration_score = max(0.0, 1 - abs(duration - typical) / typical)
+        scores.append(
+            TITLE_WEIGHT * similarity(track, result.get("name", "")) +
+            ARTIST_WEIGHT * artist_similarity(artist, result) +
+            DURATION_WEIGHT * duration_score +
+            POPULARITY_WEIGHT * result.get("popularity", 0) / 100)
+    return scores
+
+def rank_candidates(
+        track: str,
+        artist: str,
+        results: List[Dict]
+        ) -> Tuple[List[str], float]:
+    """Return result IDs from best to worst and how far the best leads."""
+    scores = score_candidates(track, artist, results)
+    # Sorting is stable, so ties keep Spotify's own order
+    ranked = sorted(zip(scores, [result["id"] for result in results]),
+                    key=lambda scored: scored[0], reverse=True)
+    if not ranked:
+        return [], 0.0
+    runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+    top = ranked[0][0]
+    # A poor best match never leads, however poor the others are
+    lead = top - runner_up if top >= MIN_CONFIDENT_SCORE else 0.0
+    return [tid for _, tid in ranked], lead
+
+def is_confident(lead: float, margin: float = DEFAULT_RANK_MARGIN) -> bool:
+    # Whether the best candidate can be picked without the saved check
+    return lead > margin
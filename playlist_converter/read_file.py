@@ -1,88 +1,181 @@
 import os
-from typing import List, Tuple, Union
+from fnmatch import fnmatch
+from itertools import repeat
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+from .model import STRINGS, TrackEntry
+from .parsers import PARSERS, READ_ERRORS, DelimitedParser, parser_for
+
+
+# Files each worker process parses per task
+PARSE_GROUP_SIZE = 64
+# Fewer files than this are parsed faster than worker processes start
+MIN_PARALLEL_FILES = 256
 
 
 class PlaylistFile:
     """File representation of a playlist."""
 
+    __slots__ = ("path", "filename", "parser", "parsed")
+
     def __init__(self, path: str, filename: str):
         self.path = path
         self.filename = filename
-        self.lines = self.clean_lines()
-
-    def clean_lines(self) -> List[str]:
-        # Return the lines of this object's file stripped of whitespace.
-        with open(self.path, "r") as f:
-            lines = f.readlines()
-        return [ln.strip() for ln in lines]
+        # Files of unknown formats are read as delimited text
+        self.parser = parser_for(filename) or DelimitedParser()
+        # Name and songs, when parsed ahead of time by parse_playlists
+        self.parsed = None
 
-    def line_starts_with(self, prefix: str) -> Union[str, None]:
-        # Return the first line beginning with prefix, or None.
-        for ln in self.lines:
-            if ln.lower().startswith(prefix):
-                return ln
-        return None
+    def clean_lines(self) -> Iterator[str]:
+        # Yield the lines of this object's file stripped of whitespace,
+        # reading one line at a time instead of the whole file. Parsers
+        # that don't strip lines get them as the file has them, newlines
+        # untranslated.
+        if not getattr(self.parser, "strip_lines", True):
+            with open(self.path, "r", encoding=self.parser.encoding,
+                      newline="") as f:
+                yield from f
+            return
+        with open(self.path, "r", encoding=self.parser.encoding) as f:
+            for ln in f:
+                yield ln.strip()
 
     def playlist_name(self) -> str:
-        """Return this playlist's name on a specific line or the filename."""
-        # Assumption: Line with playlist name begins with "name:"
-        line = self.line_starts_with("name:")
-        if not line:
-            return self.filename
-        colon_index = line.index(":")
-        return line[colon_index + 1:].strip()
+        """Return the name this playlist's file gives it or the filename."""
+        if self.parsed is not None:
+            return self.parsed[0]
+        name = self.parser.playlist_name(self.clean_lines())
+        if not name:
+            return os.path.basename(self.filename)
+        return name
 
     def playlist_items(
             self,
             delimiter: str,
-            order: str) -> List[Tuple[str, str]]:
+            order: str) -> List[TrackEntry]:
         """Return a list of pairs of song names and their respective artist."""
-        # Assumption: Track name and artists separated by delimiter
-        # Assumption: order argument is "track artist" or "artist track"
-        items = []
-        track_index = order.split().index("track")
-        artist_index = order.split().index("artist")
-        for ln in self.lines:
-            content = ln.split(delimiter)
-            if len(content) < 2:
-                continue
-            track = content[track_index].strip()
-            artist = content[artist_index].strip()
-            items.append((track, artist))
-        return items
-
-
-def directory_files(path: str) -> List[str]:
-    # Return the names of all files in a directory path
-    filenames = []
-    contents = os.listdir(path)
-    for entry in contents:
-        entry_path = os.path.join(path, entry)
-        if os.path.isfile(entry_path):
-            filenames.append(entry)
-    return filenames
-
-def filter_textfiles(filenames: List[str]) -> List[str]:
-    # Return the names of all files with a .txt extension
-    txtfile = lambda name: os.path.splitext(name)[1] == ".txt"
-    return [fn for fn in filenames if txtfile(fn)]
-
-def directory_textfiles(path: str) -> List[str]:
-    # Return the names of all text files in a directory path
-    if not os.path.isdir(path):
-        raise NotADirectoryError('"{}" is not a directory.'.format(path))
-    textfiles = filter_textfiles(directory_files(path))
-    if not textfiles:
-        message = '"{}" contains no textfiles'.format(path)
-        raise FileNotFoundError(message)
-    return textfiles
+        return list(self.iter_items(delimiter, order))
+
+    def iter_items(
+            self,
+            delimiter: str,
+            order: str) -> Iterator[TrackEntry]:
+        """Yield pairs of song names and their artist as the file is read."""
+        if self.parsed is not None:
+            yield from self.parsed[1]
+            return
+        items = self.parser.iter_items(self.clean_lines(), delimiter, order)
+        for track, artist in items:
+            yield STRINGS.entry(track, artist)
 
-def get_playlists(directory_path: str) -> List[PlaylistFile]:
+
+def scan_directory(
+        path: str,
+        include: Sequence[str],
+        exclude: Sequence[str] = (),
+        unchanged: Union[Dict[str, List[float]], None] = None
+        ) -> Iterator[Tuple[str, str, bool]]:
+    # Walk path and its subdirectories, yielding the path and relative path
+    # of each file matching an include glob, and whether it's unchanged
+    # since the [size, mtime] fingerprint recorded for it in unchanged.
+    # Directory entries carry their type, so only fingerprints need a stat.
+    pending = [("", path)]
+    while pending:
+        relative_dir, dir_path = pending.pop()
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                relative = os.path.join(relative_dir, entry.name)
+                if matches(relative, exclude) or matches(entry.name, exclude):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((relative, entry.path))
+                elif entry.is_file() and matches(entry.name, include):
+                    recorded = (unchanged or {}).get(entry.path)
+                    same = False
+                    if recorded is not None:
+                        stat = entry.stat()
+                        same = [stat.st_size, stat.st_mtime] == recorded
+                    yield entry.path, relative, same
+
+def matches(name: str, patterns: Sequence[str]) -> bool:
+    # Globs match regardless of case, so "*.csv" finds "export.CSV" too
+    return any(fnmatch(name.lower(), pattern.lower()) for pattern in patterns)
+
+def default_globs() -> List[str]:
+    # A glob for each file extension a parser is registered for
+    return ["*" + extension for extension in PARSERS]
+
+def split_globs(value: str) -> List[str]:
+    # Comma separated globs, like "*.csv, *.m3u8"
+    return [glob.strip() for glob in value.split(",") if glob.strip()]
+
+def get_playlists(
+        directory_path: str,
+        include: Union[Sequence[str], None] = None,
+        exclude: Sequence[str] = (),
+        unchanged: Union[Dict[str, List[float]], None] = None
+        ) -> List[PlaylistFile]:
     """Return a list of PlaylistFile objects for each file to convert."""
+    if not os.path.isdir(directory_path):
+        message = '"{}" is not a directory.'.format(directory_path)
+        raise NotADirectoryError(message)
     playlists = []
-    textfiles = directory_textfiles(directory_path)
-    for tf in textfiles:
-        tf_path = os.path.join(directory_path, tf)
-        tf_name = os.path.basename(tf_path)
-        playlists.append(PlaylistFile(tf_path, tf_name))
+    skipped = 0
+    found = scan_directory(
+        directory_path, include or default_globs(), exclude, unchanged)
+    for path, relative, same in found:
+        if same:
+            skipped += 1
+        else:
+            playlists.append(PlaylistFile(path, relative))
+    if not playlists and not skipped:
+        message = '"{}" contains no playlist files'.format(directory_path)
+        raise FileNotFoundError(message)
+    # Scandir order depends on the file system, so sort for stable runs
+    playlists.sort(key=lambda playlist: playlist.filename)
     return playlists
+
+def parse_group(
+        files: List[Tuple[str, str]],
+        delimiter: str,
+        order: str
+        ) -> List[Union[Tuple[str, Tuple[Tuple[str, str], ...]], None]]:
+    # Name and songs of each (path, filename) pair, run in a worker process.
+    # Files that can't be read give None, so the parent reads them again
+    # and reports the error alongside the other files.
+    parsed = []
+    for path, filename in files:
+        playlist = PlaylistFile(path, filename)
+        try:
+            items = tuple(playlist.iter_items(delimiter, order))
+            parsed.append((playlist.playlist_name(), items))
+        except READ_ERRORS:
+            parsed.append(None)
+    return parsed
+
+def parse_playlists(
+        playlists: List[PlaylistFile],
+        delimiter: str,
+        order: str,
+        processes: int
+        ) -> None:
+    """Parse many files at once on a pool of processes, keeping results."""
+    # Parsers added by register_parser only reach workers started by fork
+    if processes <= 1 or len(playlists) < MIN_PARALLEL_FILES:
+        return
+    groups = [playlists[start:start + PARSE_GROUP_SIZE]
+              for start in range(0, len(playlists), PARSE_GROUP_SIZE)]
+    tasks = [[(playlist.path, playlist.filename) for playlist in group]
+             for group in groups]
+    # Imported here, as loading multiprocessing slows every startup
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = executor.map(
+            parse_group, tasks, repeat(delimiter), repeat(order))
+        for group, parsed in zip(groups, results):
+            for playlist, result in zip(group, parsed):
+                if result is not None:
+                    # Strings arrive as new copies, so share them again
+                    name, items = result
+                    result = (name, tuple(STRINGS.entry(*item)
+                                          for item in items))
+                playlist.parsed = result
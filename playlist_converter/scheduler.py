@@ -0,0 +1,200 @@
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from threading import Condition, Lock
+from typing import Any, Callable, Union
+from requests import HTTPError, Response
+
+
+DEFAULT_RATE = 20.0
+DEFAULT_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+class TokenBucket:
+    """Lets through at most rate calls per second, in bursts up to capacity."""
+
+    def __init__(
+            self,
+            rate: float,
+            capacity: Union[float, None] = None,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep
+        ):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = self.clock()
+                elapsed = now - self.updated
+                self.tokens = min(
+                    self.capacity, self.tokens + elapsed * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class AdaptiveLimit:
+    """Concurrency limit that halves when throttled and slowly grows back."""
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.limit = self.maximum
+        self.active = 0
+        self.successes = 0
+        self.condition = Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def on_success(self) -> None:
+        # Additive increase: one more slot after a full limit of successes
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify()
+
+    def on_throttle(self) -> None:
+        # Multiplicative decrease whenever the server asks us to slow down
+        with self.condition:
+            self.limit = max(self.minimum, self.limit // 2)
+            self.successes = 0
+
+
+class RequestScheduler:
+    """Runs requests under a rate limit, retrying throttled and 5xx ones."""
+
+    def __init__(
+            self,
+            max_concurrency: int,
+            requests_per_second: float = DEFAULT_RATE,
+            max_retries: int = DEFAULT_RETRIES,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep
+        ):
+        self.limit = AdaptiveLimit(max_concurrency)
+        self.bucket = None
+        if requests_per_second > 0:
+            self.bucket = TokenBucket(
+                requests_per_second, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+        # Retry-After pauses every request, not just the throttled one
+        self.resume_at = 0.0
+        self.retries = 0
+        self.lock = Lock()
+
+    def run(
+            self,
+            send: Callable[[], Any],
+            idempotent: bool = True,
+            applied: Union[Callable[[], Any], None] = None,
+            on_retry: Union[Callable[[], None], None] = None
+        ) -> Any:
+        """Return the result of send(), retrying it when it's safe to."""
+        attempt = 0
+        while True:
+            self.wait_for_resume()
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                with self.limit:
+                    result = send()
+            except HTTPError as error:
+                delay = self.retry_delay(error.response, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                if not idempotent and is_server_error(error.response):
+                    # The server may have carried out the request before
+                    # failing, so it's only sent again if applied() finds
+                    # it wasn't, returning None, and else gives its result
+                    if applied is None:
+                        raise
+                    result = applied()
+                    if result is not None:
+                        return result
+                attempt += 1
+                with self.lock:
+                    self.retries += 1
+                if on_retry is not None:
+                    on_retry()
+                self.sleep(delay)
+            else:
+                self.limit.on_success()
+                return result
+
+    def wait_for_resume(self) -> None:
+        delay = self.resume_at - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+    def retry_delay(
+            self,
+            response: Union[Response, None],
+            attempt: int
+            ) -> Union[float, None]:
+        # Seconds to wait before retrying, or None if it shouldn't be retried
+        if response is not None and response.status_code == 429:
+            self.limit.on_throttle()
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            with self.lock:
+                self.resume_at = max(self.resume_at, self.clock() + delay)
+            return delay
+        if is_server_error(response):
+            return backoff_delay(attempt)
+        return None
+
+
+def is_server_error(response: Union[Response, None]) -> bool:
+    return response is not None and 500 <= response.status_code < 600
+
+
+def retry_after(response: Response) -> Union[float, None]:
+    # Seconds from a Retry-After header given in seconds or as an HTTP date
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+def backoff_delay(attempt: int) -> float:
+    # Exponential backoff with full jitter
+    ceiling = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(0, ceiling)
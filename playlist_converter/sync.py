@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+from array import array
+from difflib import SequenceMatcher
+from threading import Lock
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+from .model import TrackIds
+
+
+BLOCK_SIZE = 64 * 1024
+
+class SyncState:
+    """Playlists made from each file on earlier runs, to update in place."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        # Held while saving, so files converted meanwhile wait to be recorded
+        self.lock = Lock()
+
+    def load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path, "r") as state_file:
+                records = json.load(state_file)
+            for record in records.values():
+                if "items" in record:
+                    # Written by a version that kept every line's text
+                    record["item_hashes"] = item_hashes(record.pop("items"))
+                self.pack(record)
+            self.records = records
+
+    def get(self, file_path: str) -> Union[Dict, None]:
+        return self.records.get(file_path)
+
+    def set(
+            self,
+            file_path: str,
+            file_hash: str,
+            playlist_id: Union[str, None],
+            hashes: Sequence[int],
+            track_ids: List[Union[str, None]],
+            fingerprint: Union[List[float], None] = None
+            ) -> None:
+        record = {
+            "hash": file_hash,
+            "playlist_id": playlist_id,
+            "item_hashes": hashes,
+            "track_ids": track_ids,
+            "fingerprint": fingerprint
+        }
+        self.pack(record)
+        with self.lock:
+            self.records[file_path] = record
+
+    def pack(self, record: Dict) -> None:
+        # Keep a record's songs and IDs compactly, as runs may hold many:
+        # 8 bytes for each line's hash, and 17 for its track ID
+        record["item_hashes"] = array("Q", record["item_hashes"])
+        record["track_ids"] = TrackIds(record["track_ids"])
+
+    def fingerprints(self) -> Dict[str, List[float]]:
+        """Return the [size, mtime] of each file when it was last synced."""
+        return {file_path: record["fingerprint"]
+                for file_path, record in self.records.items()
+                if record.get("fingerprint")}
+
+    def save(self) -> None:
+        # Write to a temporary file first so a crash can't corrupt the state
+        temp_path = self.path + ".tmp"
+        with self.lock:
+            with open(temp_path, "w") as state_file:
+                json.dump(self.records, state_file, default=list)
+            os.replace(temp_path, self.path)
+
+
+def content_hash(path: str) -> str:
+    # Hash of a file's bytes, read in blocks
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def item_hash(item: Tuple[str, str]) -> int:
+    # 64-bit hash of a (track, artist) line, the same in every process
+    track, artist = item
+    digest = hashlib.blake2b(
+        "{}\n{}".format(track, artist).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+def item_hashes(items: Iterable[Tuple[str, str]]) -> array:
+    return array("Q", (item_hash(item) for item in items))
+
+def diff_items(
+        old_hashes: Sequence[int],
+        new_hashes: Sequence[int]
+        ) -> List[Tuple[str, int, int, int, int]]:
+    """Return the line-level edits turning old lines into new ones."""
+    matcher = SequenceMatcher(
+        None, list(old_hashes), list(new_hashes), autojunk=False)
+    return matcher.get_opcodes()
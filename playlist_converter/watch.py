@@ -0,0 +1,53 @@
+from typing import Dict, List, Sequence, Union
+from .journal import file_fingerprint
+from .read_file import PlaylistFile, default_globs, scan_directory
+
+
+DEFAULT_WATCH_INTERVAL = 2.0
+
+class DirectoryWatcher:
+    """Finds playlist files created or changed since the last poll."""
+
+    def __init__(
+            self,
+            path: str,
+            include: Union[Sequence[str], None] = None,
+            exclude: Sequence[str] = (),
+            known: Union[Dict[str, List[float]], None] = None
+        ):
+        self.path = path
+        self.include = include or default_globs()
+        self.exclude = exclude
+        # [size, mtime] of each file when it was last handed out
+        self.known = dict(known or {})
+        # Changed files seen once, handed out when they stop changing
+        self.settling = {}
+
+    def poll(self) -> List[PlaylistFile]:
+        """Return files changed since the last poll and no longer changing."""
+        # Unchanged files only cost a stat; nothing is read or hashed
+        ready = []
+        settling = {}
+        found = scan_directory(self.path, self.include, self.exclude,
+                               self.known)
+        for path, relative, same in found:
+            if same:
+                continue
+            try:
+                fingerprint = file_fingerprint(path)
+            except OSError:
+                # Removed since the scan saw it
+                continue
+            # A file still being written gets another poll to finish
+            if self.settling.get(path) == fingerprint:
+                self.known[path] = fingerprint
+                ready.append(PlaylistFile(path, relative))
+            else:
+                settling[path] = fingerprint
+        self.settling = settling
+        ready.sort(key=lambda playlist: playlist.filename)
+        return ready
+
+    def forget(self, path: str) -> None:
+        # Hand the file out again once it's polled next
+        self.known.pop(path, None)
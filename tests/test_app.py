@@ -1,7 +1,16 @@
+import gc
+import os
+import time
+import tracemalloc
+from array import array
 import unittest
 from unittest import mock
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
 from configparser import ConfigParser, NoSectionError, NoOptionError
+from requests import HTTPError
 from playlist_converter import app
+from playlist_converter.sync import item_hashes
 
 
 class TestApp(unittest.TestCase):
@@ -20,6 +29,18 @@ class TestApp(unittest.TestCase):
         mock_sys.exit.assert_called_once_with(1)
         self.assertTrue(mock_sys.stderr.flush.called)
 
+    def test_parse_args(self):
+        self.assertFalse(app.parse_args([]).resume)
+        self.assertTrue(app.parse_args(["--resume"]).resume)
+        args = app.parse_args(["--metrics", "run.prom", "--profile", "p"])
+        self.assertEqual((args.metrics, args.profile), ("run.prom", "p"))
+
+    def test_parse_args_watch(self):
+        self.assertTrue(app.parse_args(["--watch"]).watch)
+        with self.assertRaises(SystemExit), \
+                mock.patch("sys.stderr"):
+            app.parse_args(["--watch", "--apply", "b.json"])
+
     def test_quote_each_word(self):
         result = app.quote_each_word(["foo", "bar"])
         self.assertEqual(result, "'foo', 'bar'")
@@ -48,6 +69,23 @@ class TestApp(unittest.TestCase):
         self.assertTrue(parser_obj.read_file.called)
         self.assertIsInstance(result, ConfigParser)
 
+    def test_read_config_overrides(self):
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "config.ini")
+            with open(path, "w") as f:
+                f.write("[API]\nuser_id = me\naccess_token = old\n")
+            result = app.read_config(path, {"API": {"access_token": "new"},
+                                            "OPTIONS": {"max_files": "2"}})
+        self.assertEqual(dict(result["API"]),
+                         {"user_id": "me", "access_token": "new"})
+        self.assertEqual(result.getint("OPTIONS", "max_files"), 2)
+
+    @mock.patch("playlist_converter.app.os.path.exists")
+    def test_get_config_path_given(self, mock_exists):
+        mock_exists.return_value = True
+        self.assertEqual(app.get_config_path("other.ini"), "other.ini")
+        mock_exists.assert_called_once_with("other.ini")
+
     def config_values_error(self, parser, error, error_args):
         parser.get.side_effect = error(*error_args)
         app.get_config_values(parser)
@@ -65,6 +103,50 @@ class TestApp(unittest.TestCase):
         self.assertEqual(mock_parser_cls.get.call_count, 5)
         self.assertEqual(len(result), 5)
 
+    def test_get_option_values_default(self):
+        parser = ConfigParser()
+        result = app.get_option_values(parser)
+        self.assertEqual(result["max_workers"], app.DEFAULT_WORKERS)
+        self.assertEqual(result["parse_processes"], 1)
+        self.assertTrue(result["cache_path"].endswith("search_cache.db"))
+        self.assertEqual(result["cache_ttl_days"], app.DEFAULT_TTL_DAYS)
+
+    def test_open_search_cache_disabled(self):
+        options = {"cache_path": ""}
+        self.assertIsNone(app.open_search_cache(options))
+
+    def test_split_globs(self):
+        self.assertEqual(app.split_globs(" *.csv,*.m3u8 , "),
+                         ["*.csv", "*.m3u8"])
+        self.assertEqual(app.split_globs(""), [])
+
+    def test_open_saved_library_disabled(self):
+        self.assertIsNone(app.open_saved_library({"saved_index_path": ""}))
+
+    def test_open_sync_state_disabled(self):
+        self.assertIsNone(app.open_sync_state(""))
+
+    @mock.patch("playlist_converter.app.convert_files",
+                return_value=[("songs.txt", None)])
+    def test_convert_playlist_files_without_sync_state(self, mock_convert):
+        with TemporaryDirectory() as tempdir:
+            options = {"journal_path": os.path.join(tempdir, "j.jsonl"),
+                       "sync_state_path": "", "max_files": 1}
+            results = app.convert_playlist_files(
+                app.parse_args([]), options, [], None, "---", "track artist",
+                app.Metrics())
+            # No state is written, and the finished journal is cleared
+            self.assertEqual(os.listdir(tempdir), [])
+        self.assertEqual(results, [("songs.txt", None)])
+        self.assertIsNone(mock_convert.call_args[0][5])
+        self.assertFalse(os.path.exists(".tmp"))
+
+    def test_get_option_values_invalid(self):
+        parser = ConfigParser()
+        parser.read_dict({"OPTIONS": {"max_workers": "lots"}})
+        app.get_option_values(parser)
+        self.assertTrue(self.mock_error.called)
+
     @mock.patch("playlist_converter.app.quote_each_word", return_value="'foo'")
     def test_check_empty_found(self, mock_quote):
         app.check_empty(dict(foo="", bar="blah"))
@@ -85,5 +167,443 @@ class TestApp(unittest.TestCase):
             self.assertTrue(self.mock_error.called)
 
 
+    @mock.patch("playlist_converter.app.convert_file")
+    def test_convert_files_isolates_failures(self, mock_convert):
+        files = []
+        for filename in ["a.txt", "b.txt", "c.txt"]:
+            file = mock.create_autospec(app.PlaylistFile, instance=True)
+            file.filename = filename
+            files.append(file)
+        def convert(file, *args):
+            if file.filename == "b.txt":
+                raise HTTPError("401 Client Error")
+        mock_convert.side_effect = convert
+        results = app.convert_files(files, None, "---", "track artist",
+                                    max_files=3)
+        self.assertEqual([name for name, _ in results],
+                         ["a.txt", "b.txt", "c.txt"])
+        self.assertIsNone(results[0][1])
+        self.assertIn("401 Client Error", results[1][1])
+        self.assertIsNone(results[2][1])
+        self.assertEqual(mock_convert.call_count, 3)
+        self.assertFalse(self.mock_error.called)
+
+    def test_parse_args_manifest_modes_exclusive(self):
+        args = app.parse_args(["--resolve-only", "manifest.json"])
+        self.assertEqual(args.resolve_only, "manifest.json")
+        self.assertIsNone(args.apply)
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+            app.parse_args(["--resolve-only", "a.json", "--apply", "b.json"])
+
+    def test_resolve_files(self):
+        file = mock.create_autospec(app.PlaylistFile, instance=True)
+        file.filename, file.path = "a.txt", "dir/a.txt"
+        file.playlist_name.return_value = "a"
+        file.playlist_items.return_value = [("One", "A"), ("Two", "B")]
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        client.get_track_ids.return_value = iter(["id1", None])
+        results, entries = app.resolve_files(
+            [file], client, "---", "track artist")
+        self.assertEqual(results, [("a.txt", None)])
+        self.assertEqual(entries[0]["track_ids"], ["id1"])
+        self.assertEqual(entries[0]["unresolved"][0]["track"], "Two")
+        self.assertFalse(client.create_playlist.called)
+        self.assertFalse(client.add_playlist_tracks.called)
+
+    def test_apply_manifest(self):
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        client.dedupe = False
+        client.create_playlist.return_value = "pid"
+        client.tracks_posted.return_value = 0
+        entries = [
+            {"file": "dir/a.txt", "playlist": "a", "track_ids": ["id1"]},
+            {"file": "dir/b.txt", "playlist": "b", "track_ids": []}
+        ]
+        results = app.apply_manifest(entries, client)
+        self.assertEqual(results, [("a.txt", None), ("b.txt", None)])
+        client.create_playlist.assert_called_once_with("a")
+        client.add_playlist_tracks.assert_called_once_with(
+            "pid", ["spotify:track:id1"], 0, mock.ANY)
+        self.assertFalse(client.get_track_ids.called)
+
+    def test_apply_manifest_again_skips_finished_playlists(self):
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        client.dedupe = False
+        client.create_playlist.side_effect = ["pid_a", "pid_b"]
+        client.tracks_posted.side_effect = (
+            lambda checkpoint, found: checkpoint.tracks_posted)
+        def add_tracks(pid, uris, posted, on_batch):
+            if pid == "pid_b":
+                raise HTTPError("oops")
+            on_batch(len(uris), "snap")
+        client.add_playlist_tracks.side_effect = add_tracks
+        entries = [
+            {"file": "dir/a.txt", "playlist": "a", "track_ids": ["id1"]},
+            {"file": "dir/b.txt", "playlist": "b", "track_ids": ["id2"]}
+        ]
+        with TemporaryDirectory() as tmp:
+            journal_path = os.path.join(tmp, "journal.jsonl")
+            journal = app.open_journal(journal_path, True)
+            results = app.apply_manifest(entries, client, journal=journal)
+            journal.close()
+            self.assertIsNotNone(results[1][1])
+            client.add_playlist_tracks.reset_mock(side_effect=True)
+            journal = app.open_journal(journal_path, True)
+            results = app.apply_manifest(entries, client, journal=journal)
+            journal.close()
+        self.assertEqual(results, [("a.txt", None), ("b.txt", None)])
+        # The playlist left unfinished is filled in, not made again
+        self.assertEqual(client.create_playlist.call_count, 2)
+        client.add_playlist_tracks.assert_called_once_with(
+            "pid_b", ["spotify:track:id2"], 0, mock.ANY)
+
+    @mock.patch("playlist_converter.app.convert_files",
+                return_value=[("songs.txt", None)])
+    def test_apply_manifest_file_again_after_convert(self, mock_convert):
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        client.dedupe = False
+        client.create_playlist.return_value = "pid"
+        client.tracks_posted.return_value = 0
+        entries = [{"file": "dir/a.txt", "playlist": "a",
+                    "track_ids": ["id1"]}]
+        with TemporaryDirectory() as tmp:
+            manifest_path = os.path.join(tmp, "manifest.json")
+            options = {"journal_path": os.path.join(tmp, "journal.jsonl"),
+                       "sync_state_path": "", "max_files": 1}
+            app.apply_manifest_file(manifest_path, entries, client)
+            # A plain conversion clears its own journal, not the manifest's
+            app.convert_playlist_files(
+                app.parse_args([]), options, [], None, "---", "track artist",
+                app.Metrics())
+            results = app.apply_manifest_file(manifest_path, entries, client)
+            self.assertTrue(os.path.exists(manifest_path + ".journal"))
+        self.assertEqual(results, [("a.txt", None)])
+        client.create_playlist.assert_called_once_with("a")
+        self.assertEqual(client.add_playlist_tracks.call_count, 1)
+
+    @mock.patch("playlist_converter.app.sys")
+    def test_show_summary(self, mock_sys):
+        app.show_summary([("a.txt", None), ("b.txt", "oops")])
+        written = "".join(call[0][0] for call in
+                          mock_sys.stdout.write.call_args_list)
+        self.assertIn("Converted 'a.txt'", written)
+        self.assertIn("Failed to convert 'b.txt': oops", written)
+        self.mock_error.assert_called_once_with(
+            "1 of 2 file(s) failed to convert")
+
+    @mock.patch("playlist_converter.app.sys")
+    def test_show_summary_applied(self, mock_sys):
+        app.show_summary([("a.txt", None)], "apply")
+        mock_sys.stdout.write.assert_called_once_with("Made 'a.txt'\n")
+
+    @mock.patch("playlist_converter.app.sys")
+    def test_show_summary_all_converted(self, mock_sys):
+        app.show_summary([("a.txt", None)])
+        self.assertFalse(self.mock_error.called)
+
+    def test_record_items(self):
+        recorded = array("Q")
+        stream = app.record_items(iter([("a", "x"), ("b", "x")]), recorded)
+        self.assertEqual(next(stream), ("a", "x"))
+        self.assertEqual(recorded, item_hashes([("a", "x")]))
+        self.assertEqual(list(stream), [("b", "x")])
+        self.assertEqual(recorded, item_hashes([("a", "x"), ("b", "x")]))
+
+    @mock.patch("playlist_converter.app.content_hash", return_value="abc")
+    def test_convert_file_records_large_file_compactly(self, _):
+        lines = 50000
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "songs.txt")
+            with open(path, "w") as f:
+                for n in range(lines):
+                    f.write("Song number {}---Artist\n".format(n))
+            client = mock.create_autospec(app.SpotifyClient, instance=True)
+            client.make_playlist_with_tracks.side_effect = \
+                lambda name, stream, checkpoint: list(stream)
+            sync_state = app.SyncState(os.path.join(tempdir, "state.json"))
+            file = app.PlaylistFile(path, "songs.txt")
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                app.convert_file(file, client, "---", "track artist",
+                                 sync_state=sync_state)
+                gc.collect()
+                kept = tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+        record = sync_state.get(path)
+        self.assertEqual(len(record["item_hashes"]), lines)
+        # Each line is recorded by its hash, not by a copy of its text
+        self.assertLess(kept / lines, 12)
+
+    @mock.patch("playlist_converter.app.file_fingerprint",
+                return_value=[10, 2.0])
+    @mock.patch("playlist_converter.app.content_hash", return_value="abc")
+    def test_convert_file_sync_unchanged(self, *_):
+        file = mock.create_autospec(app.PlaylistFile, instance=True)
+        file.path = "songs.txt"
+        sync_state = mock.create_autospec(app.SyncState, instance=True)
+        sync_state.get.return_value = {
+            "hash": "abc", "playlist_id": "pid",
+            "item_hashes": item_hashes([["a", "x"]]), "track_ids": ["a-id"],
+            "fingerprint": [10, 1.0]}
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        app.convert_file(file, client, "---", "track artist",
+                         sync_state=sync_state, sync=True)
+        self.assertFalse(file.playlist_items.called)
+        self.assertFalse(client.make_playlist_with_tracks.called)
+        # A touched file keeps its record, but with its new fingerprint
+        sync_state.set.assert_called_once_with(
+            "songs.txt", "abc", "pid", item_hashes([["a", "x"]]), ["a-id"],
+            [10, 2.0])
+
+    @mock.patch("playlist_converter.app.file_fingerprint",
+                return_value=[10, 2.0])
+    @mock.patch("playlist_converter.app.content_hash", return_value="new")
+    def test_convert_file_sync_changed(self, *_):
+        file = mock.create_autospec(app.PlaylistFile, instance=True)
+        file.path = "songs.txt"
+        file.playlist_items.return_value = [("a", "x")]
+        sync_state = mock.create_autospec(app.SyncState, instance=True)
+        sync_state.get.return_value = {
+            "hash": "old", "playlist_id": "pid", "item_hashes": array("Q"),
+            "track_ids": []}
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        client.sync_playlist.return_value = ["a-id"]
+        app.convert_file(file, client, "---", "track artist",
+                         sync_state=sync_state, sync=True)
+        client.sync_playlist.assert_called_once_with(
+            "pid", array("Q"), [], [("a", "x")], mock.ANY)
+        self.assertFalse(client.make_playlist_with_tracks.called)
+        sync_state.set.assert_called_once_with(
+            "songs.txt", "new", "pid", item_hashes([("a", "x")]), ["a-id"],
+            [10, 2.0])
+
+
+    @mock.patch("playlist_converter.app.file_fingerprint",
+                return_value=[10, 2.0])
+    @mock.patch("playlist_converter.app.content_hash", return_value="new")
+    def test_convert_file_sync_fails_partway(self, *_):
+        file = mock.create_autospec(app.PlaylistFile, instance=True)
+        file.path = "songs.txt"
+        file.playlist_items.return_value = [("a", "x")]
+        sync_state = mock.create_autospec(app.SyncState, instance=True)
+        sync_state.get.return_value = {
+            "hash": "old", "playlist_id": "pid", "item_hashes": array("Q"),
+            "track_ids": []}
+        client = mock.create_autospec(app.SpotifyClient, instance=True)
+        def sync(pid, hashes, track_ids, items, on_failure):
+            on_failure([1], ["b-id"])
+            raise HTTPError("500 Server Error")
+        client.sync_playlist.side_effect = sync
+        with self.assertRaises(HTTPError):
+            app.convert_file(file, client, "---", "track artist",
+                             sync_state=sync_state, sync=True)
+        # Recorded without a hash, so the next run syncs from there
+        sync_state.set.assert_called_once_with(
+            "songs.txt", "", "pid", [1], ["b-id"])
+
+
+class TestAccounts(unittest.TestCase):
+    """Test converting the directories of several accounts in one run."""
+
+    def setUp(self):
+        patcher = mock.patch("playlist_converter.app.show_error")
+        self.mock_error = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.parser = ConfigParser()
+        self.parser.read_string(
+            "[API]\nuser_id = me\naccess_token = token\n"
+            "[API team]\nuser_id = team\naccess_token = team-token\n"
+            "directory_path = /team\nrequests_per_second = 5\n"
+            "refresh_token = team-refresh\n")
+        self.config = {"directory_path": "/mine", "data_order": "track artist",
+                       "data_delimiter": "---", "user_id": "me",
+                       "access_token": "token"}
+
+    def test_get_accounts(self):
+        first, team = app.get_accounts(self.parser, self.config)
+        self.assertEqual((first["name"], first["directory_path"]),
+                         ("", "/mine"))
+        self.assertIsNone(first["requests_per_second"])
+        self.assertEqual(team["name"], "team")
+        self.assertEqual(team["user_id"], "team")
+        self.assertEqual(team["directory_path"], "/team")
+        self.assertEqual(team["requests_per_second"], 5.0)
+        self.assertEqual(team["refresh_token"], "team-refresh")
+        self.assertEqual(team["client_id"], "")
+
+    def test_get_accounts_missing_key(self):
+        self.parser.remove_option("API team", "directory_path")
+        app.get_accounts(self.parser, self.config)
+        self.assertTrue(self.mock_error.called)
+
+    def test_account_options(self):
+        options = app.get_option_values(ConfigParser())
+        options["saved_index_path"] = ""
+        first, team = app.get_accounts(self.parser, self.config)
+        self.assertIs(app.account_options(options, first), options)
+        team_options = app.account_options(options, team)
+        self.assertTrue(team_options["sync_state_path"].endswith(
+            "sync_state-team.json"))
+        self.assertTrue(team_options["token_path"].endswith("token-team.json"))
+        self.assertEqual(team_options["saved_index_path"], "")
+        self.assertEqual(team_options["requests_per_second"], 5.0)
+        self.assertEqual(team_options["cache_path"], options["cache_path"])
+
+    @mock.patch("playlist_converter.app.open_sync_state")
+    @mock.patch("playlist_converter.app.open_journal")
+    @mock.patch("playlist_converter.app.open_token_provider",
+                return_value=None)
+    @mock.patch("playlist_converter.app.open_saved_library",
+                return_value=None)
+    @mock.patch("playlist_converter.app.find_playlist_files",
+                return_value=[])
+    @mock.patch("playlist_converter.app.convert_playlist_files")
+    def test_convert_accounts(self, mock_convert, *_):
+        clients = []
+        def convert(args, options, files, client, *rest):
+            clients.append(client)
+            return [("songs.txt", None)]
+        mock_convert.side_effect = convert
+        args = app.parse_args([])
+        options = app.get_option_values(ConfigParser())
+        accounts = app.get_accounts(self.parser, self.config)
+        metrics = app.Metrics()
+        results = app.convert_accounts(
+            args, accounts, self.config, options, None, metrics)
+        self.assertEqual(results, [("songs.txt", None),
+                                   ("team: songs.txt", None)])
+        mine, team = sorted(clients, key=lambda client: client.user_id)
+        # Connections and looked up songs are shared, tokens aren't
+        self.assertIs(mine.resolutions, team.resolutions)
+        self.assertIs(mine.songs, team.songs)
+        self.assertIs(mine.session.get_adapter("https://"),
+                      team.session.get_adapter("https://"))
+        self.assertIsNot(mine.scheduler, team.scheduler)
+        self.assertEqual(team.session.headers["Authorization"],
+                         "Bearer team-token")
+        self.assertEqual(team.scheduler.bucket.rate, 5.0)
+        self.assertEqual(metrics.counters["unique_songs"], 0)
+
+    @mock.patch("playlist_converter.app.open_sync_state")
+    @mock.patch("playlist_converter.app.open_journal")
+    @mock.patch("playlist_converter.app.open_token_provider",
+                return_value=None)
+    @mock.patch("playlist_converter.app.open_saved_library",
+                return_value=None)
+    @mock.patch("playlist_converter.app.convert_playlist_files")
+    @mock.patch("playlist_converter.app.get_playlist_files")
+    def test_convert_accounts_checks_every_directory_first(
+            self, mock_files, mock_convert, *_):
+        def find(path, *rest):
+            if path == "/team":
+                raise SystemExit(1)
+            return []
+        mock_files.side_effect = find
+        args = app.parse_args([])
+        options = app.get_option_values(ConfigParser())
+        accounts = app.get_accounts(self.parser, self.config)
+        with self.assertRaises(SystemExit):
+            app.convert_accounts(
+                args, accounts, self.config, options, None, app.Metrics())
+        # The [API] account's files aren't converted before the team's
+        # directory error ends the run
+        self.assertFalse(mock_convert.called)
+
+
+class TestWatchDirectory(unittest.TestCase):
+    """Test syncing files as a watched directory changes."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = os.path.join(self.tempdir.name, "playlists")
+        os.mkdir(self.root)
+        self.config = {"directory_path": self.root, "data_delimiter": "---",
+                       "data_order": "track artist"}
+        self.options = {"include_globs": [], "exclude_globs": [],
+                        "max_files": 2, "watch_interval": 0.01}
+        self.sync_state = app.SyncState(
+            os.path.join(self.tempdir.name, "state.json"))
+        self.client = mock.create_autospec(app.SpotifyClient, instance=True)
+
+    def write(self, filename):
+        path = os.path.join(self.root, filename)
+        with open(path, "w") as f:
+            f.write("Track---Artist\n")
+        return path
+
+    def watch_until(self, mock_convert, calls):
+        stop = Event()
+        watcher = Thread(target=app.watch_directory, args=(
+            self.config, self.options, self.client, self.sync_state, stop))
+        watcher.start()
+        deadline = time.monotonic() + 5
+        while mock_convert.call_count < calls and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+        stop.set()
+        watcher.join()
+
+    @mock.patch("playlist_converter.app.sys")
+    @mock.patch("playlist_converter.app.convert_file")
+    def test_converts_new_files(self, mock_convert, mock_sys):
+        path = self.write("songs.txt")
+        self.watch_until(mock_convert, 1)
+        file, client, delimiter, order, journal, sync_state, sync = \
+            mock_convert.call_args[0]
+        self.assertEqual(file.path, path)
+        self.assertIs(client, self.client)
+        self.assertIs(sync_state, self.sync_state)
+        self.assertTrue(sync)
+        mock_sys.stdout.write.assert_called_with("Converted 'songs.txt'\n")
+        # Progress is saved after every file
+        self.assertTrue(os.path.exists(self.sync_state.path))
+
+    @mock.patch("playlist_converter.app.sys")
+    @mock.patch("playlist_converter.app.convert_file")
+    def test_skips_files_synced_before(self, mock_convert, _):
+        path = self.write("songs.txt")
+        self.sync_state.set(path, "abc", "pid", [], [],
+                            app.file_fingerprint(path))
+        self.write("other.txt")
+        self.watch_until(mock_convert, 1)
+        converted = [call[0][0].filename
+                     for call in mock_convert.call_args_list]
+        self.assertEqual(converted, ["other.txt"])
+
+    @mock.patch("playlist_converter.app.sys")
+    @mock.patch("playlist_converter.app.convert_file")
+    def test_forgets_lookups_after_each_batch(self, mock_convert, _):
+        app.STRINGS.intern("Artist")
+        self.write("songs.txt")
+        stop = Event()
+        watcher = Thread(target=app.watch_directory, args=(
+            self.config, self.options, self.client, self.sync_state, stop))
+        watcher.start()
+        deadline = time.monotonic() + 5
+        while not self.client.forget_lookups.called and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+        stop.set()
+        watcher.join()
+        # Forgotten once the batch is done, and not again while idle
+        self.assertEqual(mock_convert.call_count, 1)
+        self.client.forget_lookups.assert_called_once_with()
+        self.assertEqual(len(app.STRINGS), 0)
+
+    @mock.patch("playlist_converter.app.sys")
+    @mock.patch("playlist_converter.app.convert_file",
+                side_effect=OSError("gone"))
+    def test_reports_failures_and_keeps_watching(self, mock_convert, mock_sys):
+        self.write("songs.txt")
+        self.watch_until(mock_convert, 1)
+        written = "".join(call[0][0] for call in
+                          mock_sys.stdout.write.call_args_list)
+        self.assertIn("Failed to convert 'songs.txt'", written)
+
+
 if __name__ == "__main__":
     unittest.main()
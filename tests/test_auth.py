@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from unittest import mock
+from urllib.parse import parse_qs
+import requests
+from playlist_converter import auth, client
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    """Issues access tokens and rejects API requests with stale ones."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        with self.server.lock:
+            self.server.refreshes += 1
+            self.server.token = "token{}".format(self.server.refreshes)
+            token = self.server.token
+        if form.get("refresh_token") != ["refresh"]:
+            self.send_json({"error": "invalid_grant"}, 400)
+        else:
+            self.send_json({"access_token": token, "token_type": "Bearer",
+                            "refresh_token": self.server.rotated})
+
+    def do_GET(self):
+        with self.server.lock:
+            valid = self.headers["Authorization"] == \
+                "Bearer " + self.server.token
+        self.send_json({"ok": valid}, 200 if valid else 401)
+
+    def send_json(self, body, status=200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTokenRefresh(unittest.TestCase):
+    """Test refreshing an expired token against a local token endpoint."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), TokenHandler)
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        host, port = cls.server.server_address[:2]
+        cls.base_url = "http://{}:{}".format(host, port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        # The token in the configuration file has already expired
+        self.server.token = "fresh"
+        self.server.refreshes = 0
+        self.server.rotated = None
+        patcher = mock.patch.object(
+            auth, "TOKEN_URL", self.base_url + "/api/token")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "token.json")
+
+    def make_client(self, refresh_token="refresh"):
+        tokens = auth.TokenProvider(
+            "expired", refresh_token, "client", "secret", self.path)
+        sp_client = client.SpotifyClient(
+            "expired", "user", max_workers=8, tokens=tokens)
+        self.addCleanup(sp_client.close)
+        return sp_client
+
+    def get(self, sp_client):
+        return sp_client.send("GET", {"url": self.base_url + "/v1/search"})
+
+    def test_refreshes_once_for_concurrent_requests(self):
+        sp_client = self.make_client()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda _: self.get(sp_client), range(16)))
+        self.assertTrue(all(result["ok"] for result in results))
+        self.assertEqual(self.server.refreshes, 1)
+        self.assertEqual(sp_client.tokens.refreshes, 1)
+        self.assertEqual(sp_client.session.headers["Authorization"],
+                         "Bearer token1")
+
+    def test_without_refresh_token(self):
+        sp_client = self.make_client(refresh_token="")
+        with self.assertRaises(requests.HTTPError):
+            self.get(sp_client)
+        self.assertEqual(self.server.refreshes, 0)
+
+    def test_failed_refresh(self):
+        sp_client = self.make_client(refresh_token="revoked")
+        with self.assertRaises(requests.HTTPError) as context:
+            self.get(sp_client)
+        self.assertEqual(context.exception.response.status_code, 400)
+
+    def test_rotated_refresh_token_is_saved(self):
+        self.server.rotated = "refresh"
+        sp_client = self.make_client()
+        self.get(sp_client)
+        self.assertFalse(os.path.exists(self.path))
+        self.server.rotated = "rotated"
+        self.server.token = "stale"
+        self.get(sp_client)
+        tokens = auth.TokenProvider("expired", "refresh", path=self.path)
+        tokens.load()
+        self.assertEqual(tokens.refresh_token, "rotated")
+
+    def test_client_id_without_secret(self):
+        tokens = auth.TokenProvider("expired", "refresh", "client")
+        with mock.patch.object(auth.requests, "post") as mock_post:
+            mock_post.return_value.json.return_value = {"access_token": "new"}
+            self.assertEqual(tokens.refresh("expired"), "new")
+            # A request rejected with the old token doesn't refresh again
+            self.assertEqual(tokens.refresh("expired"), "new")
+        mock_post.assert_called_once_with(
+            self.base_url + "/api/token",
+            data={"grant_type": "refresh_token", "refresh_token": "refresh",
+                  "client_id": "client"},
+            auth=None, timeout=None)
+
+
+if __name__ == "__main__":
+    unittest.main()
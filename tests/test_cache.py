@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+import unittest
+from unittest import mock
+from tempfile import TemporaryDirectory
+from playlist_converter import cache
+
+
+CACHE = "playlist_converter.cache"
+
+class TestSearchCache(unittest.TestCase):
+    """Test storing, expiring and evicting cached search results."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "cache.db")
+        self.instance = cache.SearchCache(self.path)
+        self.addCleanup(self.instance.connection.close)
+
+    def test_get_miss(self):
+        self.assertIsNone(self.instance.get("foo", "bar"))
+        self.assertEqual((self.instance.hits, self.instance.misses), (0, 1))
+
+    def test_put_then_get(self):
+        self.instance.put("Foo", "Bar", ["id1", "id2"], 0.25)
+        result = self.instance.get("  foo ", "BAR")
+        self.assertEqual(result, (["id1", "id2"], 0.25))
+        self.assertEqual((self.instance.hits, self.instance.misses), (1, 0))
+
+    def test_negative_result(self):
+        self.instance.put("foo", "bar", [])
+        self.assertEqual(self.instance.get("foo", "bar"), ([], 0.0))
+        self.assertEqual(self.instance.hits, 1)
+
+    def test_persists_between_instances(self):
+        self.instance.put("foo", "bar", ["id1"])
+        self.instance.close()
+        reopened = cache.SearchCache(self.path)
+        self.addCleanup(reopened.connection.close)
+        self.assertEqual(reopened.get("foo", "bar"), (["id1"], 0.0))
+
+    @mock.patch(CACHE + ".time")
+    def test_expired_entry(self, mock_time):
+        mock_time.time.return_value = 1000.0
+        self.instance.put("foo", "bar", ["id1"])
+        mock_time.time.return_value = 1000.0 + self.instance.ttl + 1
+        self.assertIsNone(self.instance.get("foo", "bar"))
+
+    @mock.patch(CACHE + ".time")
+    def test_evict_oldest_over_limit(self, mock_time):
+        self.instance.max_entries = 2
+        for stored_at, track in enumerate(["a", "b", "c"]):
+            mock_time.time.return_value = 1000.0 + stored_at
+            self.instance.put(track, "artist", [track])
+        self.instance.evict()
+        self.assertIsNone(self.instance.get("a", "artist"))
+        self.assertEqual(self.instance.get("c", "artist"), (["c"], 0.0))
+
+
+    def test_cache_without_lead_migrated(self):
+        self.instance.close()
+        os.remove(self.path)
+        connection = sqlite3.connect(self.path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE searches (key TEXT PRIMARY KEY, "
+                "track_ids TEXT NOT NULL, stored_at REAL NOT NULL)")
+            connection.execute("INSERT INTO searches VALUES (?, ?, ?)",
+                               ("foo\nbar", '["id1"]', time.time()))
+        connection.close()
+        reopened = cache.SearchCache(self.path)
+        self.addCleanup(reopened.connection.close)
+        self.assertEqual(reopened.get("foo", "bar"), (["id1"], 0.0))
+        reopened.put("baz", "bar", ["id2"], 0.5)
+        self.assertEqual(reopened.get("baz", "bar"), (["id2"], 0.5))
+
+
+class TestResolutionTable(unittest.TestCase):
+    """Test sharing lookups between repeats of a song."""
+
+    def test_repeats_share_lookup(self):
+        table = cache.ResolutionTable()
+        lookup = mock.Mock(return_value=["id1"])
+        self.assertEqual(table.resolve("Foo", "Bar", lookup), ["id1"])
+        self.assertEqual(table.resolve("foo", "bar ", lookup), ["id1"])
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual((table.hits, table.misses), (1, 1))
+
+    def test_concurrent_lookups_merge(self):
+        table = cache.ResolutionTable()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+        def slow_lookup():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ["id1"]
+        results = []
+        first = threading.Thread(target=lambda: results.append(
+            table.resolve("foo", "bar", slow_lookup)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(
+            table.resolve("foo", "bar", slow_lookup)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results, [["id1"], ["id1"]])
+        self.assertEqual(len(calls), 1)
+
+    def test_failed_lookup_retried(self):
+        table = cache.ResolutionTable()
+        lookup = mock.Mock(side_effect=[ValueError, ["id1"]])
+        with self.assertRaises(ValueError):
+            table.resolve("foo", "bar", lookup)
+        self.assertEqual(table.resolve("foo", "bar", lookup), ["id1"])
+
+
+class TestCacheHelpers(unittest.TestCase):
+    """Test the helper functions from the cache module."""
+
+    def test_normalize_key(self):
+        first = cache.normalize_key("Some  Track", " The Artist")
+        second = cache.normalize_key("some track", "the artist ")
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, cache.normalize_key("some", "track"))
+
+    def test_normalize_key_featuring(self):
+        expected = cache.normalize_key("Song feat. Guest", "Artist")
+        variants = ["Song (feat. Guest)", "Song ft. Guest",
+                    "Song [Featuring Guest]", "song FT guest"]
+        for variant in variants:
+            self.assertEqual(cache.normalize_key(variant, "Artist"), expected)
+        self.assertNotEqual(cache.normalize_key("Soft", "Artist"),
+                            cache.normalize_key("Sofeat", "Artist"))
+
+
+if __name__ == "__main__":
+    unittest.main()
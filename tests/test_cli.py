@@ -0,0 +1,114 @@
+import os
+import unittest
+from unittest import mock
+from tempfile import TemporaryDirectory
+from playlist_converter import cli
+
+
+class TestArgs(unittest.TestCase):
+    """Test parsing flags and config overrides."""
+
+    def test_config_setting(self):
+        self.assertEqual(cli.config_setting("API team.user_id=me=you"),
+                         ("API team", "user_id", "me=you"))
+        with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+            cli.parse_args(["--set", "max_files=8"])
+
+    def test_check_needs_directory_mode(self):
+        self.assertTrue(cli.parse_args(["--check", "--sync"]).check)
+        with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+            cli.parse_args(["--check", "--watch"])
+
+    def test_config_overrides(self):
+        args = cli.parse_args(["--set", "OPTIONS.max_files=2"])
+        environ = {"PLAYLIST_CONVERTER_OPTIONS__MAX_FILES": "8",
+                   "PLAYLIST_CONVERTER_API__ACCESS_TOKEN": "token",
+                   "PLAYLIST_CONVERTER_CONFIG": "other.ini",
+                   "HOME": "/root"}
+        self.assertEqual(cli.config_overrides(args, environ), {
+            "OPTIONS": {"max_files": "2"},
+            "API": {"access_token": "token"}})
+
+    @mock.patch.dict(os.environ, {"PLAYLIST_CONVERTER_CONFIG": "a.ini"})
+    def test_config_path_from_environment(self):
+        self.assertEqual(cli.parse_args([]).config, "a.ini")
+        self.assertEqual(cli.parse_args(["--config", "b.ini"]).config,
+                         "b.ini")
+
+
+class TestCheck(unittest.TestCase):
+    """Test skipping runs when no file or setting has changed."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = self.tempdir.name
+        self.directory = os.path.join(self.root, "playlists")
+        os.mkdir(self.directory)
+        self.write("playlists/songs.txt", "Track---Artist\n")
+        self.config_path = self.write("config.ini", "\n".join([
+            "[FILE_INFO]",
+            "directory_path = " + self.directory,
+            "[OPTIONS]",
+            "fingerprint_path = " + os.path.join(self.root, "fp.txt")]))
+        self.argv = ["--check", "--config", self.config_path]
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, filename, text):
+        path = os.path.join(self.root, filename)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def fingerprint(self, argv=None):
+        args = cli.parse_args(argv or self.argv)
+        return cli.directory_fingerprint(cli.read_check_config(args), args)
+
+    def test_fingerprint_changes(self):
+        first = self.fingerprint()
+        self.assertEqual(self.fingerprint(), first)
+        self.write("playlists/cover.jpg", "")
+        self.assertEqual(self.fingerprint(), first)
+        self.assertNotEqual(
+            self.fingerprint(self.argv + ["--set", "OPTIONS.max_files=2"]),
+            first)
+        self.assertNotEqual(self.fingerprint(self.argv + ["--sync"]), first)
+        self.write("playlists/more.txt", "Other---Artist\n")
+        self.assertNotEqual(self.fingerprint(), first)
+
+    def test_missing_directory(self):
+        os.remove(os.path.join(self.directory, "songs.txt"))
+        os.rmdir(self.directory)
+        self.assertIsNone(self.fingerprint())
+
+    @mock.patch("playlist_converter.app.run_app")
+    def test_main_skips_unchanged(self, mock_run):
+        cli.main(self.argv)
+        self.assertEqual(mock_run.call_count, 1)
+        with mock.patch("sys.stdout") as mock_stdout:
+            cli.main(self.argv)
+        self.assertEqual(mock_run.call_count, 1)
+        mock_stdout.write.assert_called_once_with(cli.nothing_changed_msg)
+        os.environ["PLAYLIST_CONVERTER_OPTIONS__MAX_FILES"] = "2"
+        cli.main(self.argv)
+        self.assertEqual(mock_run.call_count, 2)
+
+    @mock.patch("playlist_converter.app.run_app")
+    def test_main_failed_run_not_recorded(self, mock_run):
+        mock_run.side_effect = SystemExit(1)
+        with self.assertRaises(SystemExit):
+            cli.main(self.argv)
+        self.assertFalse(os.path.exists(os.path.join(self.root, "fp.txt")))
+
+    @mock.patch("playlist_converter.app.run_app")
+    def test_main_without_check(self, mock_run):
+        cli.main(["--sync"])
+        args = mock_run.call_args[1]["args"]
+        self.assertTrue(args.sync)
+        self.assertFalse(os.path.exists(os.path.join(self.root, "fp.txt")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,13 @@
 import unittest
-from unittest.mock import patch, create_autospec
+import threading
+import time
+from unittest.mock import ANY, Mock, patch, create_autospec
 from string import ascii_letters, digits
 from secrets import choice
 import requests
+from json import loads
 from playlist_converter import client
+from playlist_converter.sync import item_hashes
 
 
 CLIENT = "playlist_converter.client"
@@ -23,8 +27,11 @@ class TestSpotifyClient(unittest.TestCase):
         cls.fake_tids = [random_string(23) for _ in range(5)]
 
     def setUp(self):
-        auth_header = {"Authorization": "Bearer " + self.instance.access_token}
-        self.request_args = {"headers": auth_header}
+        self.instance.resolutions.clear()
+        self.instance.songs = client.SongIndex()
+        self.instance.saved_flags.clear()
+        self.request_args = {}
+        self.session_args = (self.instance.session, self.instance.timeout)
         patcher = patch(CLIENT + ".send_request")
         self.mock_request = patcher.start()
         self.addCleanup(patcher.stop)
@@ -32,12 +39,42 @@ class TestSpotifyClient(unittest.TestCase):
     def update_request_args(self, **kwargs):
         self.request_args = {**self.request_args, **kwargs}
 
+    def assert_sent_once(self, method):
+        self.mock_request.assert_called_once_with(
+            method, self.request_args, *self.session_args)
+
+    def test_send_with_metrics(self):
+        mock_metrics = create_autospec(client.Metrics, instance=True)
+        mock_metrics.instrument.return_value = {"url": "foo", "hooks": {}}
+        sp_client = client.SpotifyClient("token", "user", metrics=mock_metrics)
+        sp_client.send("GET", {"url": "foo"}, "search")
+        mock_metrics.instrument.assert_called_once_with("search", {"url": "foo"})
+        self.mock_request.assert_called_once_with(
+            "GET", {"url": "foo", "hooks": {}}, sp_client.session,
+            sp_client.timeout)
+
+    def test_send_records_retries_per_endpoint(self):
+        sp_metrics = client.Metrics()
+        sp_client = client.SpotifyClient("token", "user", metrics=sp_metrics)
+        error = requests.HTTPError(response=Mock(status_code=503))
+        self.mock_request.side_effect = [error, {"ok": True}]
+        with patch.object(sp_client.scheduler, "sleep"):
+            sp_client.send("GET", {"url": "foo"}, "search")
+        self.assertEqual(sp_metrics.endpoints["search"].retries, 1)
+        self.assertEqual(sp_metrics.retries, 1)
+
+    def test_session_auth_header(self):
+        auth_header = "Bearer " + self.instance.access_token
+        headers = self.instance.session.headers
+        self.assertEqual(headers["Authorization"], auth_header)
+
     def test_find_track_ids_request_helper(self):
         self.update_request_args(
             url=client.SEARCH_URL,
-            params={"q": "foo artist:bar", "type": "track", "limit": 20})
+            params={"q": "foo artist:bar", "type": "track",
+                    "limit": client.DEFAULT_SEARCH_LIMIT})
         self.instance.find_track_ids("foo", "bar")
-        self.mock_request.assert_called_once_with("GET", self.request_args)
+        self.assert_sent_once("GET")
 
     def test_find_track_ids_empty(self):
         self.mock_request.return_value = {"tracks": {"items": []}}
@@ -50,12 +87,180 @@ class TestSpotifyClient(unittest.TestCase):
         self.assertTrue(all(isinstance(tid, str) for tid in result_tids))
         self.assertListEqual(result_tids, self.fake_tids)
 
+    def test_find_track_ids_clear_winner(self):
+        items = [
+            {"id": "live", "name": "Foo - Live", "artists": [{"name": "Bar"}]},
+            {"id": "foo", "name": "Foo", "artists": [{"name": "Bar"}]},
+            {"id": "cover", "name": "Foo", "artists": [{"name": "Other"}]}
+        ]
+        self.mock_request.return_value = {"tracks": {"items": items}}
+        self.assertEqual(self.instance.find_track_ids("foo", "bar"), ["foo"])
+        self.assertEqual(self.instance.get_track_id("foo", "bar"), "foo")
+        self.assertEqual(self.mock_request.call_count, 1)
+
+    def test_find_track_ids_clear_winner_with_library(self):
+        items = [
+            {"id": "foo", "name": "Foo", "artists": [{"name": "Bar"}]},
+            {"id": "cover", "name": "Foo", "artists": [{"name": "Other"}]}
+        ]
+        self.mock_request.return_value = {"tracks": {"items": items}}
+        library = create_autospec(client.SavedLibrary, instance=True)
+        library.__contains__.side_effect = lambda tid: tid == "cover"
+        sp_client = client.SpotifyClient("token", "user", library=library)
+        sp_client.library_ready = True
+        # The version the user saved beats a confident top hit
+        self.assertEqual(sp_client.find_track_ids("foo", "bar"),
+                         ["foo", "cover"])
+        self.assertEqual(sp_client.get_track_id("foo", "bar"), "cover")
+
+    def test_find_track_ids_caches_every_candidate(self):
+        items = [
+            {"id": "foo", "name": "Foo", "artists": [{"name": "Bar"}]},
+            {"id": "cover", "name": "Foo", "artists": [{"name": "Other"}]}
+        ]
+        self.mock_request.return_value = {"tracks": {"items": items}}
+        mock_cache = create_autospec(client.SearchCache, instance=True)
+        mock_cache.get.return_value = None
+        sp_client = client.SpotifyClient("token", "user", cache=mock_cache)
+        self.assertEqual(sp_client.find_track_ids("foo", "bar"), ["foo"])
+        track_ids, lead = mock_cache.put.call_args[0][2:]
+        self.assertEqual(track_ids, ["foo", "cover"])
+        self.assertGreater(lead, client.DEFAULT_RANK_MARGIN)
+
+    def test_find_track_ids_cache_hit_uses_rank_margin(self):
+        mock_cache = create_autospec(client.SearchCache, instance=True)
+        mock_cache.get.return_value = (["foo", "cover"], 0.3)
+        sp_client = client.SpotifyClient(
+            "token", "user", cache=mock_cache, rank_margin=0.5)
+        self.assertEqual(sp_client.find_track_ids("foo", "bar"),
+                         ["foo", "cover"])
+
+    def test_search_track_ids_next_page_without_winner(self):
+        first = [{"id": "t{}".format(n)} for n in range(10)]
+        second = [{"id": "t{}".format(n)} for n in range(10, 15)]
+        self.mock_request.side_effect = [
+            {"tracks": {"items": first}}, {"tracks": {"items": second}}]
+        track_ids, _ = self.instance.search_track_ids("foo", "bar")
+        self.assertEqual(len(track_ids), 15)
+        params = self.mock_request.call_args[0][1]["params"]
+        self.assertEqual((params["limit"], params["offset"]), (10, 10))
+
+    def test_find_track_ids_cache_hit(self):
+        mock_cache = create_autospec(client.SearchCache, instance=True)
+        mock_cache.get.return_value = (self.fake_tids, 0.0)
+        sp_client = client.SpotifyClient("token", "user", cache=mock_cache)
+        self.assertEqual(sp_client.find_track_ids("foo", "bar"), self.fake_tids)
+        self.assertFalse(self.mock_request.called)
+        self.assertFalse(mock_cache.put.called)
+
+    def test_find_track_ids_cache_miss(self):
+        mock_cache = create_autospec(client.SearchCache, instance=True)
+        mock_cache.get.return_value = None
+        self.mock_request.return_value = {"tracks": {"items": []}}
+        sp_client = client.SpotifyClient("token", "user", cache=mock_cache)
+        self.assertEqual(sp_client.find_track_ids("foo", "bar"), [])
+        mock_cache.put.assert_called_once_with("foo", "bar", [], 0.0)
+
+    def test_find_track_ids_repeats_share_search(self):
+        items = [{"id": _id} for _id in self.fake_tids]
+        self.mock_request.return_value = {"tracks": {"items": items}}
+        first = self.instance.find_track_ids("Foo ft. Baz", "Bar")
+        second = self.instance.find_track_ids("foo (feat. baz)", " bar")
+        self.assertEqual(first, second)
+        self.assertEqual(self.mock_request.call_count, 1)
+        self.assertEqual(self.instance.resolutions.hits, 1)
+
+    def test_find_track_ids_counts_tiers(self):
+        self.mock_request.return_value = {"tracks": {"items": []}}
+        sp_client = client.SpotifyClient("token", "user")
+        sp_client.find_track_ids("foo", "bar")
+        sp_client.find_track_ids("foo", "bar")
+        self.assertEqual(sp_client.tiers["unresolved"], 2)
+        self.assertEqual(sp_client.tiers["search"], 0)
+
+    def test_find_track_ids_misspelling_from_index(self):
+        items = [{"id": "queen", "name": "Bohemian Rhapsody",
+                  "artists": [{"name": "Queen"}]}]
+        self.mock_request.return_value = {"tracks": {"items": items}}
+        self.instance.find_track_ids("Bohemian Rhapsody", "Queen")
+        self.mock_request.return_value = {"tracks": {"items": []}}
+        result = self.instance.find_track_ids("Bohemian Rapsody", "Queen")
+        self.assertEqual(result, ["queen"])
+        # Only the strict search was sent for the misspelled song
+        self.assertEqual(self.mock_request.call_count, 2)
+        self.assertEqual(self.instance.tiers["index"], 1)
+
+    def test_find_track_ids_corrected_search(self):
+        items = [{"id": "queen", "name": "Bohemian Rhapsody",
+                  "artists": [{"name": "Queen"}]}]
+        self.mock_request.return_value = {"tracks": {"items": items}}
+        self.instance.find_track_ids("Bohemian Rhapsody", "Queen")
+        pressure = [{"id": "pressure", "name": "Under Pressure",
+                     "artists": [{"name": "Queen"}]}]
+        queries = []
+        def search(method, request_args, *_):
+            queries.append(request_args["params"]["q"])
+            found = pressure if "artist:queen" in queries[-1] else []
+            return {"tracks": {"items": found}}
+        self.mock_request.side_effect = search
+        result = self.instance.find_track_ids("Under Pressure", "Quen")
+        self.assertEqual(result, ["pressure"])
+        self.assertEqual(queries, ["Under Pressure artist:Quen",
+                                   "under pressure artist:queen"])
+        self.assertEqual(self.instance.tiers["corrected_search"], 1)
+
+    def test_find_track_ids_cached_miss_uses_index(self):
+        mock_cache = create_autospec(client.SearchCache, instance=True)
+        mock_cache.get.return_value = ([], 0.0)
+        sp_client = client.SpotifyClient("token", "user", cache=mock_cache)
+        sp_client.songs.add("Bohemian Rhapsody", "Queen", "queen")
+        result = sp_client.find_track_ids("Bohemian Rapsody", "Queen")
+        self.assertEqual(result, ["queen"])
+        self.assertFalse(self.mock_request.called)
+        # The index's guess isn't saved as if Spotify had found it
+        self.assertFalse(mock_cache.put.called)
+        self.assertEqual(sp_client.tiers["index"], 1)
+
+    def test_find_track_ids_index_match_not_cached(self):
+        mock_cache = create_autospec(client.SearchCache, instance=True)
+        mock_cache.get.return_value = None
+        self.mock_request.return_value = {"tracks": {"items": []}}
+        sp_client = client.SpotifyClient("token", "user", cache=mock_cache)
+        sp_client.songs.add("Bohemian Rhapsody", "Queen", "queen")
+        result = sp_client.find_track_ids("Bohemian Rapsody", "Queen")
+        self.assertEqual(result, ["queen"])
+        # The search's miss is cached, so later runs try the index again
+        mock_cache.put.assert_called_once_with(
+            "Bohemian Rapsody", "Queen", [], 0.0)
+
+    def test_forget_lookups(self):
+        self.mock_request.return_value = {"tracks": {"items": []}}
+        sp_client = client.SpotifyClient("token", "user")
+        sp_client.find_track_ids("foo", "bar")
+        sp_client.songs.add("Foo", "Bar", "id1")
+        sp_client.saved_flags["id1"] = True
+        sp_client.library_ready = True
+        sp_client.forget_lookups()
+        # A song not found before is searched for again
+        sp_client.find_track_ids("foo", "bar")
+        self.assertEqual(self.mock_request.call_count, 2)
+        self.assertEqual(len(sp_client.songs), 0)
+        self.assertFalse(sp_client.saved_flags)
+        self.assertFalse(sp_client.library_ready)
+
+    def test_find_saved_tracks_remembers_flags(self):
+        self.mock_request.return_value = [False, True]
+        self.instance.find_saved_tracks([["a", "b"]])
+        result = self.instance.find_saved_tracks([["b"], ["a"]])
+        self.assertEqual(result, ["b", None])
+        self.mock_request.assert_called_once()
+
     def test_find_saved_track_request_helper(self):
         self.update_request_args(
             url=client.CONTAINS_URL,
             params={"ids": self.fake_tids})
         self.instance.find_saved_track(self.fake_tids)
-        self.mock_request.assert_called_once_with("GET", self.request_args)
+        self.assert_sent_once("GET")
 
     @patch(CLIENT + ".first_saved", return_value=None)
     def test_find_saved_track_none(self, mock_first):
@@ -90,15 +295,101 @@ class TestSpotifyClient(unittest.TestCase):
         result = self.instance.get_track_id("foo", "bar")
         self.assertEqual(result, self.fake_tids[4])
 
+    @patch(CLIENT + ".SpotifyClient.find_saved_tracks")
+    @patch(CLIENT + ".SpotifyClient.find_track_ids")
+    def test_get_track_ids_keeps_order(self, mock_find_tracks, mock_saved):
+        mock_find_tracks.side_effect = lambda track, artist: [track, "other"]
+        mock_saved.side_effect = lambda found: [None] * len(found)
+        pairs = [(tid, "artist") for tid in self.fake_tids]
+        result = list(self.instance.get_track_ids(pairs))
+        self.assertEqual(result, self.fake_tids)
+
+    @patch(CLIENT + ".SpotifyClient.find_saved_tracks")
+    @patch(CLIENT + ".SpotifyClient.find_track_ids")
+    def test_get_track_ids_matches_get_track_id(self, mock_find, mock_saved):
+        candidates = {"a": [], "b": ["b1", "b2"], "c": ["c1", "c2"]}
+        mock_find.side_effect = lambda track, artist: candidates[track]
+        mock_saved.return_value = [None, "c2"]
+        pairs = [("a", "x"), ("b", "x"), ("c", "x")]
+        result = list(self.instance.get_track_ids(pairs))
+        self.assertEqual(result, [None, "b1", "c2"])
+        mock_saved.assert_called_once_with([["b1", "b2"], ["c1", "c2"]])
+
+    @patch(CLIENT + ".SpotifyClient.find_saved_tracks")
+    @patch(CLIENT + ".SpotifyClient.find_track_ids")
+    def test_get_track_ids_single_candidate(self, mock_find, mock_saved):
+        candidates = {"a": ["a1"], "b": ["b1", "b2"]}
+        mock_find.side_effect = lambda track, artist: candidates[track]
+        mock_saved.return_value = ["b2"]
+        result = list(self.instance.get_track_ids([("a", "x"), ("b", "x")]))
+        self.assertEqual(result, ["a1", "b2"])
+        mock_saved.assert_called_once_with([["b1", "b2"]])
+
+    def test_check_saved_with_library(self):
+        index = client.SavedLibrary("unused.json")
+        sp_client = client.SpotifyClient("token", "user", library=index)
+        page = {"items": [{"added_at": "2021-01-01T00:00:00Z",
+                           "track": {"id": "b"}}],
+                "total": 1, "next": None}
+        self.mock_request.return_value = page
+        with patch.object(index, "save") as mock_save:
+            self.assertEqual(sp_client.check_saved(["a", "b"]), [False, True])
+            self.assertEqual(sp_client.find_saved_track(["a", "b"]), "b")
+        self.mock_request.assert_called_once_with(
+            "GET", {"url": client.SAVED_TRACKS_URL,
+                    "params": {"limit": client.SAVED_PAGE_SIZE, "offset": 0}},
+            sp_client.session, sp_client.timeout)
+        mock_save.assert_called_once_with()
+
+    def test_find_saved_tracks_batches_ids(self):
+        candidate_lists = [["s{}-{}".format(song, n) for n in range(20)]
+                           for song in range(6)]
+        saved_ids = {"s1-3", "s4-0", "s4-9"}
+        self.mock_request.side_effect = lambda method, args, *_: [
+            tid in saved_ids for tid in args["params"]["ids"]]
+        result = self.instance.find_saved_tracks(candidate_lists)
+        expected = [client.first_saved([(tid, tid in saved_ids) for tid in ids])
+                    for ids in candidate_lists]
+        self.assertEqual(result, expected)
+        self.assertEqual(self.mock_request.call_count, 3)
+        for call in self.mock_request.call_args_list:
+            self.assertLessEqual(len(call[0][1]["params"]["ids"]), 50)
+
+    def test_find_saved_tracks_shared_ids(self):
+        self.mock_request.return_value = [False, True]
+        result = self.instance.find_saved_tracks([["a", "b"], ["b", "a"]])
+        self.assertEqual(result, ["b", "b"])
+        self.mock_request.assert_called_once()
+
+    def test_send_caps_requests_in_flight(self):
+        # Local stub of the API that records how many calls overlap
+        lock, active, peak = threading.Lock(), [0], [0]
+        def stub_request(method, request_args, *session_args):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return {"tracks": {"items": []}}
+        self.mock_request.side_effect = stub_request
+        sp_client = client.SpotifyClient("token", "user", max_workers=3)
+        pairs = [("track {}".format(n), "artist") for n in range(12)]
+        result = list(sp_client.get_track_ids(pairs))
+        self.assertEqual(result, [None] * 12)
+        self.assertEqual(self.mock_request.call_count, 12)
+        self.assertGreater(peak[0], 1)
+        self.assertLessEqual(peak[0], 3)
+
     @patch(CLIENT + ".dumps", return_value="pname")
     def test_create_playlist_send_request(self, mock_dumps):
         new_header = {"Content-Type": "application/json"}
         self.update_request_args(
             url=client.PLAYLIST_URL.format(self.instance.user_id),
-            headers={**self.request_args["headers"], **new_header},
+            headers=new_header,
             data="pname")
         self.instance.create_playlist("pname")
-        self.mock_request.assert_called_once_with("POST", self.request_args)
+        self.assert_sent_once("POST")
         mock_dumps.assert_called_once_with({"name": "pname"})
 
     def test_create_playlist_return_value(self):
@@ -106,24 +397,339 @@ class TestSpotifyClient(unittest.TestCase):
             self.mock_request.return_value = {"id": "abc"}
             self.assertEqual(self.instance.create_playlist("foo"), "abc")
 
-    @patch(CLIENT + ".subsets_of_size", return_value=[["foo"]])
+    def test_create_playlist_made_before_server_error(self):
+        error = requests.HTTPError(response=Mock(status_code=502))
+        newest = {"id": "abc", "name": "foo", "tracks": {"total": 0}}
+        self.mock_request.side_effect = [error, {"items": [newest]}]
+        self.assertEqual(self.instance.create_playlist("foo"), "abc")
+        methods = [call[0][0] for call in self.mock_request.call_args_list]
+        self.assertEqual(methods, ["POST", "GET"])
+
+    def test_create_playlist_not_made_before_server_error(self):
+        error = requests.HTTPError(response=Mock(status_code=502))
+        other = {"id": "old", "name": "foo", "tracks": {"total": 3}}
+        self.mock_request.side_effect = [
+            error, {"items": [other]}, {"id": "abc"}]
+        with patch.object(self.instance.scheduler, "sleep"):
+            self.assertEqual(self.instance.create_playlist("foo"), "abc")
+        methods = [call[0][0] for call in self.mock_request.call_args_list]
+        self.assertEqual(methods, ["POST", "GET", "POST"])
+
     @patch(CLIENT + ".dumps", return_value="foobar")
-    def test_add_playlist_tracks_one_request(self, mock_dumps, _):
+    def test_add_playlist_tracks_one_request(self, mock_dumps):
         new_header = {"Content-Type": "application/json"}
         self.update_request_args(
             url=client.ADD_TRACK_URL.format("bar"),
-            headers={**self.request_args["headers"], **new_header},
+            headers=new_header,
             data="foobar")
         self.instance.add_playlist_tracks("bar", ["foo"])
-        self.mock_request.assert_called_once_with("POST", self.request_args)
+        self.assert_sent_once("POST")
         mock_dumps.assert_called_once_with({"uris": ["foo"]})
 
-    @patch(CLIENT + ".subsets_of_size", return_value=[["foo1"], ["foo2"]])
+    @patch(CLIENT + ".dumps", side_effect=lambda body: body)
+    def test_add_playlist_tracks_multiple_requests(self, mock_dumps):
+        uris = ("uri{}".format(n) for n in range(250))
+        self.instance.add_playlist_tracks("bar", uris)
+        sizes = [len(call[0][0]["uris"]) for call in mock_dumps.call_args_list]
+        self.assertEqual(sizes, [100, 100, 50])
+        self.assertEqual(self.mock_request.call_count, 3)
+
+    @patch(CLIENT + ".dumps", side_effect=lambda body: body)
+    def test_add_playlist_tracks_dedupe(self, mock_dumps):
+        sp_client = client.SpotifyClient("token", "user", dedupe=True)
+        sp_client.add_playlist_tracks("bar", ["a", "b", "a", "c", "b"])
+        mock_dumps.assert_called_once_with({"uris": ["a", "b", "c"]})
+
+    def test_post_playlist_tracks_snapshot(self):
+        self.mock_request.return_value = {"snapshot_id": "snap"}
+        on_batch = Mock()
+        result = self.instance.post_playlist_tracks("pid", ["a"], on_batch)
+        self.assertEqual(result, "snap")
+        on_batch.assert_called_once_with(1, "snap")
+
+    def test_post_playlist_tracks_landed_before_failure(self):
+        # The batch was added, but the connection dropped before the reply
+        self.mock_request.side_effect = [
+            requests.ConnectionError("reset"),
+            {"snapshot_id": "snap", "tracks": {"total": 102}}]
+        on_batch = Mock()
+        self.instance.post_playlist_tracks("pid", ["a", "b"], on_batch, 100)
+        on_batch.assert_called_once_with(2, "snap")
+        self.assertEqual(self.mock_request.call_args[0][1]["url"],
+                         client.PLAYLIST_STATE_URL.format("pid"))
+
+    def test_post_playlist_tracks_failed(self):
+        self.mock_request.side_effect = [
+            requests.ConnectionError("reset"),
+            {"snapshot_id": "old", "tracks": {"total": 100}}]
+        on_batch = Mock()
+        with self.assertRaises(requests.ConnectionError):
+            self.instance.post_playlist_tracks(
+                "pid", ["a", "b"], on_batch, 100)
+        self.assertFalse(on_batch.called)
+
+    @patch(CLIENT + ".SpotifyClient.post_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.create_playlist", return_value="pid")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks(self, mock_ids, mock_create, mock_post):
+        mock_ids.side_effect = lambda pairs: iter([p[0] for p in pairs])
+        checkpoint = client.FileCheckpoint()
+        self.instance.make_playlist_with_tracks(
+            "name", [("a", "x"), ("b", "x")], checkpoint)
+        mock_create.assert_called_once_with("name")
+        mock_post.assert_called_once_with(
+            "pid", ["spotify:track:a", "spotify:track:b"],
+            checkpoint.add_batch, 0)
+        self.assertTrue(checkpoint.done)
+
+    @patch(CLIENT + ".SpotifyClient.create_playlist", return_value="pid")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_streams(self, mock_ids, mock_create):
+        # Batches are posted in order while later songs are still resolved
+        events = []
+        def track_ids(pairs):
+            for track, _ in pairs:
+                events.append("resolve")
+                yield track
+        mock_ids.side_effect = track_ids
+        def post(method, request_args, *_):
+            events.append(len(loads(request_args["data"])["uris"]))
+            return {"snapshot_id": "snap"}
+        self.mock_request.side_effect = post
+        songs = [("t{}".format(n), "x") for n in range(250)]
+        checkpoint = client.FileCheckpoint()
+        self.instance.make_playlist_with_tracks("name", songs, checkpoint)
+        self.assertEqual([e for e in events if e != "resolve"], [100, 100, 50])
+        # The first batch was posted before the last songs were resolved
+        self.assertIn("resolve", events[events.index(100):])
+        mock_create.assert_called_once_with("name")
+        self.assertEqual(checkpoint.tracks_posted, 250)
+        self.assertEqual(len(checkpoint.track_ids), 250)
+
+    @patch(CLIENT + ".SpotifyClient.post_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.create_playlist", return_value="pid")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_skips_not_found(self, mock_ids,
+                                                       mock_create, mock_post):
+        mock_ids.side_effect = lambda pairs: iter(["a", None, "c"])
+        checkpoint = client.FileCheckpoint()
+        self.instance.make_playlist_with_tracks(
+            "name", [("a", "x"), ("b", "x"), ("c", "x")], checkpoint)
+        mock_post.assert_called_once_with(
+            "pid", ["spotify:track:a", "spotify:track:c"],
+            checkpoint.add_batch, 0)
+        self.assertEqual(checkpoint.track_ids, ["a", None, "c"])
+
+    @patch(CLIENT + ".SpotifyClient.create_playlist")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_none_found(self, mock_ids,
+                                                  mock_create):
+        mock_ids.side_effect = lambda pairs: iter([None])
+        self.instance.make_playlist_with_tracks("name", [("a", "x")])
+        self.assertFalse(mock_create.called)
+        self.assertFalse(self.mock_request.called)
+
+    @patch(CLIENT + ".SpotifyClient.post_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.create_playlist")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_resume(self, mock_ids, mock_create,
+                                              mock_post):
+        looked_up = []
+        def track_ids(pairs):
+            pairs = list(pairs)
+            looked_up.extend(pairs)
+            return iter([pair[0] for pair in pairs])
+        mock_ids.side_effect = track_ids
+        checkpoint = client.FileCheckpoint()
+        checkpoint.track_ids.extend(["r{}".format(n) for n in range(101)])
+        checkpoint.playlist_id = "pid"
+        checkpoint.tracks_posted = 100
+        checkpoint.snapshot_id = "snap"
+        self.mock_request.return_value = {
+            "snapshot_id": "snap", "tracks": {"total": 100}}
+        songs = [("r{}".format(n), "x") for n in range(101)] + [("b", "x")]
+        self.instance.make_playlist_with_tracks("name", songs, checkpoint)
+        self.assertEqual(looked_up, [("b", "x")])
+        self.assertFalse(mock_create.called)
+        mock_post.assert_called_once_with(
+            "pid", ["spotify:track:r100", "spotify:track:b"],
+            checkpoint.add_batch, 100)
+
+    @patch(CLIENT + ".SpotifyClient.post_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_resume_unrecorded_batch(
+            self, mock_ids, mock_post):
+        # The last batch was added, but the run stopped before recording it
+        mock_ids.side_effect = lambda pairs: iter([])
+        checkpoint = client.FileCheckpoint()
+        checkpoint.track_ids.extend(["r{}".format(n) for n in range(150)])
+        checkpoint.playlist_id = "pid"
+        checkpoint.tracks_posted = 100
+        checkpoint.snapshot_id = "snap1"
+        self.mock_request.return_value = {
+            "snapshot_id": "snap2", "tracks": {"total": 150}}
+        songs = [("r{}".format(n), "x") for n in range(150)]
+        self.instance.make_playlist_with_tracks("name", songs, checkpoint)
+        self.assertFalse(mock_post.called)
+        self.assertEqual(checkpoint.tracks_posted, 150)
+        self.assertEqual(checkpoint.snapshot_id, "snap2")
+
+    @patch(CLIENT + ".SpotifyClient.post_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.create_playlist", return_value="pid")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_first_batch_fails(
+            self, mock_ids, mock_create, mock_post):
+        mock_ids.side_effect = lambda pairs: iter(
+            ["t{}".format(n) for n in range(250)])
+        mock_post.side_effect = requests.HTTPError("400 Bad Request")
+        checkpoint = client.FileCheckpoint()
+        songs = [("t{}".format(n), "x") for n in range(250)]
+        with self.assertRaises(requests.HTTPError):
+            self.instance.make_playlist_with_tracks("name", songs, checkpoint)
+        # Later batches wait for the first, so none are added after it
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_post.call_args[0][3], 0)
+        self.assertEqual(checkpoint.tracks_posted, 0)
+        self.assertFalse(checkpoint.done)
+
+    @patch(CLIENT + ".SpotifyClient.post_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.create_playlist", return_value="pid")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_dedupe(self, mock_ids, mock_create,
+                                              mock_post):
+        mock_ids.side_effect = lambda pairs: iter(["a", "b", "a", None])
+        sp_client = client.SpotifyClient("token", "user", dedupe=True)
+        checkpoint = client.FileCheckpoint()
+        sp_client.make_playlist_with_tracks(
+            "name", [("a", "x"), ("b", "x"), ("a", "x"), ("c", "x")],
+            checkpoint)
+        mock_post.assert_called_once_with(
+            "pid", ["spotify:track:a", "spotify:track:b"],
+            checkpoint.add_batch, 0)
+        # Repeats are recorded like songs not found, matching the playlist
+        self.assertEqual(checkpoint.track_ids, ["a", "b", None, None])
+
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_make_playlist_with_tracks_done(self, mock_ids):
+        checkpoint = client.FileCheckpoint()
+        checkpoint.done = True
+        self.instance.make_playlist_with_tracks("name", [], checkpoint)
+        self.assertFalse(mock_ids.called)
+
     @patch(CLIENT + ".dumps", return_value="foobar")
-    def test_add_playlist_tracks_multiple_requests(self, mock_dumps, _):
-        self.instance.add_playlist_tracks("bar", ["foo1", "foo2"])
-        self.assertEqual(mock_dumps.call_count, 2)
-        self.assertEqual(self.mock_request.call_count, 2)
+    def test_add_playlist_tracks_skip_tracks(self, mock_dumps):
+        self.mock_request.return_value = {"snapshot_id": "snap"}
+        on_batch = Mock()
+        self.instance.add_playlist_tracks("bar", ["foo1", "foo2"], 1, on_batch)
+        mock_dumps.assert_called_once_with({"uris": ["foo2"]})
+        on_batch.assert_called_once_with(1, "snap")
+
+    @patch(CLIENT + ".SpotifyClient.insert_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.remove_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_sync_playlist(self, mock_ids, mock_remove, mock_insert):
+        mock_ids.side_effect = lambda pairs: iter(
+            [pair[0] + "-id" for pair in pairs])
+        old_items = item_hashes([["a", "x"], ["b", "x"], ["c", "x"]])
+        old_ids = ["a-id", "b-id", "c-id"]
+        new_items = [("a", "x"), ("c", "x"), ("d", "x"), ("e", "x")]
+        result = self.instance.sync_playlist(
+            "pid", old_items, old_ids, new_items)
+        self.assertEqual(result, ["a-id", "c-id", "d-id", "e-id"])
+        mock_ids.assert_called_once_with([("d", "x"), ("e", "x")])
+        mock_remove.assert_called_once_with(
+            "pid", [("spotify:track:b-id", 1)], ANY)
+        mock_insert.assert_called_once_with(
+            "pid", ["spotify:track:d-id", "spotify:track:e-id"], 2, ANY)
+
+    @patch(CLIENT + ".SpotifyClient.insert_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.remove_playlist_tracks")
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_sync_playlist_not_found(self, mock_ids, mock_remove,
+                                     mock_insert):
+        # Songs not found aren't in the playlist and don't shift positions
+        mock_ids.side_effect = lambda pairs: iter([None, "e-id"])
+        old_items = item_hashes(
+            [["a", "x"], ["b", "x"], ["c", "x"], ["d", "x"]])
+        old_ids = [None, "b-id", None, "d-id"]
+        new_items = [("a", "x"), ("b", "x"), ("x", "x"), ("e", "x"),
+                     ("d", "x")]
+        result = self.instance.sync_playlist(
+            "pid", old_items, old_ids, new_items)
+        self.assertEqual(result, [None, "b-id", None, "e-id", "d-id"])
+        mock_remove.assert_called_once_with("pid", [], ANY)
+        mock_insert.assert_called_once_with(
+            "pid", ["spotify:track:e-id"], 1, ANY)
+
+    @patch(CLIENT + ".dumps", side_effect=lambda body: body)
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_sync_playlist_insert_fails(self, mock_ids, _):
+        mock_ids.side_effect = lambda pairs: iter(
+            [pair[0] + "-id" for pair in pairs])
+        old_items = [("a", "x"), ("b", "x"), ("c", "x"), ("f", "x")]
+        old_ids = ["a-id", "b-id", "c-id", "f-id"]
+        new_items = [("a", "x"), ("d", "x"), ("c", "x"), ("e", "x"),
+                     ("f", "x")]
+        def send(method, request_args, *_):
+            # The removal and first insert succeed, the second doesn't
+            if request_args["data"].get("position") == 3:
+                raise requests.HTTPError("400 Bad Request")
+        self.mock_request.side_effect = send
+        recorded = []
+        with self.assertRaises(requests.HTTPError):
+            self.instance.sync_playlist(
+                "pid", item_hashes(old_items), old_ids, new_items,
+                lambda *state: recorded.append(state))
+        # The playlist holds a, d, c and f, so those are recorded
+        hashes, track_ids = recorded[0]
+        self.assertEqual(hashes, list(item_hashes(
+            [("a", "x"), ("d", "x"), ("c", "x"), ("f", "x")])))
+        self.assertEqual(track_ids, ["a-id", "d-id", "c-id", "f-id"])
+        # Synced again from there, only e is added
+        self.mock_request.reset_mock(side_effect=True)
+        self.instance.sync_playlist("pid", hashes, track_ids, new_items)
+        self.mock_request.assert_called_once()
+        self.assertEqual(self.mock_request.call_args[0][1]["data"],
+                         {"uris": ["spotify:track:e-id"], "position": 3})
+
+    @patch(CLIENT + ".dumps", side_effect=lambda body: body)
+    @patch(CLIENT + ".SpotifyClient.get_track_ids")
+    def test_sync_playlist_removal_fails(self, mock_ids, _):
+        mock_ids.side_effect = lambda pairs: iter([])
+        old_items = [("t{}".format(n), "x") for n in range(150)]
+        old_ids = ["t{}-id".format(n) for n in range(150)]
+        removed = []
+        def send(method, request_args, *_):
+            if removed:
+                raise requests.HTTPError("500 Server Error")
+            removed.extend(request_args["data"]["tracks"])
+        self.mock_request.side_effect = send
+        recorded = []
+        with self.assertRaises(requests.HTTPError):
+            self.instance.sync_playlist(
+                "pid", item_hashes(old_items), old_ids, [],
+                lambda *state: recorded.append(state))
+        # The last 100 lines were removed before the error
+        hashes, track_ids = recorded[0]
+        self.assertEqual(track_ids, old_ids[:50])
+        self.assertEqual(hashes, list(item_hashes(old_items[:50])))
+
+    @patch(CLIENT + ".dumps", side_effect=lambda body: body)
+    def test_remove_playlist_tracks_from_end(self, _):
+        first_positions = []
+        self.mock_request.side_effect = lambda method, args, *_: \
+            first_positions.append(args["data"]["tracks"][0]["positions"])
+        removals = [("uri{}".format(n), n) for n in range(150)]
+        self.instance.remove_playlist_tracks("pid", removals)
+        self.assertEqual(first_positions, [[149], [49]])
+
+    @patch(CLIENT + ".dumps", side_effect=lambda body: body)
+    def test_insert_playlist_tracks_positions(self, _):
+        positions = []
+        self.mock_request.side_effect = lambda method, args, *_: \
+            positions.append(args["data"]["position"])
+        self.instance.insert_playlist_tracks("pid", ["uri"] * 150, 5)
+        self.assertEqual(positions, [5, 105])
 
 
 class TestClientHelpers(unittest.TestCase):
@@ -136,7 +742,8 @@ class TestClientHelpers(unittest.TestCase):
         mock_request.return_value = mock_response
         with self.assertRaises(requests.HTTPError):
             client.send_request("GET", {"url": "https://blah.com"})
-        mock_request.assert_called_once_with("GET", url="https://blah.com")
+        mock_request.assert_called_once_with(
+            "GET", timeout=None, url="https://blah.com")
         self.assertFalse(mock_response.json.called)
 
     @patch(CLIENT + ".requests.request", autospec=True)
@@ -149,17 +756,71 @@ class TestClientHelpers(unittest.TestCase):
         self.assertEqual(result, {"data": "blah"})
         self.assertTrue(mock_response.raise_for_status.called)
 
+    def test_send_request_with_session(self):
+        session = create_autospec(spec=requests.Session, instance=True)
+        session.request.return_value.json.return_value = {"data": "blah"}
+        result = client.send_request("GET", {"url": "https://foo.com"},
+                                     session, 5.0)
+        session.request.assert_called_once_with(
+            "GET", timeout=5.0, url="https://foo.com")
+        self.assertEqual(result, {"data": "blah"})
+
+    def test_make_session(self):
+        session = client.make_session(4)
+        adapter = session.get_adapter("https://api.spotify.com")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        session.close()
+
+    def test_make_session_shared_adapter(self):
+        adapter = client.HTTPAdapter()
+        first = client.SpotifyClient("a", "user", adapter=adapter)
+        second = client.SpotifyClient("b", "user", adapter=adapter)
+        self.assertIs(first.session.get_adapter("https://"), adapter)
+        self.assertIs(second.session.get_adapter("https://"), adapter)
+        # Closing one client leaves the other's connections open
+        with patch.object(adapter, "close") as mock_close:
+            first.close()
+        self.assertFalse(mock_close.called)
+        adapter.close()
+
+    def test_ordered_map(self):
+        result = client.ordered_map(lambda x: x * 2, iter(range(50)), 4)
+        self.assertEqual(list(result), [x * 2 for x in range(50)])
+
+    def test_ordered_map_is_lazy(self):
+        consumed = []
+        def items():
+            for x in range(100):
+                consumed.append(x)
+                yield x
+        result = client.ordered_map(lambda x: x, items(), 2)
+        self.assertEqual(next(result), 0)
+        self.assertLess(len(consumed), 100)
+        result.close()
+
+    def test_chunked(self):
+        result = list(client.chunked(iter(range(5)), 2))
+        self.assertEqual(result, [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(client.chunked([], 2)), [])
+
+    def test_track_uris(self):
+        self.assertEqual(client.track_uris(["a", None, "b"]),
+                         ["spotify:track:a", "spotify:track:b"])
+
     def test_first_saved(self):
         result = client.first_saved([("foo", False), ("bar", False)])
         self.assertIsNone(result)
         tracks_saved = [("foo", False), ("bar", True), ("a", True)]
         self.assertEqual(client.first_saved(tracks_saved), "bar")
 
-    def test_subsets_of_size(self):
-        result1 = client.subsets_of_size(["foo", "bar"], 2)
-        result2 = client.subsets_of_size(["abc", "xyz", "123"], 2)
-        self.assertEqual(result1, [["foo", "bar"]])
-        self.assertEqual(result2, [["abc", "xyz"], ["123"]])
+    def test_unique(self):
+        self.assertEqual(list(client.unique(["a", "b", "a"])), ["a", "b"])
+
+    def test_drop_repeats(self):
+        seen = {"a"}
+        result = client.drop_repeats(["a", "b", None, "b", "c"], seen)
+        self.assertEqual(result, [None, "b", None, None, "c"])
+        self.assertEqual(seen, {"a", "b", "c"})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import unittest
+from playlist_converter import fuzzy
+
+
+class TestTrigramIndex(unittest.TestCase):
+    """Test finding texts by the trigrams they share."""
+
+    def test_search(self):
+        index = fuzzy.TrigramIndex()
+        index.add("bohemian rhapsody")
+        index.add("somebody to love")
+        found = index.search("bohemian rapsody")
+        self.assertEqual([position for _, position in found], [0])
+        self.assertGreater(found[0][0], 0.75)
+        self.assertEqual(index.search("bohemian rhapsody")[0][0], 1.0)
+        self.assertEqual(index.search("yesterday"), [])
+
+    def test_trigrams(self):
+        self.assertEqual(fuzzy.trigrams("ab"), {"  a", " ab", "ab "})
+
+
+class TestSongIndex(unittest.TestCase):
+    """Test matching misspelled songs against songs found earlier."""
+
+    def setUp(self):
+        self.index = fuzzy.SongIndex()
+        self.index.add("Bohemian Rhapsody", "Queen", "bohemian-id")
+        self.index.add("Don't Stop Me Now", "Queen", "dont-stop-id")
+        self.index.add("Symphony No. 5", "Beethoven", "fifth-id")
+
+    def test_add_skips_repeats(self):
+        self.index.add("bohemian rhapsody", " Queen", "other-id")
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(len(self.index.artists), 2)
+
+    def test_match_misspelling(self):
+        self.assertEqual(self.index.match("Bohemian Rapsody", "Queen"),
+                         "bohemian-id")
+        self.assertEqual(self.index.match("Bohemian Rhapsody", "Quen"),
+                         "bohemian-id")
+
+    def test_match_needs_title_and_artist(self):
+        self.assertIsNone(self.index.match("Bohemian Rhapsody", "Muse"))
+        self.assertIsNone(self.index.match("Killer Queen", "Queen"))
+
+    def test_match_different_numbers(self):
+        self.assertIsNone(self.index.match("Symphony No. 9", "Beethoven"))
+
+    def test_correct(self):
+        self.assertEqual(self.index.correct("Under Pressure", "Quuen"),
+                         ("under pressure", "queen"))
+        self.assertEqual(self.index.correct("Dont Stop Me Know", "Queen"),
+                         ("don't stop me now", "queen"))
+        self.assertIsNone(self.index.correct("Under Pressure", "Queen"))
+        self.assertIsNone(self.index.correct("Yesterday", "The Beatles"))
+
+
+if __name__ == "__main__":
+    unittest.main()
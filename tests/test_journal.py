@@ -0,0 +1,89 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from playlist_converter import journal
+
+
+class TestJournal(unittest.TestCase):
+    """Test recording and replaying conversion progress."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "journal.jsonl")
+        self.song_file = os.path.join(self.tempdir.name, "songs.txt")
+        with open(self.song_file, "w") as f:
+            f.write("Track---Artist\n")
+        self.instance = journal.Journal(self.path)
+        self.addCleanup(self.instance.close)
+
+    def reopen(self):
+        self.instance.close()
+        reopened = journal.Journal(self.path)
+        reopened.load()
+        self.addCleanup(reopened.close)
+        return reopened
+
+    def test_replay_progress(self):
+        checkpoint = self.instance.checkpoint(self.song_file)
+        checkpoint.add_track_ids(["id1", None])
+        checkpoint.add_track_ids(["id3"])
+        checkpoint.set_playlist("pid")
+        checkpoint.add_batch(2, "snap1")
+        resumed = self.reopen().checkpoint(self.song_file)
+        self.assertEqual(resumed.track_ids, ["id1", None, "id3"])
+        self.assertEqual(resumed.playlist_id, "pid")
+        self.assertEqual(resumed.tracks_posted, 2)
+        self.assertEqual(resumed.snapshot_id, "snap1")
+        self.assertFalse(resumed.done)
+
+    def test_replay_done(self):
+        self.instance.checkpoint(self.song_file).finish()
+        self.assertTrue(self.reopen().checkpoint(self.song_file).done)
+
+    def test_changed_file_starts_over(self):
+        self.instance.checkpoint(self.song_file).set_playlist("pid")
+        with open(self.song_file, "a") as f:
+            f.write("Another Track---Artist\n")
+        os.utime(self.song_file, (0, 0))
+        resumed = self.reopen().checkpoint(self.song_file)
+        self.assertIsNone(resumed.playlist_id)
+
+    def test_given_fingerprint(self):
+        self.instance.checkpoint("apply:a", ["digest1"]).set_playlist("pid")
+        reopened = self.reopen()
+        self.assertEqual(
+            reopened.checkpoint("apply:a", ["digest1"]).playlist_id, "pid")
+        self.assertIsNone(
+            reopened.checkpoint("apply:a", ["digest2"]).playlist_id)
+
+    def test_truncated_line_ignored(self):
+        self.instance.checkpoint(self.song_file).set_playlist("pid")
+        self.instance.close()
+        with open(self.path, "a") as f:
+            f.write('{"file": "songs.txt", "ba')
+        resumed = self.reopen().checkpoint(self.song_file)
+        self.assertEqual(resumed.playlist_id, "pid")
+
+    def test_reset(self):
+        self.instance.checkpoint(self.song_file).finish()
+        self.instance.reset()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.instance.checkpoints)
+
+
+class TestFileCheckpoint(unittest.TestCase):
+    """Test checkpoints that aren't backed by a journal file."""
+
+    def test_in_memory_progress(self):
+        checkpoint = journal.FileCheckpoint()
+        checkpoint.add_track_ids(["id1"])
+        checkpoint.add_batch(1)
+        checkpoint.finish()
+        self.assertEqual(checkpoint.track_ids, ["id1"])
+        self.assertEqual(checkpoint.tracks_posted, 1)
+        self.assertTrue(checkpoint.done)
+
+
+if __name__ == "__main__":
+    unittest.main()
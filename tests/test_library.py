@@ -0,0 +1,74 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from playlist_converter import library
+
+
+def saved_pages(track_ids, page_size=2):
+    # Pages of saved tracks shaped like Spotify's, newest first, where the
+    # first ID in track_ids was saved most recently
+    items = [{"added_at": "2021-01-{:02d}T00:00:00Z".format(
+                  len(track_ids) - n),
+              "track": {"id": tid}} for n, tid in enumerate(track_ids)]
+    pages = []
+    for start in range(0, len(items), page_size):
+        pages.append({"items": items[start:start + page_size],
+                      "total": len(items)})
+    return pages
+
+
+class TestSavedLibrary(unittest.TestCase):
+    """Test building and refreshing the index of saved tracks."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "saved.json")
+        self.fetches = []
+
+    def fetch_from(self, track_ids):
+        def fetch_pages():
+            for page in saved_pages(track_ids):
+                self.fetches.append(page)
+                yield page
+        return fetch_pages
+
+    def test_refresh_empty_index(self):
+        index = library.SavedLibrary(self.path)
+        index.refresh(self.fetch_from(["c", "b", "a"]))
+        self.assertEqual(index.track_ids, {"a", "b", "c"})
+        self.assertIn("b", index)
+        self.assertNotIn("d", index)
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_refresh_stops_at_known_tracks(self):
+        index = library.SavedLibrary(self.path)
+        index.refresh(self.fetch_from(["d", "c", "b", "a"]))
+        index.save()
+        reloaded = library.SavedLibrary(self.path)
+        reloaded.load()
+        self.fetches = []
+        reloaded.refresh(self.fetch_from(["f", "e", "d", "c", "b", "a"]))
+        self.assertEqual(reloaded.track_ids, set("abcdef"))
+        # The first page has the new tracks, the second reaches known ones
+        self.assertEqual(len(self.fetches), 2)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_refresh_rebuilds_after_unsaving(self):
+        index = library.SavedLibrary(self.path)
+        index.refresh(self.fetch_from(["c", "b", "a"]))
+        index.refresh(self.fetch_from(["c", "a"]))
+        self.assertEqual(index.track_ids, {"a", "c"})
+        self.assertEqual(index.total, 2)
+
+    def test_local_files_are_skipped(self):
+        index = library.SavedLibrary(self.path)
+        index.refresh(self.fetch_from([None, "a"]))
+        self.assertEqual(index.track_ids, {"a"})
+        self.fetches = []
+        index.refresh(self.fetch_from([None, "a"]))
+        self.assertEqual(len(self.fetches), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from playlist_converter import manifest
+
+
+class TestManifest(unittest.TestCase):
+    """Test writing and reading resolve manifests."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "manifest.json")
+
+    def test_manifest_entry(self):
+        items = [("One", "A"), ("Two", "B"), ("Three", "C")]
+        entry = manifest.manifest_entry(
+            "dir/songs.txt", "Songs", items, ["id1", None, "id3"])
+        self.assertEqual(entry["file"], "dir/songs.txt")
+        self.assertEqual(entry["playlist"], "Songs")
+        self.assertEqual(entry["track_ids"], ["id1", "id3"])
+        self.assertEqual(entry["unresolved"],
+                         [{"index": 1, "track": "Two", "artist": "B"}])
+
+    def test_write_then_read(self):
+        entry = manifest.manifest_entry("songs.txt", "Songs",
+                                        [("One", "A")], ["id1"])
+        manifest.write_manifest(self.path, [entry])
+        self.assertEqual(manifest.read_manifest(self.path), [entry])
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_read_wrong_version(self):
+        with open(self.path, "w") as f:
+            json.dump({"version": 99, "files": []}, f)
+        with self.assertRaises(ValueError):
+            manifest.read_manifest(self.path)
+
+    def test_read_incomplete_entry(self):
+        with open(self.path, "w") as f:
+            json.dump({"version": manifest.MANIFEST_VERSION,
+                       "files": [{"file": "songs.txt"}]}, f)
+        with self.assertRaises(ValueError):
+            manifest.read_manifest(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import unittest
+from datetime import timedelta
+from unittest import mock
+from tempfile import TemporaryDirectory
+import requests
+from playlist_converter import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Test recording request statistics and phase timings."""
+
+    def setUp(self):
+        self.instance = metrics.Metrics()
+
+    def fake_response(self, status, body, elapsed, headers=None):
+        response = mock.create_autospec(requests.Response, instance=True)
+        response.status_code = status
+        response.content = body
+        response.headers = headers or {}
+        response.raw = mock.Mock(spec=[])
+        response.elapsed = timedelta(seconds=elapsed)
+        response.request = mock.Mock(body=b'{"name": "x"}')
+        return response
+
+    def test_instrument_adds_hook(self):
+        request_args = {"url": "https://foo.com"}
+        result = self.instance.instrument("search", request_args)
+        self.assertNotIn("hooks", request_args)
+        hook = result["hooks"]["response"]
+        response = self.fake_response(200, b"{}", 0.03)
+        self.assertIs(hook(response), response)
+        stats = self.instance.endpoints["search"]
+        self.assertEqual(stats.requests, 1)
+        self.assertEqual(stats.statuses, {200: 1})
+        self.assertEqual(stats.bytes_sent, 13)
+        self.assertEqual(stats.bytes_received, 2)
+
+    def test_instrument_counts_bytes_on_the_wire(self):
+        hook = self.instance.instrument("add_tracks", {})["hooks"]["response"]
+        # A text body counts its UTF-8 bytes, and a compressed one its
+        # length before decompressing
+        response = self.fake_response(
+            201, b"x" * 500, 0.03, {"Content-Length": "40"})
+        response.request.body = '{"name": "Café"}'
+        hook(response)
+        # Without a length, the bytes read off the connection are counted
+        response = self.fake_response(201, b"x" * 500, 0.03)
+        response.raw = mock.Mock(**{"tell.return_value": 60})
+        hook(response)
+        stats = self.instance.endpoints["add_tracks"]
+        self.assertEqual(stats.bytes_sent, 17 + 13)
+        self.assertEqual(stats.bytes_received, 40 + 60)
+
+    def test_latency_buckets(self):
+        for seconds in [0.005, 0.03, 0.03, 60]:
+            self.instance.record_request("search", seconds, 200, 0, 0)
+        buckets = self.instance.report()["endpoints"]["search"]
+        buckets = buckets["latency_buckets"]
+        self.assertEqual(buckets["0.01"], 1)
+        self.assertEqual(buckets["0.05"], 2)
+        self.assertEqual(buckets["+Inf"], 1)
+
+    @mock.patch("playlist_converter.metrics.time")
+    def test_phase(self, mock_time):
+        mock_time.perf_counter.side_effect = [1.0, 3.5, 10.0, 11.0]
+        for _ in range(2):
+            with self.instance.phase("convert"):
+                pass
+        self.assertEqual(self.instance.report()["phases"], {"convert": 3.5})
+
+    def test_write_json_and_prometheus(self):
+        self.instance.record_request("search", 0.02, 200, 10, 20)
+        self.instance.record_retry("search")
+        self.instance.record_retry("search")
+        with TemporaryDirectory() as tempdir:
+            json_path = os.path.join(tempdir, "metrics.json")
+            prom_path = os.path.join(tempdir, "metrics.prom")
+            self.instance.write(json_path)
+            self.instance.write(prom_path)
+            with open(json_path) as f:
+                report = json.load(f)
+            with open(prom_path) as f:
+                text = f.read()
+        self.assertEqual(report["endpoints"]["search"]["requests"], 1)
+        self.assertIn('playlist_converter_requests_total{endpoint="search",'
+                      'status="200"} 1', text)
+        self.assertIn('playlist_converter_request_seconds_bucket{endpoint='
+                      '"search",le="+Inf"} 1', text)
+        self.assertEqual(report["retries"], 2)
+        self.assertEqual(report["endpoints"]["search"]["retries"], 2)
+        self.assertIn('playlist_converter_retries_total{endpoint="search"} 2',
+                      text)
+
+
+class TestProfiler(unittest.TestCase):
+    """Test profiling calls made on the calling thread and new threads."""
+
+    def test_profile_threads(self):
+        profiler = metrics.Profiler()
+        with profiler.profile():
+            thread = threading.Thread(target=sorted, args=([3, 1, 2],))
+            thread.start()
+            thread.join()
+        if sys.version_info < metrics.SHARED_PROFILER_VERSION:
+            self.assertGreaterEqual(len(profiler.profilers), 2)
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "run.stats")
+            profiler.write(path)
+            self.assertTrue(os.path.getsize(path) > 0)
+
+    def test_profile_thread_pool(self):
+        profiler = metrics.Profiler()
+        with profiler.profile():
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(sorted, [[2, 1], [4, 3]]))
+        self.assertEqual(results, [[1, 2], [3, 4]])
+
+    @mock.patch("playlist_converter.metrics.threading.setprofile")
+    def test_profile_shared_profiler(self, mock_setprofile):
+        profiler = metrics.Profiler()
+        with mock.patch.object(metrics.sys, "version_info", (3, 12, 1)):
+            with profiler.profile():
+                pass
+        self.assertFalse(mock_setprofile.called)
+        self.assertEqual(len(profiler.profilers), 1)
+
+    @mock.patch("playlist_converter.metrics.sys.setprofile")
+    @mock.patch("playlist_converter.metrics.cProfile.Profile")
+    def test_thread_profiler_already_active(self, mock_profile, _):
+        mock_profile.return_value.enable.side_effect = ValueError(
+            "Another profiling tool is already active")
+        profiler = metrics.Profiler()
+        profiler.start_thread_profiler()
+        self.assertEqual(profiler.profilers, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from playlist_converter import model
+
+
+class TestTrackIds(unittest.TestCase):
+    """Test packing track IDs into bytes."""
+
+    def test_round_trip(self):
+        ids = ["4uLU6hMCjMI75M1A2tKUQC", None, "0000000000000000000000",
+               "zzzzzzzzzzzzzzzzzzzzzz", "not-an-id", None]
+        packed = model.TrackIds(ids)
+        self.assertEqual(len(packed), len(ids))
+        self.assertEqual(list(packed), ids)
+        self.assertEqual(packed, ids)
+        self.assertEqual(packed[-1], None)
+        self.assertEqual(packed[1:4], ids[1:4])
+        with self.assertRaises(IndexError):
+            packed[len(ids)]
+
+    def test_packs_spotify_ids(self):
+        packed = model.TrackIds(["4uLU6hMCjMI75M1A2tKUQC"] * 10)
+        self.assertEqual(len(packed.data), 10 * model.SLOT_SIZE)
+        self.assertEqual(packed.others, [])
+
+    def test_append_and_extend(self):
+        packed = model.TrackIds()
+        packed.append("4uLU6hMCjMI75M1A2tKUQC")
+        packed.extend([None, "id1"])
+        self.assertEqual(packed, ["4uLU6hMCjMI75M1A2tKUQC", None, "id1"])
+
+    def test_base62_number(self):
+        self.assertEqual(model.base62_number("0" * 21 + "z"), 61)
+        self.assertIsNone(model.base62_number("short"))
+        self.assertIsNone(model.base62_number("!" * 22))
+
+
+class TestStringTable(unittest.TestCase):
+    """Test sharing repeated strings."""
+
+    def test_entry_shares_artists(self):
+        table = model.StringTable()
+        first = table.entry("One", "".join(["Art", "ist"]))
+        second = table.entry("Two", "".join(["Art", "ist"]))
+        self.assertIs(first.artist, second.artist)
+        self.assertEqual(first, ("One", "Artist"))
+        track, artist = second
+        self.assertEqual((track, artist), ("Two", "Artist"))
+        self.assertEqual(len(table), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
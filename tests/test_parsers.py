@@ -0,0 +1,86 @@
+import json
+import unittest
+from playlist_converter import parsers
+
+
+class TestParsers(unittest.TestCase):
+    """Test reading songs from each supported playlist format."""
+
+    def test_delimited(self):
+        parser = parsers.DelimitedParser()
+        lines = ["Name: Mix", "Artist---Track", "not a song"]
+        self.assertEqual(parser.playlist_name(iter(lines)), "Mix")
+        items = list(parser.iter_items(iter(lines), "---", "artist track"))
+        self.assertEqual(items, [("Track", "Artist")])
+
+    def test_csv_with_headings(self):
+        lines = ['"Spotify ID","Track Name","Artist Name(s)"',
+                 '"x1","Hey Jude","The Beatles"',
+                 '"x2","Crazy in Love","Beyonce, JAY-Z"',
+                 '"x3","",""']
+        items = parsers.CsvParser(",").iter_items(
+            iter(lines), "---", "track artist")
+        self.assertEqual(list(items), [("Hey Jude", "The Beatles"),
+                                       ("Crazy in Love", "Beyonce, JAY-Z")])
+
+    def test_tsv_without_headings(self):
+        lines = ["The Beatles\tHey Jude", "Coldplay\tClocks"]
+        items = parsers.CsvParser("\t").iter_items(
+            iter(lines), "---", "artist track")
+        self.assertEqual(list(items), [("Hey Jude", "The Beatles"),
+                                       ("Clocks", "Coldplay")])
+
+    def test_tsv_empty_first_column(self):
+        lines = ["album\ttrack\tartist\r\n", "\tSong A\tArtist A\r\n",
+                 "Album\tSong B\tArtist B\r\n"]
+        items = parsers.CsvParser("\t").iter_items(
+            iter(lines), "---", "track artist")
+        self.assertEqual(list(items), [("Song A", "Artist A"),
+                                       ("Song B", "Artist B")])
+
+    def test_m3u(self):
+        lines = ["#EXTM3U", "#PLAYLIST: Road Trip",
+                 "#EXTINF:431,The Beatles - Hey Jude",
+                 "Music/Beatles/hey_jude.mp3",
+                 "C:\\Music\\Coldplay - Clocks.flac",
+                 "untitled.mp3"]
+        parser = parsers.M3uParser()
+        self.assertEqual(parser.playlist_name(iter(lines)), "Road Trip")
+        items = parser.iter_items(iter(lines), "---", "track artist")
+        self.assertEqual(list(items), [("Hey Jude", "The Beatles"),
+                                       ("Clocks", "Coldplay")])
+
+    def test_json_playlist(self):
+        playlist = {"name": "Export", "tracks": [
+            {"track": {"name": "Hey Jude",
+                       "artists": [{"name": "The Beatles"}]}},
+            {"trackName": "Clocks", "artistName": "Coldplay"},
+            {"title": "Crazy in Love", "artists": ["Beyonce", "JAY-Z"]},
+            {"title": "No artist"}]}
+        lines = json.dumps(playlist, indent=1).splitlines()
+        parser = parsers.JsonParser()
+        self.assertEqual(parser.playlist_name(iter(lines)), "Export")
+        items = parser.iter_items(iter(lines), "---", "track artist")
+        self.assertEqual(list(items), [("Hey Jude", "The Beatles"),
+                                       ("Clocks", "Coldplay"),
+                                       ("Crazy in Love", "Beyonce, JAY-Z")])
+
+    def test_json_list(self):
+        lines = ['[{"track": "Clocks", "artist": "Coldplay"}]']
+        parser = parsers.JsonParser()
+        self.assertIsNone(parser.playlist_name(iter(lines)))
+        items = parser.iter_items(iter(lines), "---", "track artist")
+        self.assertEqual(list(items), [("Clocks", "Coldplay")])
+
+    def test_register_parser(self):
+        parser = parsers.CsvParser(";")
+        self.addCleanup(parsers.PARSERS.pop, ".ssv")
+        parsers.register_parser(".SSV", parser)
+        self.assertIs(parsers.parser_for("songs.ssv"), parser)
+        self.assertIsInstance(parsers.parser_for("songs.M3U"),
+                              parsers.M3uParser)
+        self.assertIsNone(parsers.parser_for("song.mp3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from playlist_converter import ranking
+
+
+def result(tid, name, artists, popularity=50, duration_ms=200000):
+    return {"id": tid, "name": name, "popularity": popularity,
+            "duration_ms": duration_ms,
+            "artists": [{"name": artist} for artist in artists]}
+
+# Songs as written in playlist files, the search results Spotify gave for
+# them in Spotify's order, and the ID of the right match
+CORPUS = [
+    (("Hey Jude", "The Beatles"), [
+        result("live", "Hey Jude - Live", ["The Beatles"], 40, 500000),
+        result("jude", "Hey Jude", ["The Beatles"], 78, 431000),
+        result("cover", "Hey Jude", ["Tribute Band"], 10, 425000)], "jude"),
+    (("Crazy in Love ft. Jay-Z", "Beyonce"), [
+        result("remix", "Crazy In Love - Remix", ["Beyonce"], 30, 210000),
+        result("love", "Crazy In Love (feat. Jay-Z)", ["Beyonce", "JAY-Z"],
+               80, 236000)], "love"),
+    (("Hurt", "Johnny Cash"), [
+        result("nin", "Hurt", ["Nine Inch Nails"], 70, 373000),
+        result("cash", "Hurt", ["Johnny Cash"], 75, 218000)], "cash"),
+    (("Clocks", "Coldplay"), [
+        result("clocks", "Clocks", ["Coldplay"], 82, 307000),
+        result("clocks2", "Clocks - Live in Buenos Aires", ["Coldplay"],
+               35, 330000),
+        result("karaoke", "Clocks (Karaoke Version)", ["Karaoke Hits"],
+               5, 305000)], "clocks"),
+    (("Bohemian Rhapsody", "Queen"), [
+        result("remaster", "Bohemian Rhapsody - Remastered 2011", ["Queen"],
+               85, 354000),
+        result("rhapsody", "Bohemian Rhapsody", ["Queen"], 70, 355000),
+        result("movie", "Bohemian Rhapsody - Live Aid", ["Queen"], 60,
+               360000)], "rhapsody"),
+]
+
+
+class TestRanking(unittest.TestCase):
+    """Test scoring and ranking song search results."""
+
+    def test_corpus_accuracy(self):
+        correct = 0
+        for (track, artist), results, expected in CORPUS:
+            ranked, _ = ranking.rank_candidates(track, artist, results)
+            correct += ranked[0] == expected
+        self.assertEqual(correct, len(CORPUS))
+
+    def test_clear_winner_is_confident(self):
+        (track, artist), results, _ = CORPUS[3]
+        _, lead = ranking.rank_candidates(track, artist, results)
+        self.assertTrue(ranking.is_confident(lead))
+
+    def test_duplicates_are_not_confident(self):
+        results = [result("album", "Hurt", ["Johnny Cash"]),
+                   result("single", "Hurt", ["Johnny Cash"])]
+        ranked, lead = ranking.rank_candidates(
+            "Hurt", "Johnny Cash", results)
+        self.assertEqual(ranked, ["album", "single"])
+        self.assertFalse(ranking.is_confident(lead))
+
+    def test_margin_of_one_is_never_confident(self):
+        (track, artist), results, _ = CORPUS[3]
+        _, lead = ranking.rank_candidates(track, artist, results)
+        self.assertFalse(ranking.is_confident(lead, 1))
+
+    def test_results_missing_fields(self):
+        ranked, lead = ranking.rank_candidates(
+            "foo", "bar", [{"id": "a"}, {"id": "b"}])
+        self.assertEqual(ranked, ["a", "b"])
+        self.assertEqual(lead, 0.0)
+
+    def test_no_results(self):
+        self.assertEqual(ranking.rank_candidates("foo", "bar", []),
+                         ([], 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,54 +1,57 @@
+import os
 import unittest
 from unittest import mock
+from tempfile import TemporaryDirectory
 from playlist_converter import read_file
 
 
 READFILE = "playlist_converter.read_file"
 
-@mock.patch(READFILE + ".os")
 class TestDirectoryFunctions(unittest.TestCase):
-    """Test functions in read_file.py that read directory contents."""
-
-    @classmethod
-    def setUpClass(cls):
-        cls.listdir = ["subdir", "playlist.txt", "song.mp3"]
-
-    def test_directory_files_none(self, mock_os):
-        mock_os.listdir.return_value = []
-        result = read_file.directory_files(".")
-        self.assertFalse(mock_os.path.join.called)
-        self.assertFalse(result)
-
-    def test_directory_files_exist(self, mock_os):
-        mock_os.listdir.return_value = self.listdir
-        mock_os.path.isfile.side_effect = [False, True, True]
-        result = read_file.directory_files(".")
-        self.assertEqual(mock_os.path.isfile.call_count, 3)
-        self.assertCountEqual(result, self.listdir[1:])
-
-    def test_filter_textfiles_none(self, mock_os):
-        result = read_file.filter_textfiles([])
-        self.assertFalse(mock_os.path.splitext.called)
-        self.assertFalse(result)
-
-    def test_filter_textfiles_exist(self, mock_os):
-        splitext_result = [("playlist", ".txt"), ("song", ".mp3")]
-        mock_os.path.splitext.side_effect = splitext_result
-        result = read_file.filter_textfiles(self.listdir[1:])
-        self.assertEqual(result, [self.listdir[1]])
-
-    def test_directory_textfiles_path(self, mock_os):
-        mock_os.path.isdir.return_value = False
+    """Test functions in read_file.py that scan directory contents."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = self.tempdir.name
+        for relative in ["playlist.txt", "song.mp3", "sub/mix.m3u8",
+                         "sub/deep/export.CSV", "old/archive.json"]:
+            path = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("Track---Artist\n")
+
+    def filenames(self, *args, **kwargs):
+        playlists = read_file.get_playlists(self.root, *args, **kwargs)
+        return [playlist.filename.replace(os.sep, "/")
+                for playlist in playlists]
+
+    def test_get_playlists_recursive(self):
+        self.assertEqual(self.filenames(), [
+            "old/archive.json", "playlist.txt", "sub/deep/export.CSV",
+            "sub/mix.m3u8"])
+
+    def test_get_playlists_globs(self):
+        self.assertEqual(self.filenames(["*.txt", "*.m3u8"]),
+                         ["playlist.txt", "sub/mix.m3u8"])
+        self.assertEqual(self.filenames(exclude=["old", "*.txt"]),
+                         ["sub/deep/export.CSV", "sub/mix.m3u8"])
+
+    def test_get_playlists_skips_unchanged(self):
+        path = os.path.join(self.root, "playlist.txt")
+        stat = os.stat(path)
+        unchanged = {path: [stat.st_size, stat.st_mtime]}
+        self.assertNotIn("playlist.txt", self.filenames(unchanged=unchanged))
+        # Everything unchanged isn't an error, just nothing to convert
+        self.assertEqual(self.filenames(["*.txt"], unchanged=unchanged), [])
+
+    def test_get_playlists_not_directory(self):
         with self.assertRaises(NotADirectoryError):
-            read_file.directory_textfiles(".")
+            read_file.get_playlists(os.path.join(self.root, "playlist.txt"))
 
-    def test_directory_textfiles_none(self, mock_os):
-        mock_os.path.isdir.return_value = True
-        func_target = READFILE + ".filter_textfiles"
-        with mock.patch(func_target) as mock_func:
-            mock_func.return_value = []
-            with self.assertRaises(FileNotFoundError):
-                read_file.directory_textfiles(".")
+    def test_get_playlists_none(self):
+        with self.assertRaises(FileNotFoundError):
+            read_file.get_playlists(self.root, ["*.xspf"])
 
 
 class TestPlaylistFile(unittest.TestCase):
@@ -67,19 +70,14 @@ class TestPlaylistFile(unittest.TestCase):
 
     def test_constructor(self):
         self.assertIsInstance(self.instance, read_file.PlaylistFile)
-        self.assertTrue(self.mock_func.called)
+        self.assertFalse(self.mock_func.called)
         self.assertEqual(self.instance.filename, "songs.txt")
-        self.assertEqual(self.instance.lines, self.song_lines)
 
     def test_playlist_name(self):
-        func_target = READFILE + ".PlaylistFile.line_starts_with"
-        with mock.patch(func_target) as mock_line_start:
-            mock_line_start.return_value = None
-            filename = self.instance.filename
-            self.assertEqual(self.instance.playlist_name(), filename)
-            mock_line_start.return_value = "Name: My Playlist "
-            self.assertEqual(self.instance.playlist_name(), "My Playlist")
-            self.assertEqual(mock_line_start.call_count, 2)
+        filename = self.instance.filename
+        self.assertEqual(self.instance.playlist_name(), filename)
+        self.mock_func.return_value = ["Name: My Playlist ", "Track---Artist"]
+        self.assertEqual(self.instance.playlist_name(), "My Playlist")
 
     def test_playlist_items(self):
         result = self.instance.playlist_items("---", "track artist")
@@ -87,6 +85,78 @@ class TestPlaylistFile(unittest.TestCase):
         self.assertIn(("Track", "Artist 1, Artist 2"), result)
         self.assertIn(("Track 2", "Artist"), result)
 
+    def test_iter_items_is_lazy(self):
+        result = self.instance.iter_items("---", "artist track")
+        self.assertFalse(self.mock_func.called)
+        self.assertEqual(next(result), ("Artist 1, Artist 2", "Track"))
+
+
+class TestPlaylistFileReading(unittest.TestCase):
+    """Test reading a real file through PlaylistFile."""
+
+    def test_reads_lines_lazily(self):
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "songs.txt")
+            with open(path, "w") as f:
+                f.write("Name:  My Mix \n\nTrack---Artist\nnot a song\n")
+            instance = read_file.PlaylistFile(path, "songs.txt")
+            self.assertEqual(instance.playlist_name(), "My Mix")
+            items = list(instance.iter_items("---", "track artist"))
+            self.assertEqual(items, [("Track", "Artist")])
+
+    def write_items(self, filename, text):
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, filename)
+            with open(path, "w", newline="") as f:
+                f.write(text)
+            instance = read_file.PlaylistFile(path, filename)
+            return list(instance.iter_items("---", "track artist"))
+
+    def test_tsv_row_starting_with_separator(self):
+        items = self.write_items(
+            "songs.tsv", "album\ttrack\tartist\r\n\tSong A\tArtist A\r\n"
+            "Album\tSong B\tArtist B\r\n")
+        self.assertEqual(items, [("Song A", "Artist A"),
+                                 ("Song B", "Artist B")])
+
+    def test_csv_quoted_newline(self):
+        items = self.write_items(
+            "songs.csv", 'track,artist\r\n"Song, with\nnewline",Artist\r\n')
+        self.assertEqual(items, [("Song, with\nnewline", "Artist")])
+
+
+class TestParsePlaylists(unittest.TestCase):
+    """Test parsing files ahead of time on a process pool."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        contents = {"a.txt": "Name: A\nOne---X\n", "b.txt": "Two---Y\n",
+                    "c.json": "{not json"}
+        for filename, content in contents.items():
+            with open(os.path.join(self.tempdir.name, filename), "w") as f:
+                f.write(content)
+        self.playlists = read_file.get_playlists(self.tempdir.name)
+
+    @mock.patch(READFILE + ".MIN_PARALLEL_FILES", 1)
+    @mock.patch(READFILE + ".PARSE_GROUP_SIZE", 2)
+    def test_parse_playlists(self):
+        read_file.parse_playlists(self.playlists, "---", "track artist", 2)
+        first, second, broken = self.playlists
+        self.assertEqual(first.parsed, ("A", (("One", "X"),)))
+        self.assertEqual(second.playlist_name(), "b.txt")
+        self.assertEqual(second.playlist_items("---", "track artist"),
+                         [("Two", "Y")])
+        # Unreadable files are left to fail while being converted
+        self.assertIsNone(broken.parsed)
+        with self.assertRaises(ValueError):
+            broken.playlist_name()
+
+    def test_parse_playlists_few_files(self):
+        read_file.parse_playlists(self.playlists, "---", "track artist", 2)
+        self.assertTrue(all(playlist.parsed is None
+                            for playlist in self.playlists))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,260 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import requests
+from playlist_converter import client, scheduler
+
+
+class FakeClock:
+    """Clock whose sleep advances time instantly."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """Sends the status codes queued on the server, then succeeds."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.hits += 1
+            status, headers = (self.server.responses.pop(0)
+                               if self.server.responses else (200, {}))
+        body = json.dumps({"ok": status == 200}).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRequestSchedulerServer(unittest.TestCase):
+    """Test the scheduler against a local server that throttles requests."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingHandler)
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        host, port = cls.server.server_address[:2]
+        cls.url = "http://{}:{}/v1/search".format(host, port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.hits = 0
+        self.server.responses = []
+        self.clock = FakeClock()
+        self.instance = scheduler.RequestScheduler(
+            4, 0, 3, clock=self.clock, sleep=self.clock.sleep)
+        self.session = client.make_session(1)
+        self.addCleanup(self.session.close)
+
+    def send(self):
+        request_args = {"url": self.url}
+        return client.send_request("GET", request_args, self.session)
+
+    def test_honours_retry_after(self):
+        self.server.responses = [(429, {"Retry-After": "7"})]
+        result = self.instance.run(self.send)
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(self.server.hits, 2)
+        self.assertEqual(self.clock.sleeps, [7.0])
+        self.assertEqual(self.instance.limit.limit, 2)
+        self.assertEqual(self.instance.retries, 1)
+
+    def test_retries_server_errors(self):
+        self.server.responses = [(503, {}), (500, {})]
+        self.assertEqual(self.instance.run(self.send), {"ok": True})
+        self.assertEqual(self.server.hits, 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.responses = [(500, {})] * 4
+        with self.assertRaises(requests.HTTPError):
+            self.instance.run(self.send)
+        self.assertEqual(self.server.hits, 4)
+
+    def test_client_errors_not_retried(self):
+        self.server.responses = [(401, {})]
+        with self.assertRaises(requests.HTTPError):
+            self.instance.run(self.send)
+        self.assertEqual(self.server.hits, 1)
+        self.assertFalse(self.clock.sleeps)
+
+
+    def test_server_errors_not_retried_unless_idempotent(self):
+        self.server.responses = [(502, {})]
+        with self.assertRaises(requests.HTTPError):
+            self.instance.run(self.send, idempotent=False)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_applied_request_not_retried(self):
+        self.server.responses = [(502, {})]
+        result = self.instance.run(
+            self.send, idempotent=False, applied=lambda: {"ok": "applied"})
+        self.assertEqual(result, {"ok": "applied"})
+        self.assertEqual(self.server.hits, 1)
+
+    def test_unapplied_request_retried(self):
+        self.server.responses = [(502, {})]
+        result = self.instance.run(
+            self.send, idempotent=False, applied=lambda: None)
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(self.server.hits, 2)
+
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    """Adds posted tracks to one playlist, then answers the queued status."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        uris = json.loads(self.rfile.read(length))["uris"]
+        with self.server.lock:
+            self.server.tracks.extend(uris)
+            status = (self.server.responses.pop(0)
+                      if self.server.responses else 201)
+        self.reply(status, {"snapshot_id": self.snapshot_id()})
+
+    def do_GET(self):
+        with self.server.lock:
+            state = {"snapshot_id": self.snapshot_id(),
+                     "tracks": {"total": len(self.server.tracks)}}
+        self.reply(200, state)
+
+    def snapshot_id(self):
+        return "snap{}".format(len(self.server.tracks))
+
+    def reply(self, status, state):
+        body = json.dumps(state).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestClientRetriesServer(unittest.TestCase):
+    """Test that a POST carried out before a server error isn't repeated."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PlaylistHandler)
+        self.server.lock = threading.Lock()
+        self.server.tracks = []
+        self.server.responses = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        base = "http://{}:{}/v1/playlists/{{}}".format(
+            *self.server.server_address[:2])
+        for name, url in (("PLAYLIST_STATE_URL", base),
+                          ("ADD_TRACK_URL", base + "/tracks")):
+            patcher = mock.patch.object(client, name, url)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.instance = client.SpotifyClient("token", "user")
+        self.instance.scheduler.sleep = lambda seconds: None
+        self.addCleanup(self.instance.close)
+
+    def test_applied_batch_not_posted_again(self):
+        self.server.responses = [502]
+        snapshot_id = self.instance.post_playlist_tracks(
+            "pid", ["spotify:track:a", "spotify:track:b"], posted=0)
+        self.assertEqual(self.server.tracks,
+                         ["spotify:track:a", "spotify:track:b"])
+        self.assertEqual(snapshot_id, "snap2")
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test that the token bucket spaces out calls past its burst size."""
+
+    def test_acquire_waits_when_empty(self):
+        clock = FakeClock()
+        bucket = scheduler.TokenBucket(2, clock=clock, sleep=clock.sleep)
+        for _ in range(6):
+            bucket.acquire()
+        # Two calls go through at once, then one every half second
+        self.assertAlmostEqual(clock.now, 2.0)
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+    """Test how the concurrency limit reacts to throttling and success."""
+
+    def test_throttle_halves_limit(self):
+        limit = scheduler.AdaptiveLimit(8)
+        limit.on_throttle()
+        self.assertEqual(limit.limit, 4)
+        for _ in range(5):
+            limit.on_throttle()
+        self.assertEqual(limit.limit, 1)
+
+    def test_success_grows_limit_back(self):
+        limit = scheduler.AdaptiveLimit(4)
+        limit.on_throttle()
+        for _ in range(2):
+            limit.on_success()
+        self.assertEqual(limit.limit, 3)
+        for _ in range(10):
+            limit.on_success()
+        self.assertEqual(limit.limit, 4)
+
+
+class TestSchedulerHelpers(unittest.TestCase):
+    """Test the helper functions from the scheduler module."""
+
+    def response_with(self, headers):
+        response = mock.create_autospec(requests.Response, instance=True)
+        response.headers = headers
+        return response
+
+    def test_retry_after_seconds(self):
+        response = self.response_with({"Retry-After": "3"})
+        self.assertEqual(scheduler.retry_after(response), 3.0)
+
+    def test_retry_after_date(self):
+        past = "Wed, 21 Oct 2015 07:28:00 GMT"
+        response = self.response_with({"Retry-After": past})
+        self.assertEqual(scheduler.retry_after(response), 0.0)
+
+    def test_retry_after_missing_or_invalid(self):
+        self.assertIsNone(scheduler.retry_after(self.response_with({})))
+        response = self.response_with({"Retry-After": "soon"})
+        self.assertIsNone(scheduler.retry_after(response))
+
+    def test_backoff_delay_bounds(self):
+        for attempt in range(10):
+            delay = scheduler.backoff_delay(attempt)
+            ceiling = min(scheduler.BACKOFF_MAX,
+                          scheduler.BACKOFF_BASE * 2 ** attempt)
+            self.assertTrue(0 <= delay <= ceiling)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from playlist_converter import sync
+
+
+class TestSyncState(unittest.TestCase):
+    """Test saving and loading the playlists made from each file."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = os.path.join(self.tempdir.name, "state.json")
+
+    def test_load_missing(self):
+        state = sync.SyncState(self.path)
+        state.load()
+        self.assertIsNone(state.get("songs.txt"))
+
+    def test_save_then_load(self):
+        state = sync.SyncState(self.path)
+        hashes = sync.item_hashes([("Track", "Artist")])
+        state.set("songs.txt", "abc", "pid", hashes, ["id1"])
+        state.save()
+        reloaded = sync.SyncState(self.path)
+        reloaded.load()
+        record = reloaded.get("songs.txt")
+        self.assertEqual(record["hash"], "abc")
+        self.assertEqual(record["playlist_id"], "pid")
+        self.assertEqual(record["item_hashes"], hashes)
+        self.assertEqual(record["track_ids"], ["id1"])
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_load_records_with_items(self):
+        # State written when records kept each line's text
+        with open(self.path, "w") as f:
+            f.write('{"songs.txt": {"hash": "abc", "playlist_id": "pid", '
+                    '"items": [["Track", "Artist"]], "track_ids": ["id1"], '
+                    '"fingerprint": null}}')
+        state = sync.SyncState(self.path)
+        state.load()
+        record = state.get("songs.txt")
+        self.assertNotIn("items", record)
+        self.assertEqual(list(record["item_hashes"]),
+                         [sync.item_hash(("Track", "Artist"))])
+
+    def test_fingerprints(self):
+        state = sync.SyncState(self.path)
+        state.set("a.txt", "abc", "pid", [], [], [10, 1.5])
+        state.set("b.txt", "def", "pid", [], [])
+        self.assertEqual(state.fingerprints(), {"a.txt": [10, 1.5]})
+
+
+class TestSyncHelpers(unittest.TestCase):
+    """Test the helper functions from the sync module."""
+
+    def test_content_hash(self):
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "songs.txt")
+            with open(path, "w") as f:
+                f.write("Track---Artist\n")
+            first = sync.content_hash(path)
+            self.assertEqual(first, sync.content_hash(path))
+            with open(path, "a") as f:
+                f.write("Track 2---Artist\n")
+            self.assertNotEqual(first, sync.content_hash(path))
+
+    def test_item_hash(self):
+        self.assertEqual(sync.item_hash(["a", "x"]),
+                         sync.item_hash(("a", "x")))
+        self.assertNotEqual(sync.item_hash(("a", "x")),
+                            sync.item_hash(("x", "a")))
+        self.assertLess(sync.item_hash(("a", "x")), 2 ** 64)
+
+    def test_diff_items(self):
+        old = sync.item_hashes([["a", "x"], ["b", "x"], ["c", "x"]])
+        new = sync.item_hashes([("a", "x"), ("c", "x"), ("d", "x")])
+        opcodes = sync.diff_items(old, new)
+        tags = [opcode[0] for opcode in opcodes]
+        self.assertEqual(tags, ["equal", "delete", "equal", "insert"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from playlist_converter import watch
+from playlist_converter.journal import file_fingerprint
+
+
+class TestDirectoryWatcher(unittest.TestCase):
+    """Test finding files created or changed between polls."""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = self.tempdir.name
+        self.path = self.write("songs.txt", "Track---Artist\n")
+
+    def write(self, filename, text):
+        path = os.path.join(self.root, filename)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def filenames(self, watcher):
+        return [playlist.filename for playlist in watcher.poll()]
+
+    def test_new_file_waits_until_settled(self):
+        watcher = watch.DirectoryWatcher(self.root)
+        self.assertEqual(self.filenames(watcher), [])
+        self.assertEqual(self.filenames(watcher), ["songs.txt"])
+        self.assertEqual(self.filenames(watcher), [])
+
+    def test_file_still_changing_waits(self):
+        watcher = watch.DirectoryWatcher(self.root)
+        watcher.poll()
+        self.write("songs.txt", "Track---Artist\nOther---Artist\n")
+        self.assertEqual(self.filenames(watcher), [])
+        self.assertEqual(self.filenames(watcher), ["songs.txt"])
+
+    def test_known_files_skipped_until_changed(self):
+        known = {self.path: file_fingerprint(self.path)}
+        watcher = watch.DirectoryWatcher(self.root, known=known)
+        self.assertEqual(self.filenames(watcher), [])
+        self.assertEqual(self.filenames(watcher), [])
+        self.write("songs.txt", "Other---Artist\nTrack---Artist\n")
+        watcher.poll()
+        self.assertEqual(self.filenames(watcher), ["songs.txt"])
+
+    def test_globs(self):
+        self.write("cover.jpg", "")
+        self.write("mix.m3u8", "")
+        watcher = watch.DirectoryWatcher(self.root, exclude=["*.txt"])
+        watcher.poll()
+        self.assertEqual(self.filenames(watcher), ["mix.m3u8"])
+
+    def test_forget(self):
+        watcher = watch.DirectoryWatcher(self.root)
+        watcher.poll()
+        watcher.poll()
+        watcher.forget(self.path)
+        watcher.poll()
+        self.assertEqual(self.filenames(watcher), ["songs.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()